@@ -0,0 +1,110 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+from database import query
+
+# Admin user list: keyset pages over Users ordered by one indexed column plus
+# id, with login counts kept on Users (see audit.py) and transaction counts
+# read from TransactionRollup for just the users on the page. Nothing here
+# scans LoginHistory or Transactions, so a page costs the same at 1M users.
+
+SORT_COLUMNS = {
+    'last_login':  'last_login',
+    'created_at':  'created_at',
+    'name':        'name',
+    'logins':      'login_count',
+}
+
+
+def encode_cursor(value, uid):
+    return base64.urlsafe_b64encode(json.dumps([value, uid], default=str).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (sort value, id) from encode_cursor(); raises ValueError if malformed."""
+    try:
+        value, uid = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return value, int(uid)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def _after(col, desc, value, uid):
+    """
+    WHERE clause for rows after (value, uid) in ORDER BY col, id (both
+    ascending or both descending). MySQL sorts NULLs first ascending and
+    last descending, so a NULL sort value needs its own branch.
+    """
+    op = '<' if desc else '>'
+    if value is None:
+        if desc:
+            return f"({col} IS NULL AND id < %s)", [uid]
+        return f"(({col} IS NULL AND id > %s) OR {col} IS NOT NULL)", [uid]
+    cond = f"({col} {op} %s OR ({col} = %s AND id {op} %s)"
+    return cond + (f" OR {col} IS NULL)" if desc else ")"), [value, value, uid]
+
+
+USERS_PAGE_SQL = """
+    SELECT id, name, email, created_at, last_login, login_count
+    FROM Users
+    {where}
+    ORDER BY {col} {order}, id {order}
+    LIMIT %s
+"""
+
+TXN_COUNTS_SQL = "SELECT user_id, SUM(txn_count) FROM TransactionRollup WHERE user_id IN ({ids}) GROUP BY user_id"
+
+
+def list_users(cursor=None, limit=50, sort='last_login', desc=True, search=None):
+    """
+    One page of users with their login and transaction counts.
+    `search` is a prefix match on email or name. Returns (rows, next_cursor or None).
+    """
+    if sort not in SORT_COLUMNS:
+        raise ValueError(f"sort must be one of {', '.join(SORT_COLUMNS)}")
+    col = SORT_COLUMNS[sort]
+    where, params = [], []
+    if cursor:
+        cond, values = _after(col, desc, *decode_cursor(cursor))
+        where.append(cond)
+        params += values
+    if search:
+        prefix = search.replace('\\', '\\\\').replace('%', r'\%').replace('_', r'\_') + '%'
+        where.append("(email LIKE %s OR name LIKE %s)")
+        params += [prefix, prefix]
+    order = 'DESC' if desc else 'ASC'
+
+    rows = query(
+        USERS_PAGE_SQL.format(where='WHERE ' + ' AND '.join(where) if where else '', col=col, order=order),
+        tuple(params) + (limit + 1,), fetch=True
+    )
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][col], rows[-1]['id'])
+
+    if rows:
+        ids = [r['id'] for r in rows]
+        counts = dict(query(TXN_COUNTS_SQL.format(ids=', '.join(['%s'] * len(ids))), tuple(ids), fetch='tuples'))
+        for r in rows:
+            r['transaction_count'] = int(counts.get(r['id']) or 0)
+    return rows, next_cursor
+
+
+def summary(now=None):
+    """Headline numbers: total users, active today / this week, sign-ups per day (30 days)."""
+    now = now or datetime.now()
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    total, active_today, active_week = query(
+        """SELECT (SELECT COUNT(*) FROM Users),
+                  (SELECT COUNT(*) FROM Users WHERE last_login >= %s),
+                  (SELECT COUNT(*) FROM Users WHERE last_login >= %s)""",
+        (today, today - timedelta(days=7)), fetch='tuples')[0]
+    users_by_date = query(
+        """SELECT DATE(created_at) as date, COUNT(*) as count FROM Users
+           WHERE created_at >= %s GROUP BY DATE(created_at) ORDER BY date DESC""",
+        (today - timedelta(days=29),), fetch=True
+    )
+    return {'total_users': total, 'active_today': active_today, 'active_week': active_week,
+            'users_by_date': users_by_date}
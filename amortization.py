@@ -0,0 +1,139 @@
+from datetime import date
+
+import numpy as np
+
+# Month-by-month loan schedules computed for many loans at once. Loans are
+# rows, months are columns: every function takes 1-D arrays (one value per
+# loan) and returns (loans × months) arrays, so 10k loans × 360 months is a
+# handful of array operations rather than 3.6M Python iterations.
+#
+# Rates are annual percentages, as stored in Loans.rate; tenures are months.
+#   - a prepayment is paid on top of that month's EMI; the EMI stays the same
+#     and the loan finishes early
+#   - a rate change applies from its month on; the EMI is recomputed so the
+#     balance is still repaid by the original last month
+
+
+def emi(principal, annual_rate, months):
+    """Level monthly instalment(s) that repay `principal` in `months`."""
+    p = np.asarray(principal, dtype=float)
+    r = np.asarray(annual_rate, dtype=float) / 1200
+    n = np.asarray(months, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = (1 + r) ** n
+        level = p * r * growth / (growth - 1)
+    return np.where(r == 0, p / np.maximum(n, 1), level)
+
+
+def _closed_form(principal, annual_rate, months, width):
+    """Schedules without prepayments or rate changes, straight from the annuity formula."""
+    r = annual_rate / 1200
+    e = emi(principal, annual_rate, months)
+    k = np.arange(width + 1, dtype=float)
+    # balance after k months = P(1+r)^k - E((1+r)^k - 1)/r = (1+r)^k (P - E/r) + E/r,
+    # evaluated in place: a few passes over the (loans × months) grid in total
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c = np.where(r == 0, 0, e / r)
+    balance = np.multiply.outer(np.log1p(r), k)
+    np.exp(balance, out=balance)
+    balance *= (principal - c)[:, None]
+    balance += c[:, None]
+    flat = r == 0
+    if flat.any():
+        balance[flat] = principal[flat, None] - np.multiply.outer(e[flat], k)
+    np.clip(balance, 0, None, out=balance)
+    balance[k >= months[:, None]] = 0
+    opening = balance[:, :-1]
+    interest = opening * r[:, None]
+    principal_paid = opening - balance[:, 1:]
+    return interest, principal_paid, np.zeros_like(interest), balance[:, 1:]
+
+
+def _stepwise(principal, months, rates, extra):
+    """Schedules with per-month rates (loans × months) and extra payments, one vector step per month."""
+    n, width = rates.shape
+    interest = np.zeros((n, width))
+    principal_paid = np.zeros((n, width))
+    prepaid = np.zeros((n, width))
+    balance = np.zeros((n, width))
+    bal = principal.astype(float)
+    instalment = emi(principal, rates[:, 0], months)
+    for k in range(width):
+        r = rates[:, k] / 1200
+        if k:
+            changed = rates[:, k] != rates[:, k - 1]
+            if changed.any():
+                remaining = np.maximum(months - k, 1)
+                instalment = np.where(changed, emi(bal, rates[:, k], remaining), instalment)
+        live = (bal > 0.005) & (k < months)
+        interest[:, k] = np.where(live, bal * r, 0)
+        principal_paid[:, k] = np.where(live, np.minimum(instalment - bal * r, bal), 0)
+        # the last scheduled month settles whatever is left
+        principal_paid[:, k] = np.where(live & (k == months - 1), bal, principal_paid[:, k])
+        bal = bal - principal_paid[:, k]
+        prepaid[:, k] = np.where(live, np.minimum(extra[:, k], bal), 0)
+        bal = bal - prepaid[:, k]
+        balance[:, k] = bal
+    return interest, principal_paid, prepaid, balance
+
+
+def schedules(principal, annual_rate, months, prepayments=None, rate_changes=None):
+    """
+    Amortization schedules for many loans.
+    principal, annual_rate, months: one value per loan.
+    prepayments:  {loan index: {month number (1-based): amount}}
+    rate_changes: {loan index: {month number (1-based): new annual rate}}
+    Returns a dict of (loans × max months) arrays – interest, principal,
+    prepaid, payment, balance – plus `emi` (first instalment per loan).
+    Months after a loan is repaid are zero.
+    """
+    principal = np.atleast_1d(np.asarray(principal, dtype=float))
+    annual_rate = np.atleast_1d(np.asarray(annual_rate, dtype=float))
+    months = np.atleast_1d(np.asarray(months, dtype=int))
+    width = int(months.max()) if months.size else 0
+
+    if prepayments or rate_changes:
+        rates = np.repeat(annual_rate[:, None], width, axis=1)
+        for i, changes in (rate_changes or {}).items():
+            for month, rate in sorted(changes.items()):
+                rates[i, max(int(month) - 1, 0):] = rate
+        extra = np.zeros((len(principal), width))
+        for i, payments in (prepayments or {}).items():
+            for month, amount in payments.items():
+                if 1 <= int(month) <= width:
+                    extra[i, int(month) - 1] += amount
+        interest, principal_paid, prepaid, balance = _stepwise(principal, months, rates, extra)
+    else:
+        interest, principal_paid, prepaid, balance = _closed_form(principal, annual_rate, months, width)
+
+    return {
+        'emi': emi(principal, annual_rate, months),
+        'interest': interest,
+        'principal': principal_paid,
+        'prepaid': prepaid,
+        'payment': interest + principal_paid + prepaid,
+        'balance': balance,
+    }
+
+
+def summarize(result):
+    """Per loan: total interest, total paid and the number of months with a payment."""
+    paying = result['payment'] > 0.005
+    return {
+        'total_interest': result['interest'].sum(axis=1),
+        'total_paid': result['payment'].sum(axis=1),
+        'months': paying.sum(axis=1),
+    }
+
+
+def due_dates(start, count):
+    """
+    The `count` monthly due dates after `start`, on the same day of the
+    month (clamped to the month's last day, e.g. Jan 31 → Feb 28/29).
+    """
+    first = np.datetime64(start, 'M')
+    month_starts = first + np.arange(1, count + 1)
+    month_lengths = ((month_starts + 1).astype('datetime64[D]') - month_starts.astype('datetime64[D]')).astype(int)
+    days = np.minimum(start.day, month_lengths) - 1
+    dues = month_starts.astype('datetime64[D]') + days
+    return [date.fromisoformat(str(d)) for d in dues]
@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+from database import query
+
+# Every section of the analysis page is one branch of a UNION ALL, so the
+# whole payload costs a single round trip. Transaction totals come from the
+# monthly rollup. All branches share one column layout:
+#   section, label, month, kind, ref, cnt, v1, v2, v3
+# The rows (plain tuples) are sorted into their sections in Python.
+ANALYSIS_SQL = """
+    (SELECT 'transactions' AS section, c.name AS label, r.month AS month, r.type AS kind,
+            r.category_id AS ref, r.txn_count AS cnt, r.total AS v1, NULL AS v2, NULL AS v3
+       FROM TransactionRollup r
+       LEFT JOIN Categories c ON r.category_id=c.id
+      WHERE r.user_id=%s AND r.month >= %s AND r.txn_count > 0)
+    UNION ALL
+    (SELECT 'accounts', type, NULL, NULL, NULL, COUNT(*), SUM(balance), NULL, NULL
+       FROM Accounts WHERE user_id=%s GROUP BY type)
+    UNION ALL
+    (SELECT 'investments', type, NULL, NULL, NULL, COUNT(*), SUM(current_val), NULL, NULL
+       FROM Investments WHERE user_id=%s GROUP BY type)
+    UNION ALL
+    (SELECT 'bills', category, NULL, NULL, NULL, COUNT(*), SUM(amount), NULL, NULL
+       FROM Bills WHERE user_id=%s GROUP BY category ORDER BY SUM(amount) DESC LIMIT 10)
+    UNION ALL
+    (SELECT 'subscriptions', name, NULL, NULL, NULL, 1, amount, NULL, NULL
+       FROM Subscriptions WHERE user_id=%s ORDER BY amount DESC LIMIT 10)
+    UNION ALL
+    (SELECT 'trips', t.destination, NULL, NULL, NULL, 1, COALESCE(SUM(te.amount), 0), NULL, NULL
+       FROM Trips t
+       LEFT JOIN TripExpenses te ON te.trip_id = t.id
+      WHERE t.user_id=%s
+      GROUP BY t.id, t.destination
+      ORDER BY COALESCE(SUM(te.amount), 0) DESC LIMIT 10)
+    UNION ALL
+    (SELECT 'loans', loan_name, NULL, NULL, NULL, 1, principal, emi, total_int
+       FROM Loans WHERE user_id=%s ORDER BY principal DESC LIMIT 10)
+    UNION ALL
+    (SELECT 'budgets', c.name, NULL, NULL, NULL, 1, b.amount, NULL, NULL
+       FROM Budgets b
+       LEFT JOIN Categories c ON b.category_id=c.id
+      WHERE b.user_id=%s
+      ORDER BY b.amount DESC LIMIT 10)
+"""
+
+
+def _num(v):
+    return float(v) if v else 0
+
+
+def _month_window(today):
+    """Last 12 month keys (oldest first) with labels, and the range start date."""
+    months_data = {}
+    for i in range(11, -1, -1):
+        month_date = today - timedelta(days=30*i)
+        months_data[month_date.strftime('%Y-%m')] = {
+            'label': month_date.strftime('%b %Y'), 'income': 0, 'expense': 0
+        }
+    start_date = (today - timedelta(days=365)).strftime('%Y-%m-01')
+    return months_data, start_date
+
+
+def _ranked(rows):
+    """(label, cnt, v1, v2, v3) rows sorted by v1, largest first (stable for ties)."""
+    return sorted(rows, key=lambda r: _num(r[2]), reverse=True)
+
+
+def build_analysis(user_id, today=None):
+    """Return the full /api/analysis payload for a user in one query."""
+    months_data, start_date = _month_window(today or datetime.now())
+
+    rows = query(ANALYSIS_SQL, (user_id, start_date[:7]) + (user_id,) * 7, fetch='tuples') or []
+    sections = {}
+    by_cat = {'income': {}, 'expense': {}}
+    for section, label, month, kind, ref, cnt, v1, v2, v3 in rows:
+        if section != 'transactions':
+            sections.setdefault(section, []).append((label, cnt, v1, v2, v3))
+            continue
+        # Transactions: month totals plus per-category totals over the window
+        total = _num(v1)
+        if month in months_data:
+            months_data[month][kind] += total
+        cats = by_cat[kind]
+        name, acc = cats.get(ref, (label, 0))
+        cats[ref] = (name, acc + total)
+
+    months, income, expense, savings = [], [], [], []
+    for month_key in sorted(months_data):
+        data = months_data[month_key]
+        months.append(data['label'])
+        income.append(data['income'])
+        expense.append(data['expense'])
+        savings.append(data['income'] - data['expense'])
+
+    income_by_cat  = sorted(by_cat['income'].values(),  key=lambda c: c[1], reverse=True)
+    expense_by_cat = sorted(by_cat['expense'].values(), key=lambda c: c[1], reverse=True)
+
+    accounts      = sections.get('accounts', [])
+    investments   = _ranked(sections.get('investments', []))
+    bills         = _ranked(sections.get('bills', []))
+    subscriptions = _ranked(sections.get('subscriptions', []))
+    trips         = _ranked(sections.get('trips', []))
+    loans         = _ranked(sections.get('loans', []))
+    budgets       = [b for b in _ranked(sections.get('budgets', [])) if b[0]]
+
+    return {
+        'months': months, 'income': income, 'expense': expense, 'savings': savings,
+        'income_categories': [n or 'Uncategorized' for n, _ in income_by_cat],
+        'income_values': [v for _, v in income_by_cat],
+        'expense_categories': [n or 'Uncategorized' for n, _ in expense_by_cat],
+        'expense_values': [v for _, v in expense_by_cat],
+        'account_types': [a[0].upper() if a[0] else 'Unknown' for a in accounts],
+        'account_values': [_num(a[2]) for a in accounts],
+        'inv_types': [i[0] or 'Other' for i in investments],
+        'inv_counts': [int(i[1]) for i in investments],
+        'inv_values': [_num(i[2]) for i in investments],
+        'bill_categories': [b[0] or 'Other' for b in bills],
+        'bill_counts': [int(b[1]) for b in bills],
+        'bill_values': [_num(b[2]) for b in bills],
+        'subscription_names': [s[0][:15] for s in subscriptions],
+        'subscription_values': [_num(s[2]) for s in subscriptions],
+        'trip_names': [t[0][:15] for t in trips],
+        'trip_values': [_num(t[2]) for t in trips],
+        'loan_names': [l[0][:15] for l in loans],
+        'loan_principals': [_num(l[2]) for l in loans],
+        'loan_emis': [_num(l[3]) for l in loans],
+        'loan_interests': [_num(l[4]) for l in loans],
+        'budget_categories': [b[0][:15] for b in budgets],
+        'budget_values': [_num(b[2]) for b in budgets],
+    }
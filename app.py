@@ -1,16 +1,27 @@
 from flask import Flask
-from config import SECRET_KEY
+from config import SECRET_KEY, RECURRING_SCHEDULER
 from models import create_tables
 from auth import auth_bp
 from routes import routes_bp
+from commands import register_commands
+from json_provider import MoneyMapJSONProvider
+import recurring
 
 app = Flask(__name__)
 app.secret_key = SECRET_KEY
+app.json = MoneyMapJSONProvider(app)    # Decimal/date aware jsonify()
 
 # Register blueprints
 app.register_blueprint(auth_bp)
 app.register_blueprint(routes_bp)
 
+# CLI: flask --app app <command>
+register_commands(app)
+
+# Post due bills/subscriptions in the background (otherwise: `flask recurring post` from cron)
+if RECURRING_SCHEDULER:
+    recurring.start_scheduler()
+
 if __name__ == '__main__':
     print("🚀 Starting MoneyMap...")
     create_tables()
@@ -0,0 +1,139 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from mysql.connector import IntegrityError
+
+from database import query, query_many, transaction
+from config import AUDIT_FLUSH_INTERVAL, AUDIT_BATCH_SIZE, AUDIT_MAX_PENDING, AUDIT_RETRY_MAX
+
+# Write-behind buffer for login audit rows. A login only enqueues an event;
+# a background thread writes them every AUDIT_FLUSH_INTERVAL seconds or as
+# soon as AUDIT_BATCH_SIZE are waiting, as one multi-row LoginHistory insert
+# plus one Users update (last login times, login_count) covering every user
+# in the batch. The queue holds at most AUDIT_MAX_PENDING events: when it is
+# full the login writes its own event synchronously, so memory stays bounded
+# and nothing is dropped.
+#
+# A batch that fails to write is kept and retried, backing off up to
+# AUDIT_RETRY_MAX seconds while the database is unavailable. A batch that
+# breaks a constraint (a user deleted since logging in) is written again
+# user by user, and only the events of the failing users are dropped.
+
+_queue = None
+_wakeup = None
+_pid = None
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_pending = []       # the batch being written; what is left of it after a failure
+
+
+def _start():
+    """Start the flusher in this process (again after a fork)."""
+    global _queue, _wakeup, _pid
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _queue, _wakeup, _pid = queue.Queue(maxsize=AUDIT_MAX_PENDING), threading.Event(), os.getpid()
+        threading.Thread(target=_flush_loop, name='audit-flush', daemon=True).start()
+
+
+def record_login(user_id, ip_address, when=None):
+    """Queue a login (LoginHistory row + Users.last_login/last_activity)."""
+    _start()
+    event = (user_id, ip_address, when or datetime.now())
+    try:
+        _queue.put_nowait(event)
+    except queue.Full:
+        write([event])
+        return
+    if _queue.qsize() >= AUDIT_BATCH_SIZE:
+        _wakeup.set()
+
+
+def write(events):
+    """Write login events now: one multi-row insert and one coalesced Users update."""
+    if not events:
+        return
+    latest, logins = {}, {}
+    for user_id, _, when in events:
+        latest[user_id] = max(when, latest.get(user_id, when))
+        logins[user_id] = logins.get(user_id, 0) + 1
+    case = ' '.join(['WHEN %s THEN %s'] * len(latest))
+    times = [v for item in latest.items() for v in item]
+    counts = [v for item in logins.items() for v in item]
+    with transaction():
+        query_many("INSERT INTO LoginHistory (user_id, ip_address, login_time) VALUES (%s,%s,%s)", events)
+        query(f"""UPDATE Users
+                  SET last_login = CASE id {case} END, last_activity = CASE id {case} END,
+                      login_count = login_count + CASE id {case} END
+                  WHERE id IN ({', '.join(['%s'] * len(latest))})""",
+              tuple(times + times + counts + list(latest)))
+
+
+def _drain(limit=None):
+    events = []
+    while limit is None or len(events) < limit:
+        try:
+            events.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    return events
+
+
+def _write_pending():
+    """Write _pending, emptying it as its events are written."""
+    global _pending
+    try:
+        write(_pending)
+        _pending = []
+        return
+    except IntegrityError:
+        pass
+    by_user = {}
+    for event in _pending:
+        by_user.setdefault(event[0], []).append(event)
+    for user_id, events in by_user.items():
+        try:
+            write(events)
+        except IntegrityError as e:
+            print(f"Audit: {len(events)} login events of user {user_id} dropped: {e}", flush=True)
+        _pending = [event for event in _pending if event[0] != user_id]
+
+
+def flush():
+    """
+    Write everything queued so far (also run at interpreter exit). Returns
+    False if a batch could not be written; it is kept for the next flush.
+    """
+    global _pending
+    if _pid != os.getpid():
+        return True
+    with _flush_lock:
+        while True:
+            if not _pending:
+                _pending = _drain(AUDIT_BATCH_SIZE)
+                if not _pending:
+                    return True
+            try:
+                _write_pending()
+            except Exception as e:
+                print(f"Audit flush error, {len(_pending)} login events kept for a retry: {e}", flush=True)
+                return False
+
+
+def _flush_loop():
+    delay = 0
+    while True:
+        if delay:
+            time.sleep(delay)
+        else:
+            _wakeup.wait(AUDIT_FLUSH_INTERVAL)
+        _wakeup.clear()
+        delay = 0 if flush() else min(max(delay * 2, AUDIT_FLUSH_INTERVAL), AUDIT_RETRY_MAX)
+
+
+atexit.register(flush)
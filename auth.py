@@ -1,70 +1,11 @@
 from flask import Blueprint, request, session, redirect, url_for, render_template, flash
-import bcrypt
-from datetime import datetime
-from database import query
+from database import query, bind_request_scope, release_connection
+from categories import seed_defaults
+from audit import record_login
+from passwords import PoolBusy, check_password, hash_password, needs_rehash
 
 auth_bp = Blueprint('auth', __name__)
-
-
-# ── DEFAULT CATEGORIES + BUDGETS SETUP ─────────────────────────
-def create_default_categories(user_id):
-    """
-    Create default categories AND default budgets for new user.
-    Called on registration. Safe to call multiple times.
-    """
-    try:
-        income_cats = ['Salary', 'Freelance', 'Bonus', 'Investment Returns', 'Gifts', 'Other Income']
-        expense_cats = [
-            'Food & Dining', 'Transportation', 'Shopping', 'Utilities', 'Healthcare',
-            'Entertainment', 'Education', 'Insurance', 'Home & Rent', 'Personal Care',
-            'Phone & Internet', 'Gifts & Donations', 'Other Expense'
-        ]
-
-        for cat in income_cats:
-            try:
-                query("INSERT INTO Categories (user_id, name, type) VALUES (%s, %s, %s)",
-                      (user_id, cat, 'income'))
-            except Exception as e:
-                print(f"Error inserting income category '{cat}': {e}")
-
-        cat_ids = {}
-        for cat in expense_cats:
-            try:
-                cid = query("INSERT INTO Categories (user_id, name, type) VALUES (%s, %s, %s)",
-                            (user_id, cat, 'expense'), lastrowid=True)
-                cat_ids[cat] = cid
-            except Exception as e:
-                print(f"Error inserting expense category '{cat}': {e}")
-
-        # Default budgets for current month
-        current_month = datetime.now().strftime('%Y-%m')
-        default_budgets = {
-            'Food & Dining':     5000,
-            'Transportation':    3000,
-            'Shopping':          4000,
-            'Utilities':         2000,
-            'Healthcare':        2000,
-            'Entertainment':     2000,
-            'Education':         3000,
-            'Insurance':         1500,
-            'Home & Rent':      10000,
-            'Personal Care':     1000,
-            'Phone & Internet':  1000,
-            'Gifts & Donations': 1000,
-            'Other Expense':     2000,
-        }
-        for cat_name, amount in default_budgets.items():
-            cid = cat_ids.get(cat_name)
-            if cid:
-                try:
-                    query("INSERT INTO Budgets (user_id, category_id, month, amount) VALUES (%s,%s,%s,%s)",
-                          (user_id, cid, current_month, amount))
-                except Exception as e:
-                    print(f"Error inserting budget for '{cat_name}': {e}")
-
-        print(f"✅ Default categories + budgets created for user {user_id}")
-    except Exception as e:
-        print(f"❌ Error creating defaults: {e}")
+bind_request_scope(auth_bp)
 
 
 # ── REGISTER ────────────────────────────────────────────────────
@@ -85,7 +26,12 @@ def register():
             flash('Email already registered. Please login.', 'error')
             return render_template('register.html')
 
-        hashed = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+        release_connection()    # not held while bcrypt runs
+        try:
+            hashed = hash_password(password)
+        except PoolBusy as e:
+            flash(str(e), 'error')
+            return render_template('register.html'), 503
         uid = query(
             "INSERT INTO Users (name, email, password) VALUES (%s,%s,%s)",
             (name, email, hashed), lastrowid=True
@@ -94,7 +40,7 @@ def register():
         query("INSERT INTO UserPreferences (user_id) VALUES (%s)", (uid,))
 
         # Create default categories + budgets
-        create_default_categories(uid)
+        seed_defaults(uid)
 
         flash('Registration successful! Please login.', 'success')
         return redirect(url_for('auth.login'))
@@ -113,28 +59,26 @@ def login():
         email    = request.form.get('email', '').strip().lower()
         password = request.form.get('password', '')
 
-        rows = query("SELECT * FROM Users WHERE email=%s", (email,), fetch=True)
+        rows = query("SELECT * FROM Users WHERE email=%s", (email,), fetch=True, prepared=True)
         if not rows:
             flash('Email not found. Please register.', 'error')
             return render_template('login.html')
 
         user = rows[0]
-        if not bcrypt.checkpw(password.encode(), user['password'].encode()):
-            flash('Incorrect password.', 'error')
-            return render_template('login.html')
-
-        # Log the login
-        ip_address = request.remote_addr
-        query(
-            "INSERT INTO LoginHistory (user_id, ip_address) VALUES (%s, %s)",
-            (user['id'], ip_address)
-        )
-
-        # Update last login time
-        query(
-            "UPDATE Users SET last_login=%s, last_activity=%s WHERE id=%s",
-            (datetime.now(), datetime.now(), user['id'])
-        )
+        release_connection()    # not held while bcrypt runs
+        try:
+            if not check_password(password, user['password']):
+                flash('Incorrect password.', 'error')
+                return render_template('login.html')
+            # Work factor changed since this hash was made: upgrade it now we know the password
+            if needs_rehash(user['password']):
+                query("UPDATE Users SET password=%s WHERE id=%s", (hash_password(password), user['id']))
+        except PoolBusy as e:
+            flash(str(e), 'error')
+            return render_template('login.html'), 503
+
+        # Log the login (LoginHistory + last login time), written behind in batches
+        record_login(user['id'], request.remote_addr)
 
         session['user_id'] = user['id']
         session['user_name'] = user['name']
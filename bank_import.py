@@ -0,0 +1,193 @@
+import csv
+import hashlib
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+
+from database import query_many, transaction
+
+CHUNK_ROWS = 1000
+SEEN_DAYS = 62      # days of lines remembered to number identical lines (see import_statement)
+
+INSERT_SQL = """INSERT IGNORE INTO BankTransactions (user_id, description, amount, type, date, row_hash)
+                VALUES (%s,%s,%s,%s,%s,%s)"""
+
+DATE_FORMATS = ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d %b %Y', '%d-%b-%Y', '%Y%m%d')
+
+
+class StatementError(ValueError):
+    """A statement line that cannot be imported."""
+
+
+# ─────────────────────────────────────────────────────────────
+# PARSING (generators – one line in memory at a time)
+# ─────────────────────────────────────────────────────────────
+def _parse_date(text):
+    text = text.strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    raise StatementError(f'unrecognised date {text!r}')
+
+
+def _parse_amount(text):
+    try:
+        return Decimal(text.replace(',', '').replace('₹', '').strip() or '0')
+    except InvalidOperation:
+        raise StatementError(f'unrecognised amount {text!r}')
+
+
+def parse_csv(lines):
+    """
+    Yield (line_no, date, description, amount, type, ref) from a CSV statement.
+    Needs a header with a date and description/narration column plus either a
+    signed `amount` (optionally with a credit/debit `type`) or separate
+    `debit` / `credit` columns.
+    """
+    reader = csv.reader(lines)
+    header = [h.strip().lower() for h in next(reader, [])]
+    col = {name: header.index(name) for name in header}
+    desc_col = next((col[n] for n in ('description', 'narration', 'details', 'particulars') if n in col), None)
+    if 'date' not in col or desc_col is None or not ({'amount'} <= col.keys() or {'debit', 'credit'} & col.keys()):
+        raise StatementError('CSV header needs date, description and amount (or debit/credit) columns')
+
+    for line_no, row in enumerate(reader, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        try:
+            day = _parse_date(row[col['date']])
+            desc = row[desc_col].strip()
+            if 'amount' in col:
+                amount = _parse_amount(row[col['amount']])
+                kind = row[col['type']].strip().lower() if 'type' in col else ''
+                if kind in ('cr', 'credit'):
+                    kind = 'credit'
+                elif kind in ('dr', 'debit'):
+                    kind = 'debit'
+                else:
+                    kind = 'debit' if amount < 0 else 'credit'
+            else:
+                debit = _parse_amount(row[col['debit']]) if 'debit' in col else Decimal(0)
+                credit = _parse_amount(row[col['credit']]) if 'credit' in col else Decimal(0)
+                amount, kind = (debit, 'debit') if debit else (credit, 'credit')
+        except IndexError:
+            raise StatementError(f'line {line_no}: missing columns')
+        except StatementError as e:
+            raise StatementError(f'line {line_no}: {e}')
+        yield line_no, day, desc, abs(amount), kind, None
+
+
+_OFX_TAG = re.compile(r'<(/?)(\w+)>([^<\r\n]*)')
+
+
+def _ofx_transaction(txn, account):
+    try:
+        amount = _parse_amount(txn.get('TRNAMT', ''))
+        day = _parse_date(txn.get('DTPOSTED', '')[:8])
+    except StatementError as e:
+        raise StatementError(f"line {txn['line']}: {e}")
+    desc = txn.get('NAME') or txn.get('MEMO') or ''
+    ref = None
+    if txn.get('FITID'):
+        # A FITID is only unique within its account
+        ref = f"{account.get('BANKID', '')}|{account.get('ACCTID', '')}|{txn['FITID']}"
+    return txn['line'], day, desc, abs(amount), 'debit' if amount < 0 else 'credit', ref
+
+
+def parse_ofx(lines):
+    """
+    Yield (line_no, date, description, amount, type, ref) from an OFX/QFX
+    statement, one <STMTTRN> block at a time (SGML or XML flavour, any
+    number of blocks per line). The bank's FITID, qualified by the
+    BANKID/ACCTID of the statement's account, is used as the natural key.
+    A <STMTTRN> still open at the end of the file is reported: the file
+    was cut short.
+    """
+    txn, account = None, {}
+    for line_no, line in enumerate(lines, start=1):
+        for closing, tag, value in _OFX_TAG.findall(line):
+            tag, value = tag.upper(), value.strip()
+            if tag == 'STMTTRN':
+                if txn is not None:
+                    yield _ofx_transaction(txn, account)
+                txn = None if closing else {'line': line_no}
+            elif txn is not None:
+                if value and not closing:
+                    txn[tag] = value
+            elif tag in ('BANKACCTFROM', 'CCACCTFROM') and not closing:
+                account = {}
+            elif tag in ('BANKID', 'ACCTID') and value:
+                account[tag] = value
+    if txn is not None:
+        raise StatementError(f"line {txn['line']}: <STMTTRN> is never closed (file cut short?)")
+
+
+def detect_format(first_line, filename=''):
+    if filename.lower().endswith(('.ofx', '.qfx')):
+        return 'ofx'
+    head = first_line.lstrip('\ufeff').strip().upper()
+    return 'ofx' if head.startswith(('OFXHEADER', '<OFX', '<?XML')) else 'csv'
+
+
+# ─────────────────────────────────────────────────────────────
+# IMPORT
+# ─────────────────────────────────────────────────────────────
+def row_hash(user_id, day, desc, amount, kind, ref, occurrence):
+    """
+    Hashed natural key of a statement line: the account-qualified FITID when
+    the bank gave one (`ref`), else the line's contents. Identical lines
+    within one file are told apart by their occurrence number, so re-importing
+    the same file (or an overlapping one) skips them but genuine repeats are kept.
+    """
+    if ref:
+        key = f'{user_id}|fitid|{ref}'
+    else:
+        key = f"{user_id}|{day}|{amount:.2f}|{kind}|{' '.join(desc.lower().split())}|{occurrence}"
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def import_statement(user_id, lines, fmt='csv', progress=None):
+    """
+    Import a CSV or OFX statement into BankTransactions.
+    Lines are parsed as a stream and inserted in multi-row batches of
+    CHUNK_ROWS, one transaction per batch (or the caller's transaction).
+    Already-imported lines are skipped through the (user_id, row_hash) key.
+    Identical lines without a FITID are numbered per day, remembering the
+    last SEEN_DAYS days – exact for statements in date order, bounded
+    memory for any size.
+    `progress(parsed, inserted)` is called after every batch.
+    Returns {'parsed': n, 'inserted': n, 'duplicates': n}.
+    """
+    parse = parse_ofx if fmt == 'ofx' else parse_csv
+    seen = {}       # day → {(desc, amount, type): occurrences so far}
+    parsed = inserted = 0
+    batch = []
+
+    def flush():
+        nonlocal inserted
+        with transaction():
+            inserted += query_many(INSERT_SQL, batch)
+        batch.clear()
+        if progress:
+            progress(parsed, inserted)
+
+    for _, day, desc, amount, kind, ref in parse(lines):
+        occurrence = 1
+        if not ref:
+            counts = seen.get(day)
+            if counts is None:
+                if len(seen) >= SEEN_DAYS:
+                    del seen[next(iter(seen))]
+                counts = seen[day] = {}
+            natural = (desc, amount, kind)
+            counts[natural] = occurrence = counts.get(natural, 0) + 1
+        batch.append((user_id, desc[:255], amount, kind, day,
+                      row_hash(user_id, day, desc, amount, kind, ref, occurrence)))
+        parsed += 1
+        if len(batch) >= CHUNK_ROWS:
+            flush()
+    if batch:
+        flush()
+    return {'parsed': parsed, 'inserted': inserted, 'duplicates': parsed - inserted}
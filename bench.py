@@ -0,0 +1,336 @@
+"""
+MoneyMap benchmarks – run against a scratch database, never production.
+Benchmarks that use the database refuse to run unless DB_HOST and DB_NAME
+are set in the environment (or --i-know-this-is-scratch is given), so the
+defaults in config.py are never written to by accident.
+
+    python bench.py analysis --rows 10000 100000 1000000
+    python bench.py listing  --rows 1000000 --depths 0 10000 100000 900000
+    python bench.py import   --lines 100000
+    python bench.py insert   --count 2000
+    python bench.py login    --clients 1 8 32  (no database needed)
+    python bench.py amortize --loans 10000 --months 360  (no database needed)
+    python bench.py json     --rows 100000     (no database needed)
+
+Synthetic users are created as bench-<rows>@moneymap.local and reused on
+later runs, so the (slow) seeding only happens once per size.
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from config import DB_FROM_ENV, DB_HOST, DB_NAME
+from database import query, query_many, transaction
+from categories import seed_defaults
+import ledger
+
+
+# ─────────────────────────────────────────────────────────────
+# SYNTHETIC DATA
+# ─────────────────────────────────────────────────────────────
+def bench_user(rows):
+    """Return the id of a user holding `rows` synthetic transactions."""
+    email = f'bench-{rows}@moneymap.local'
+    found = query("SELECT id FROM Users WHERE email=%s", (email,), fetch=True)
+    if found:
+        return found[0]['id']
+
+    with transaction():
+        user_id = query("INSERT INTO Users (name, email, password) VALUES (%s,%s,%s)",
+                        (f'Bench {rows}', email, '!'), lastrowid=True)
+        seed_defaults(user_id)
+    cats = query("SELECT id, type FROM Categories WHERE user_id=%s", (user_id,), fetch=True)
+
+    rnd = random.Random(rows)
+    today = date.today()
+    chunk = []
+    for i in range(rows):
+        c = rnd.choice(cats)
+        chunk.append((user_id, c['id'], c['type'], round(rnd.uniform(10, 5000), 2),
+                      f'bench {i}', today - timedelta(days=rnd.randrange(730))))
+        if len(chunk) == 5000 or i == rows - 1:
+            with transaction():
+                query_many("INSERT INTO Transactions (user_id,category_id,type,amount,note,date) "
+                           "VALUES (%s,%s,%s,%s,%s,%s)", chunk)
+            chunk = []
+    ledger.rebuild(user_id)
+    return user_id
+
+
+def timed(fn, repeat):
+    """Median wall time of `fn()` in milliseconds."""
+    fn()    # warm-up (pool, caches)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def report(title, results):
+    print(f"\n{title}")
+    print('-' * len(title))
+    for label, ms in results:
+        print(f"  {label:<40} {ms:10.2f} ms")
+
+
+# ─────────────────────────────────────────────────────────────
+# /api/analysis
+# ─────────────────────────────────────────────────────────────
+def analysis_serial(user_id):
+    """The original route body: ten independent queries, one after another."""
+    start_date = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-01')
+    query("""SELECT DATE_FORMAT(date, '%Y-%m') as month, type, SUM(amount) as total
+             FROM Transactions WHERE user_id=%s AND date >= %s
+             GROUP BY DATE_FORMAT(date, '%Y-%m'), type""", (user_id, start_date), fetch=True)
+    for kind in ('income', 'expense'):
+        query(f"""SELECT c.name as category, SUM(t.amount) as total
+                  FROM Transactions t LEFT JOIN Categories c ON t.category_id=c.id
+                  WHERE t.user_id=%s AND t.type='{kind}' AND date >= %s
+                  GROUP BY c.id, c.name ORDER BY total DESC""", (user_id, start_date), fetch=True)
+    for sql in (
+        "SELECT type, SUM(balance) as total FROM Accounts WHERE user_id=%s GROUP BY type",
+        "SELECT type, COUNT(*) as count, SUM(current_val) as total FROM Investments WHERE user_id=%s GROUP BY type ORDER BY total DESC",
+        "SELECT category, COUNT(*) as count, SUM(amount) as total FROM Bills WHERE user_id=%s GROUP BY category ORDER BY total DESC LIMIT 10",
+        "SELECT name, amount FROM Subscriptions WHERE user_id=%s ORDER BY amount DESC LIMIT 10",
+        """SELECT t.destination, COALESCE(SUM(te.amount), 0) as spent FROM Trips t
+           LEFT JOIN TripExpenses te ON te.trip_id = t.id WHERE t.user_id=%s
+           GROUP BY t.id, t.destination ORDER BY spent DESC LIMIT 10""",
+        "SELECT loan_name, principal, emi, total_int FROM Loans WHERE user_id=%s ORDER BY principal DESC LIMIT 10",
+        """SELECT b.amount, c.name FROM Budgets b LEFT JOIN Categories c ON b.category_id=c.id
+           WHERE b.user_id=%s ORDER BY b.amount DESC LIMIT 10""",
+    ):
+        query(sql, (user_id,), fetch=True)
+
+
+def bench_analysis(args):
+    from analysis import build_analysis
+    results = []
+    for rows in args.rows:
+        user_id = bench_user(rows)
+        results.append((f'{rows:>9,} rows  serial (10 queries)', timed(lambda: analysis_serial(user_id), args.repeat)))
+        results.append((f'{rows:>9,} rows  build_analysis', timed(lambda: build_analysis(user_id), args.repeat)))
+    report('/api/analysis', results)
+
+
+# ─────────────────────────────────────────────────────────────
+# GET /api/transactions
+# ─────────────────────────────────────────────────────────────
+def bench_listing(args):
+    results = []
+    for rows in args.rows:
+        user_id = bench_user(rows)
+        for depth in args.depths:
+            if depth >= rows:
+                continue
+            cursor = None
+            if depth:
+                edge = query("""SELECT id, date FROM Transactions WHERE user_id=%s
+                                ORDER BY date DESC, id DESC LIMIT 1 OFFSET %s""",
+                             (user_id, depth - 1), fetch=True)[0]
+                cursor = ledger.encode_cursor(edge)
+            results.append((f'{rows:>9,} rows  page @{depth:<9,} keyset',
+                            timed(lambda: ledger.list_transactions(user_id, cursor=cursor, limit=50), args.repeat)))
+            results.append((f'{rows:>9,} rows  page @{depth:<9,} OFFSET',
+                            timed(lambda: query("""SELECT t.id, t.date, t.type, t.amount, t.note, t.category_id
+                                                   FROM Transactions t WHERE t.user_id=%s
+                                                   ORDER BY t.date DESC, t.id DESC LIMIT 51 OFFSET %s""",
+                                                (user_id, depth), fetch=True), args.repeat)))
+    report('GET /api/transactions (50 per page)', results)
+
+
+# ─────────────────────────────────────────────────────────────
+# BANK STATEMENT IMPORT
+# ─────────────────────────────────────────────────────────────
+def bench_import(args):
+    from bank_import import import_statement
+    user_id = bench_user(0)
+    rnd = random.Random(args.lines)
+    start = date.today() - timedelta(days=365)
+    lines = ['Date,Description,Amount\n'] + [
+        f"{start + timedelta(days=i % 365)},Bench payee {rnd.randrange(500)},{rnd.uniform(-5000, 5000):.2f}\n"
+        for i in range(args.lines)
+    ]
+    results = []
+    for label in ('first import', 're-import (all duplicates)'):
+        t0 = time.perf_counter()
+        summary = import_statement(user_id, iter(lines), 'csv')
+        results.append((f"{args.lines:,} lines  {label} ({summary['inserted']:,} new)",
+                        (time.perf_counter() - t0) * 1000))
+    report('Bank statement import', results)
+
+
+# ─────────────────────────────────────────────────────────────
+# TRANSACTION INSERT (prepared statements)
+# ─────────────────────────────────────────────────────────────
+def bench_insert(args):
+    user_id = bench_user(0)
+    cat_id = query("SELECT id FROM Categories WHERE user_id=%s AND type='expense' LIMIT 1",
+                   (user_id,), fetch='scalar')
+    today = date.today()
+    results = []
+    for prepared in (False, True):
+        def insert_all():
+            with transaction():
+                for i in range(args.count):
+                    query(ledger.INSERT_TRANSACTION_SQL,
+                          (user_id, cat_id, 'expense', 1.5, 'bench insert', today),
+                          lastrowid=True, prepared=prepared)
+                    query(ledger.ROLLUP_ADD_SQL, (user_id, today, cat_id, 'expense', 1.5, 1),
+                          prepared=prepared)
+        label = 'prepared (cached)' if prepared else 'text protocol'
+        results.append((f'{args.count:,} inserts  {label}', timed(insert_all, args.repeat)))
+    query("DELETE FROM Transactions WHERE user_id=%s", (user_id,))
+    ledger.rebuild(user_id)
+    report('Transaction insert + rollup upsert', results)
+
+
+# ─────────────────────────────────────────────────────────────
+# PASSWORD CHECKS (login throughput)
+# ─────────────────────────────────────────────────────────────
+def bench_login(args):
+    import bcrypt
+    import passwords
+    hashed = bcrypt.hashpw(b'correct horse', bcrypt.gensalt(passwords.BCRYPT_ROUNDS)).decode()
+
+    def logins_per_sec(check, clients):
+        done, stop = [0] * clients, time.perf_counter() + args.seconds
+
+        def client(i):
+            while time.perf_counter() < stop:
+                try:
+                    check('correct horse', hashed)
+                    done[i] += 1
+                except passwords.PoolBusy:
+                    pass
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return sum(done) / args.seconds
+
+    inline = lambda pw, h: bcrypt.checkpw(pw.encode(), h.encode())
+    print(f"\nLogins/sec, {passwords.BCRYPT_ROUNDS} rounds, {passwords.BCRYPT_WORKERS} pool workers")
+    for clients in args.clients:
+        print(f"  {clients:>3} clients  inline {logins_per_sec(inline, clients):8.1f}"
+              f"   pool {logins_per_sec(passwords.check_password, clients):8.1f}")
+    print('  pool metrics:', passwords.stats())
+
+
+# ─────────────────────────────────────────────────────────────
+# AMORTIZATION SCHEDULES
+# ─────────────────────────────────────────────────────────────
+def bench_amortize(args):
+    import numpy as np
+    import amortization
+
+    rnd = np.random.default_rng(args.loans)
+    principal = rnd.uniform(1e5, 1e7, args.loans)
+    rate = rnd.uniform(6, 14, args.loans)
+    months = np.full(args.loans, args.months)
+    prepay = {i: {12: 50_000} for i in range(0, args.loans, 10)}
+    label = f'{args.loans:,} loans x {args.months} months'
+    report('Amortization schedules', [
+        (f'{label}  closed form', timed(lambda: amortization.schedules(principal, rate, months), args.repeat)),
+        (f'{label}  with prepayments', timed(
+            lambda: amortization.schedules(principal, rate, months, prepayments=prepay), args.repeat)),
+    ])
+
+
+# ─────────────────────────────────────────────────────────────
+# JSON ENCODING
+# ─────────────────────────────────────────────────────────────
+def bench_json(args):
+    from flask import Flask
+    from flask.json.provider import DefaultJSONProvider
+    import json_provider
+
+    rnd = random.Random(args.rows)
+    today = date.today()
+    rows = [{'id': i, 'user_id': 1, 'category_id': rnd.randrange(20), 'type': 'expense',
+             'amount': Decimal(f'{rnd.uniform(10, 5000):.2f}'), 'note': f'bench {i}',
+             'date': today - timedelta(days=rnd.randrange(730)), 'category': 'Food'}
+            for i in range(args.rows)]
+
+    app = Flask(__name__)
+    default, provider = DefaultJSONProvider(app), json_provider.MoneyMapJSONProvider(app)
+
+    def per_row_loop():
+        # What the routes did before: convert every row, then jsonify
+        out = [dict(r) for r in rows]
+        for t in out:
+            t['date'] = str(t['date'])
+            t['amount'] = float(t['amount'])
+        return default.dumps(out, separators=(',', ':'))
+
+    def stdlib_provider():
+        fast, json_provider.orjson = json_provider.orjson, None
+        try:
+            return provider.dumps(rows, separators=(',', ':'))
+        finally:
+            json_provider.orjson = fast
+
+    results = [(f'{args.rows:,} rows  per-row loop + json', timed(per_row_loop, args.repeat)),
+               (f'{args.rows:,} rows  provider (json)', timed(stdlib_provider, args.repeat))]
+    if json_provider.orjson is not None:
+        results.append((f'{args.rows:,} rows  provider (orjson)',
+                        timed(lambda: provider.dumps(rows, separators=(',', ':')), args.repeat)))
+    report('jsonify of a transaction listing', results)
+
+
+NO_DATABASE = {'login', 'amortize', 'json'}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MoneyMap benchmarks')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--i-know-this-is-scratch', dest='scratch', action='store_true',
+                        help='allow writing to the database configured by default')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    p = sub.add_parser('analysis', help='serial vs single-pass analysis queries')
+    p.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    p.set_defaults(func=bench_analysis)
+
+    p = sub.add_parser('listing', help='keyset vs OFFSET pagination of transactions')
+    p.add_argument('--rows', type=int, nargs='+', default=[1_000_000])
+    p.add_argument('--depths', type=int, nargs='+', default=[0, 10_000, 100_000, 900_000])
+    p.set_defaults(func=bench_listing)
+
+    p = sub.add_parser('import', help='bulk bank-statement import throughput')
+    p.add_argument('--lines', type=int, default=100_000)
+    p.set_defaults(func=bench_import)
+
+    p = sub.add_parser('insert', help='text protocol vs cached prepared statements')
+    p.add_argument('--count', type=int, default=2000)
+    p.set_defaults(func=bench_insert)
+
+    p = sub.add_parser('login', help='bcrypt checks per second, inline vs hashing pool')
+    p.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32])
+    p.add_argument('--seconds', type=float, default=5)
+    p.set_defaults(func=bench_login)
+
+    p = sub.add_parser('amortize', help='vectorized loan schedules')
+    p.add_argument('--loans', type=int, default=10_000)
+    p.add_argument('--months', type=int, default=360)
+    p.set_defaults(func=bench_amortize)
+
+    p = sub.add_parser('json', help='per-row conversion vs JSON provider encoding')
+    p.add_argument('--rows', type=int, default=100_000)
+    p.set_defaults(func=bench_json)
+
+    args = parser.parse_args()
+    if args.bench not in NO_DATABASE and not (DB_FROM_ENV or args.scratch):
+        parser.error(f'refusing to write benchmark data to {DB_NAME}@{DB_HOST}: set DB_HOST and DB_NAME '
+                     f'to a scratch database, or pass --i-know-this-is-scratch')
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from functools import wraps
+
+from flask import Response, g, has_request_context, request, session
+from config import CACHE_URL, CACHE_MAX_ENTRIES, CACHE_TTL
+from database import execute_now, query
+
+# Per-user response cache. Every cached entry is keyed by
+#   (user, data version, endpoint + query string)
+# and a user's data version is bumped after each successful write, so old
+# entries are never served again and simply age out of the LRU / TTL.
+# Versions are shared by every process (MySQL or Redis). A write on one
+# gunicorn worker, or by a CLI job, is seen by all the others on their
+# next request; only the cached bodies are per process.
+
+
+class DatabaseCounters:
+    """
+    Version counters in the CacheVersions table, so every worker process
+    and CLI job sees the same values. Reads are remembered for the rest of
+    the request (a cached view and its ETag ask for the same version).
+    """
+
+    def _memo(self):
+        return g.setdefault('cache_counters', {}) if has_request_context() else {}
+
+    def counter(self, key):
+        memo = self._memo()
+        if key not in memo:
+            memo[key] = query("SELECT value FROM CacheVersions WHERE name=%s", (key,),
+                              fetch='scalar', prepared=True) or 0
+        return memo[key]
+
+    def counter_time(self, key):
+        return query("SELECT updated_at FROM CacheVersions WHERE name=%s", (key,), fetch='scalar')
+
+    def incr(self, key):
+        """Atomically add one to a counter (starting from 0) and return it."""
+        value = execute_now(
+            """INSERT INTO CacheVersions (name, value, updated_at) VALUES (%s, LAST_INSERT_ID(1), %s)
+               ON DUPLICATE KEY UPDATE value=LAST_INSERT_ID(value + 1), updated_at=VALUES(updated_at)""",
+            (key, time.time()), lastrowid=True)
+        self._memo()[key] = value
+        return value
+
+
+class LocalCache:
+    """
+    In-process LRU cache with a per-entry TTL, bounded to `max_entries`.
+    Entries are per process, version counters are shared (DatabaseCounters),
+    so a process never serves an entry older than another process's write.
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL, counters=None):
+        self.max_entries = max_entries
+        self.ttl         = ttl
+        self.epoch       = 'd'
+        self._lock       = threading.Lock()
+        self._entries    = OrderedDict()    # key → (expires_at, value), most recently used last
+        self._counters   = counters or DatabaseCounters()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def counter(self, key):
+        return self._counters.counter(key)
+
+    def counter_time(self, key):
+        return self._counters.counter_time(key)
+
+    def incr(self, key):
+        return self._counters.incr(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache:
+    """
+    Shared backend for several workers or hosts (needs the `redis` package).
+    Eviction is left to the server: use maxmemory-policy volatile-lru, so
+    entries (which carry a TTL) are evicted but version counters are not.
+    """
+
+    def __init__(self, url, ttl=CACHE_TTL):
+        import redis
+        self.ttl     = ttl
+        self.epoch   = 'r'
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self._client.get(key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self._client.set(key, pickle.dumps(value), ex=int(ttl or self.ttl))
+
+    def counter(self, key):
+        return int(self._client.get(key) or 0)
+
+    def counter_time(self, key):
+        raw = self._client.get(key + ':t')
+        return float(raw) if raw is not None else None
+
+    def incr(self, key):
+        pipe = self._client.pipeline()
+        pipe.incr(key)
+        pipe.set(key + ':t', time.time())
+        return pipe.execute()[0]
+
+    def clear(self):
+        self._client.flushdb()
+
+
+def _backend_from_config():
+    if CACHE_URL.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisCache(CACHE_URL)
+    return LocalCache()
+
+
+backend = _backend_from_config()
+
+
+# ─────────────────────────────────────────────────────────────
+# DATA VERSIONS
+# ─────────────────────────────────────────────────────────────
+def _version_key(user_id):
+    return f'mm:v:{user_id}'
+
+
+def data_version(user_id):
+    """Current data version of a user (0 until their first write)."""
+    return backend.counter(_version_key(user_id))
+
+
+def invalidate(user_id):
+    """Mark everything cached for a user as stale. Call after a committed write."""
+    return backend.incr(_version_key(user_id))
+
+
+def last_modified(user_id):
+    """Time (epoch seconds) of the user's last write, if known."""
+    return backend.counter_time(_version_key(user_id))
+
+
+def bind_invalidation(bp):
+    """
+    Bump the signed-in user's data version after every successful non-GET
+    request of blueprint `bp`. Register this BEFORE bind_request_scope(bp):
+    after_request hooks run in reverse order, so the bump then follows the
+    commit and no reader can cache pre-commit data under the new version.
+    """
+    @bp.after_request
+    def _invalidate_after_write(response):
+        if (request.method not in ('GET', 'HEAD') and response.status_code < 400
+                and 'user_id' in session):
+            invalidate(session['user_id'])
+        return response
+
+
+# ─────────────────────────────────────────────────────────────
+# CONDITIONAL GET
+# ─────────────────────────────────────────────────────────────
+def etag_for(user_id):
+    """
+    Validator for a user's views on a given day: their shared data
+    version plus the date (due dates and "days left" change at midnight).
+    The backend epoch keeps MySQL and Redis versions from matching each other.
+    """
+    return f'{backend.epoch}-{user_id}-{data_version(user_id)}-{date.today():%Y%m%d}'
+
+
+def conditional(f):
+    """
+    Answer conditional GETs of a logged-in view whose body depends only on
+    the user's data and the date. A matching If-None-Match gets a 304
+    without running the view; 200 responses carry the ETag. The tag is
+    taken before the view runs, so a write in between only costs the client
+    one more full response. If-Modified-Since is not trusted for 304s: its
+    one-second resolution cannot tell apart two writes within the same second.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        user_id = session['user_id']
+        tag = etag_for(user_id)
+        if request.if_none_match.contains_weak(tag):
+            response = Response(status=304)
+            response.set_etag(tag, weak=True)
+            return response
+        response = f(*args, **kwargs)
+        if not isinstance(response, Response) or response.status_code != 200:
+            return response
+        response.set_etag(tag, weak=True)
+        response.headers['Cache-Control'] = 'private, no-cache'
+        modified = last_modified(user_id)
+        if modified:
+            response.last_modified = modified
+        return response
+    return decorated
+
+
+# ─────────────────────────────────────────────────────────────
+# VIEW CACHING
+# ─────────────────────────────────────────────────────────────
+def cached(f):
+    """
+    Cache a logged-in JSON view per user and data version (see conditional
+    for its 304s). Only 200 responses are stored; the cached body is returned
+    without running the view. A hit still reads the user's version and its
+    time: from CacheVersions in MySQL with LocalCache, from Redis with RedisCache.
+    """
+    @conditional
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        user_id = session['user_id']
+        key = f'mm:r:{user_id}:{data_version(user_id)}:{request.full_path}'
+        hit = backend.get(key)
+        if hit is not None:
+            body, mimetype = hit
+            return Response(body, mimetype=mimetype, headers={'X-Cache': 'HIT'})
+        response = f(*args, **kwargs)
+        if isinstance(response, Response) and response.status_code == 200:
+            backend.set(key, (response.get_data(), response.mimetype))
+            response.headers['X-Cache'] = 'MISS'
+        return response
+    return decorated
@@ -0,0 +1,95 @@
+from datetime import datetime
+from database import on_commit, query, query_many, transaction
+import cache
+
+DEFAULT_INCOME_CATEGORIES = ['Salary', 'Freelance', 'Bonus', 'Investment Returns', 'Gifts', 'Other Income']
+
+# Default expense categories and their monthly budget
+DEFAULT_EXPENSE_BUDGETS = {
+    'Food & Dining':     5000,
+    'Transportation':    3000,
+    'Shopping':          4000,
+    'Utilities':         2000,
+    'Healthcare':        2000,
+    'Entertainment':     2000,
+    'Education':         3000,
+    'Insurance':         1500,
+    'Home & Rent':      10000,
+    'Personal Care':     1000,
+    'Phone & Internet':  1000,
+    'Gifts & Donations': 1000,
+    'Other Expense':     2000,
+}
+
+
+def seed_defaults(user_id):
+    """
+    Create default categories AND current-month budgets for a user.
+    Runs a fixed three statements in one transaction: a multi-row category
+    insert, one id lookup and a multi-row budget insert. Rows that already
+    exist are skipped via the unique keys, so it is safe to call anytime.
+    Returns {expense category name: id}.
+    """
+    cat_rows = [(user_id, name, 'income') for name in DEFAULT_INCOME_CATEGORIES]
+    cat_rows += [(user_id, name, 'expense') for name in DEFAULT_EXPENSE_BUDGETS]
+    current_month = datetime.now().strftime('%Y-%m')
+
+    with transaction():
+        query_many("INSERT IGNORE INTO Categories (user_id, name, type) VALUES (%s, %s, %s)", cat_rows)
+        rows = query("SELECT id, name FROM Categories WHERE user_id=%s AND type='expense'",
+                     (user_id,), fetch=True)
+        cat_ids = {r['name']: r['id'] for r in rows}
+        query_many(
+            "INSERT IGNORE INTO Budgets (user_id, category_id, month, amount) VALUES (%s,%s,%s,%s)",
+            [(user_id, cat_ids[name], current_month, amount)
+             for name, amount in DEFAULT_EXPENSE_BUDGETS.items() if name in cat_ids]
+        )
+        invalidate(user_id)
+        # Seeding can happen inside a GET (first visit), where no write bumps the version
+        on_commit(lambda: cache.invalidate(user_id))
+    return cat_ids
+
+
+# ─────────────────────────────────────────────────────────────
+# CATEGORY RESOLVER
+# ─────────────────────────────────────────────────────────────
+# A user's categories are loaded with one query into the cache backend as
+# {(type, name): id} and reused until add/delete/seeding bumps the user's
+# category version. The version is bumped after the commit, so another
+# worker can briefly read the old map: a name or id it does not know is
+# looked up again in the table before being treated as missing.
+
+CATEGORY_MAP_SQL = "SELECT id, type, name FROM Categories WHERE user_id=%s"
+
+
+def _map_version(user_id):
+    return cache.backend.counter(f'mm:cv:{user_id}')
+
+
+def invalidate(user_id):
+    """Drop the cached category map of a user once the current transaction commits."""
+    on_commit(lambda: cache.backend.incr(f'mm:cv:{user_id}'))
+
+
+def category_map(user_id, fresh=False):
+    """{(type, name): id} for all of a user's categories; `fresh` reads the table even on a cache hit."""
+    key = f'mm:c:{user_id}:{_map_version(user_id)}'
+    cats = None if fresh else cache.backend.get(key)
+    if cats is None:
+        rows = query(CATEGORY_MAP_SQL, (user_id,), fetch='tuples', prepared=True)
+        cats = {(type_, name): cid for cid, type_, name in rows}
+        cache.backend.set(key, cats)
+    return cats
+
+
+def category_types(user_id, fresh=False):
+    """{id: type} of a user's categories, e.g. to check ownership of posted ids."""
+    return {cid: type_ for (type_, _), cid in category_map(user_id, fresh).items()}
+
+
+def resolve(user_id, name, type_='expense'):
+    """Id of the user's category `name` of `type_`, or None."""
+    cid = category_map(user_id).get((type_, name))
+    if cid is None:
+        cid = category_map(user_id, fresh=True).get((type_, name))
+    return cid
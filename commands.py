@@ -0,0 +1,200 @@
+"""
+Maintenance commands, run through the Flask CLI:
+
+    flask --app app db migrate
+    flask --app app db status
+    flask --app app db check-indexes
+    flask --app app db check-queries USER_ID
+    flask --app app db purge-idempotency-keys [--days N]
+    flask --app app rollup rebuild [--user-id N]
+    flask --app app rollup verify  [--user-id N]
+    flask --app app loans rebuild-state [--user-id N]
+    flask --app app recurring post [--date YYYY-MM-DD] [--days N] [--user-id N]
+    flask --app app recurring rebuild-upcoming [--user-id N]
+    flask --app app export USER_ID [--format jsonl|csv] [--table NAME] [--gzip] [-o FILE]
+    flask --app app import-statement USER_ID FILE [--format csv|ofx]
+"""
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+import cache
+import ledger
+import loans
+import models
+import recurring
+import routes
+import upcoming
+from export import EXPORT_TABLES, FORMATS, export_chunks, export_filename
+from bank_import import StatementError, detect_format, import_statement
+from config import IDEMPOTENCY_KEY_DAYS, RECURRING_LOOKBACK_DAYS
+from database import count_queries
+
+db_cli = AppGroup('db', help='Schema migrations and index checks.')
+rollup_cli = AppGroup('rollup', help='Maintain the TransactionRollup table.')
+loans_cli = AppGroup('loans', help='Maintain the LoanState table.')
+recurring_cli = AppGroup('recurring', help='Post due bills and subscriptions.')
+
+
+@rollup_cli.command('rebuild')
+@click.option('--user-id', type=int, help='Only rebuild this user.')
+def rollup_rebuild(user_id):
+    """Recompute the monthly rollup from Transactions."""
+    ledger.rebuild(user_id)
+    click.echo('✅ Rollup rebuilt' + (f' for user {user_id}' if user_id else ''))
+
+
+@rollup_cli.command('verify')
+@click.option('--user-id', type=int, help='Only verify this user.')
+def rollup_verify(user_id):
+    """Report rollup rows that disagree with Transactions."""
+    mismatches = ledger.verify(user_id)
+    for uid_, month, cat, type_, expected, actual in mismatches:
+        click.echo(f"user {uid_} {month} {type_} category {cat}: expected {expected}, rollup {actual}")
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} rollup rows out of date – run "rollup rebuild"')
+    click.echo('✅ Rollup matches Transactions')
+
+
+@loans_cli.command('rebuild-state')
+@click.option('--user-id', type=int, help="Only rebuild this user's loans.")
+def loans_rebuild_state(user_id):
+    """Recompute every loan's state from EmiPayments."""
+    n = loans.rebuild_state(user_id)
+    click.echo(f'✅ Loan state rebuilt for {n} loans')
+
+
+@recurring_cli.command('post')
+@click.option('--date', 'day', type=click.DateTime(['%Y-%m-%d']), help='Post as of this day (default: today).')
+@click.option('--days', type=int, default=RECURRING_LOOKBACK_DAYS, show_default=True,
+              help='Also catch up on this many days before it.')
+@click.option('--user-id', type=int, help="Only post this user's items.")
+def recurring_post(day, days, user_id):
+    """Post every bill and subscription due and not yet posted (safe to re-run)."""
+    n = recurring.run(day.date() if day else None, days, user_id)
+    click.echo(f'✅ {n} recurring charges posted' + (f' for user {user_id}' if user_id else ''))
+
+
+@recurring_cli.command('rebuild-upcoming')
+@click.option('--user-id', type=int, help='Only rebuild this user.')
+def recurring_rebuild_upcoming(user_id):
+    """Recompute UpcomingDues from bills, subscriptions and loan state."""
+    n = upcoming.rebuild(user_id)
+    click.echo(f'✅ {n} upcoming dues indexed')
+
+
+@db_cli.command('migrate')
+def db_migrate():
+    """Create missing tables and apply pending migrations."""
+    models.create_tables()
+
+
+@db_cli.command('status')
+def db_status():
+    """List migrations and whether they have been applied."""
+    done = models.applied_migrations()
+    for version, name, _ in models.MIGRATIONS:
+        state = f'applied {done[version]}' if version in done else 'pending'
+        click.echo(f"{version:>4}  {name:<45} {state}")
+
+
+@db_cli.command('check-indexes')
+def db_check_indexes():
+    """EXPLAIN the route queries and fail if any of them scans a table."""
+    problems = models.unindexed_queries()
+    for label, table, access in problems:
+        click.echo(f"{label}: {table} read without an index (type={access})")
+    if problems:
+        raise click.ClickException(f'{len(problems)} unindexed table reads')
+    click.echo('✅ Every checked query uses an index')
+
+
+# Statements an uncached GET of each hot route sends for a user who has categories, cache version reads included
+QUERY_BUDGETS = [
+    ('/api/bootstrap',      7),
+    ('/api/dashboard',      5),
+    ('/api/health-score',   4),
+    ('/api/analysis',       3),
+    ('/api/categories',     3),
+    ('/api/transactions',   3),
+    ('/api/upcoming',       3),
+    ('/api/loans',          3),
+    ('/api/budgets',        3),
+    ('/api/bills',          3),
+    ('/api/subscriptions',  3),
+]
+
+
+@db_cli.command('check-queries')
+@click.argument('user_id', type=int)
+def db_check_queries(user_id):
+    """GET the hot routes as a user, uncached, and fail if one sends more statements than budgeted."""
+    client = current_app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    over = 0
+    for path, budget in QUERY_BUDGETS:
+        cache.invalidate(user_id)
+        # A fresh app context per request, so no `g` (memoized cache versions) carries over
+        with current_app.app_context(), count_queries() as n:
+            status = client.get(path).status_code
+        ok = status == 200 and n.count <= budget
+        over += not ok
+        click.echo(f"{'ok ' if ok else 'BAD'}  {path:<20} {n.count:>3} queries (budget {budget}), HTTP {status}")
+    if over:
+        raise click.ClickException(f'{over} routes over their query budget')
+    click.echo('✅ Every checked route is within its query budget')
+
+
+@db_cli.command('purge-idempotency-keys')
+@click.option('--days', type=int, default=IDEMPOTENCY_KEY_DAYS, show_default=True,
+              help='Keep the keys of the last N days.')
+def db_purge_idempotency_keys(days):
+    """Delete batch Idempotency-Key responses older than the retention window."""
+    deleted = routes.purge_idempotency_keys(days)
+    click.echo(f'✅ Deleted {deleted} idempotency keys older than {days} days')
+
+
+@click.command('export')
+@click.argument('user_id', type=int)
+@click.option('--format', 'fmt', type=click.Choice(FORMATS), default='jsonl', show_default=True)
+@click.option('--table', 'tables', type=click.Choice(list(EXPORT_TABLES)), multiple=True,
+              help='Tables to include (default: all; CSV takes the first).')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('-o', '--output', type=click.Path(dir_okay=False), help='Output file (default: named after the export).')
+def export_cmd(user_id, fmt, tables, compress, output):
+    """Stream a user's full history to a file."""
+    tables = list(tables) or None
+    output = output or export_filename(fmt, tables, compress)
+    written = 0
+    with open(output, 'wb') as f:
+        for chunk in export_chunks(user_id, fmt, tables, compress):
+            f.write(chunk)
+            written += len(chunk)
+    click.echo(f'✅ Wrote {written:,} bytes to {output}')
+
+
+@click.command('import-statement')
+@click.argument('user_id', type=int)
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ofx']), help='Default: detected from the file.')
+def import_statement_cmd(user_id, path, fmt):
+    """Bulk-import a bank statement into BankTransactions."""
+    with open(path, encoding='utf-8-sig', errors='replace', newline='') as f:
+        fmt = fmt or detect_format(f.readline(), path)
+        f.seek(0)
+        progress = lambda parsed, inserted: click.echo(f'  {parsed:>9,} parsed  {inserted:>9,} new', err=True)
+        try:
+            result = import_statement(user_id, f, fmt, progress=progress)
+        except StatementError as e:
+            raise click.ClickException(str(e))
+    click.echo(f"✅ {result['inserted']:,} imported, {result['duplicates']:,} already present")
+
+
+def register_commands(app):
+    app.cli.add_command(db_cli)
+    app.cli.add_command(rollup_cli)
+    app.cli.add_command(loans_cli)
+    app.cli.add_command(recurring_cli)
+    app.cli.add_command(export_cmd)
+    app.cli.add_command(import_statement_cmd)
@@ -5,5 +5,44 @@ DB_PORT     = int(os.environ.get("DB_PORT", 39650))
 DB_USER     = os.environ.get("DB_USER", "root")
 DB_PASSWORD = os.environ.get("DB_PASSWORD", "SJcAmhIgmnJUJCEJpOMuskAUQDULGUic")
 DB_NAME     = os.environ.get("DB_NAME", "railway")
+# True when the database was chosen explicitly rather than left at the defaults above
+DB_FROM_ENV = "DB_HOST" in os.environ and "DB_NAME" in os.environ
 
-SECRET_KEY  = os.environ.get("SECRET_KEY", "moneymap_super_secret_2024")
\ No newline at end of file
+SECRET_KEY  = os.environ.get("SECRET_KEY", "moneymap_super_secret_2024")
+
+# Connection pool (per worker process)
+DB_POOL_SIZE     = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_POOL_TIMEOUT  = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", 300))
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 32))    # prepared statements per connection
+DB_MAX_STREAMS   = int(os.environ.get("DB_MAX_STREAMS", 2))    # open export streams, each on its own connection
+
+# Response cache: "local" keeps cached bodies per process and the per-user data
+# versions in MySQL (shared by every worker); a redis:// URL shares both
+CACHE_URL         = os.environ.get("CACHE_URL", "local")
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 1024))
+CACHE_TTL         = float(os.environ.get("CACHE_TTL", 300))
+
+# Password hashing: bcrypt work factor and the per-process hashing pool
+BCRYPT_ROUNDS    = int(os.environ.get("BCRYPT_ROUNDS", 12))
+BCRYPT_WORKERS   = int(os.environ.get("BCRYPT_WORKERS", 2))
+BCRYPT_MAX_QUEUE = int(os.environ.get("BCRYPT_MAX_QUEUE", 32))
+
+# Login audit write-behind: flush every N seconds or once a batch is full;
+# a batch the database refuses is retried, backing off up to AUDIT_RETRY_MAX seconds
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", 2))
+AUDIT_BATCH_SIZE     = int(os.environ.get("AUDIT_BATCH_SIZE", 500))
+AUDIT_MAX_PENDING    = int(os.environ.get("AUDIT_MAX_PENDING", 10000))
+AUDIT_RETRY_MAX      = float(os.environ.get("AUDIT_RETRY_MAX", 60))
+
+# Recurring bills/subscriptions: the background poster is off by default (use
+# `flask recurring post` from cron instead); when on, every worker runs it –
+# the per-month markers keep that safe
+RECURRING_SCHEDULER     = os.environ.get("RECURRING_SCHEDULER", "0") == "1"
+RECURRING_INTERVAL      = float(os.environ.get("RECURRING_INTERVAL", 3600))
+RECURRING_LOOKBACK_DAYS = int(os.environ.get("RECURRING_LOOKBACK_DAYS", 3))
+RECURRING_BATCH_SIZE    = int(os.environ.get("RECURRING_BATCH_SIZE", 1000))
+
+# Idempotency-Key responses of /api/transactions/batch are replayed for this many
+# days; `flask db purge-idempotency-keys` (from cron) deletes older ones
+IDEMPOTENCY_KEY_DAYS = int(os.environ.get("IDEMPOTENCY_KEY_DAYS", 7))
@@ -1,35 +1,476 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
 import mysql.connector
-from config import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+from flask import current_app, g, has_request_context, request
+from config import (DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME,
+                    DB_POOL_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE, DB_STATEMENT_CACHE_SIZE, DB_MAX_STREAMS)
 
 
 def get_db():
-    """Return a new MySQL connection."""
+    """
+    Return a new MySQL connection.
+    Autocommit is on so a pooled connection never holds a stale snapshot;
+    multi-statement work opens an explicit transaction instead.
+    """
     return mysql.connector.connect(
         host=DB_HOST,
+        port=DB_PORT,
         user=DB_USER,
         password=DB_PASSWORD,
-        database=DB_NAME
+        database=DB_NAME,
+        autocommit=True
     )
 
 
-def query(sql, params=None, fetch=False, lastrowid=False):
+class PoolExhausted(Exception):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT."""
+
+
+class ConnectionPool:
+    """
+    Small fork-aware pool of reusable MySQL connections.
+      - at most `size` connections are checked out at once
+      - idle connections are pinged on checkout and replaced if dead
+      - connections idle for longer than `max_idle` seconds are closed
+      - after a fork (gunicorn workers) the child starts with an empty pool
+    """
+
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, max_idle=DB_POOL_MAX_IDLE):
+        self.size     = size
+        self.timeout  = timeout
+        self.max_idle = max_idle
+        self._init_worker()
+
+    def _init_worker(self):
+        # Sockets inherited from the parent process belong to the parent,
+        # so they are dropped here without being closed.
+        self._pid   = os.getpid()
+        self._lock  = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle  = []    # [(conn, released_at)], most recently used last
+
+    def _reap(self, now):
+        """Close connections that sat idle longer than max_idle. Caller holds the lock."""
+        fresh = []
+        for conn, released_at in self._idle:
+            if now - released_at > self.max_idle:
+                _close_quietly(conn)
+            else:
+                fresh.append((conn, released_at))
+        self._idle = fresh
+
+    def acquire(self):
+        if self._pid != os.getpid():
+            self._init_worker()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolExhausted(f"No database connection free after {self.timeout}s")
+        try:
+            with self._lock:
+                self._reap(time.monotonic())
+                conn = self._idle.pop()[0] if self._idle else None
+            if conn is not None:
+                try:
+                    conn.ping(reconnect=False)
+                except Exception:
+                    _close_quietly(conn)
+                    conn = None
+            return conn or get_db()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn):
+        if self._pid != os.getpid():
+            return
+        try:
+            # Never hand an open transaction to the next borrower.
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+                self._reap(time.monotonic())
+        except Exception:
+            _close_quietly(conn)
+        finally:
+            self._slots.release()
+
+    def close_idle(self):
+        with self._lock:
+            for conn, _ in self._idle:
+                _close_quietly(conn)
+            self._idle = []
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+pool = ConnectionPool()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=pool._init_worker)
+
+
+_local = threading.local()
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection for the duration of the block."""
+    conn = pool.acquire()
+    try:
+        yield conn
+    finally:
+        pool.release(conn)
+
+
+# ─────────────────────────────────────────────────────────────
+# UNIT OF WORK
+# ─────────────────────────────────────────────────────────────
+def _bound_connection():
+    """
+    Connection of the enclosing unit of work, or None.
+    Inside a request the connection is checked out lazily on first use and
+    kept on `g`; write requests also open their transaction here.
+    """
+    if has_request_context() and g.get('db_scope'):
+        conn = g.get('db_conn')
+        if conn is None:
+            conn = pool.acquire()
+            g.db_conn = conn
+            if g.db_scope == 'write':
+                conn.start_transaction()
+        return conn
+    return getattr(_local, 'conn', None)
+
+
+@contextmanager
+def transaction():
+    """
+    Run the block in one transaction. Joins the request's (or an outer)
+    transaction when there is one, otherwise commits on exit.
+    """
+    conn = _bound_connection()
+    if conn is not None and conn.in_transaction:
+        yield conn
+        return
+    owned = conn is None
+    if owned:
+        conn = pool.acquire()
+        _local.conn = conn
+    _local.on_commit = []
+    try:
+        conn.start_transaction()
+        yield conn
+        conn.commit()
+        _run_callbacks(_local.on_commit)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        _local.on_commit = None
+        if owned:
+            _local.conn = None
+            pool.release(conn)
+
+
+def on_commit(fn):
+    """
+    Call `fn()` once the enclosing transaction commits (dropped on rollback),
+    or straight away when there is none. For side effects such as cache
+    invalidation that must not run before other readers can see the change.
+    """
+    if has_request_context() and g.get('db_scope') == 'write':
+        g.setdefault('db_on_commit', []).append(fn)
+    elif getattr(_local, 'on_commit', None) is not None:
+        _local.on_commit.append(fn)
+    else:
+        fn()
+
+
+def _run_callbacks(callbacks):
+    for fn in callbacks or ():
+        fn()
+
+
+def bind_request_scope(bp):
+    """
+    Give every request of blueprint `bp` one connection and, for writes,
+    one transaction: committed after a successful response, rolled back on
+    an error status or an exception, released on teardown.
+    """
+    @bp.before_request
+    def _begin_unit_of_work():
+        g.db_scope = 'read' if request.method in ('GET', 'HEAD') else 'write'
+        g.db_queries = 0
+
+    @bp.after_request
+    def _commit_unit_of_work(response):
+        conn = g.get('db_conn')
+        callbacks = g.pop('db_on_commit', None)
+        if conn is not None and conn.in_transaction:
+            if response.status_code < 400:
+                conn.commit()
+                _run_callbacks(callbacks)
+            else:
+                conn.rollback()
+        elif response.status_code < 400:
+            _run_callbacks(callbacks)
+        if current_app.debug:
+            response.headers['X-DB-Queries'] = str(g.get('db_queries', 0))
+        return response
+
+    @bp.teardown_request
+    def _end_unit_of_work(exc):
+        g.pop('db_scope', None)
+        g.pop('db_queries', None)
+        g.pop('db_on_commit', None)
+        conn = g.pop('db_conn', None)
+        if conn is not None:
+            pool.release(conn)    # rolls back anything left uncommitted
+
+
+def release_connection():
+    """
+    Hand the request's connection back to the pool before slow work that
+    does not need it (password hashing), committing what was written so far.
+    A later query checks a connection (and, for writes, a transaction) out again.
+    """
+    conn = g.pop('db_conn', None) if has_request_context() else None
+    if conn is not None:
+        if conn.in_transaction:
+            conn.commit()
+        pool.release(conn)
+
+
+@contextmanager
+def own_transactions():
+    """
+    Leave the request's unit of work for the block: each transaction() in it
+    checks out its own connection and commits on its own (a long import
+    commits batch by batch instead of holding one transaction open).
+    """
+    release_connection()
+    scope = g.pop('db_scope', None)
+    try:
+        yield
+    finally:
+        g.db_scope = scope
+
+
+def query(sql, params=None, fetch=False, lastrowid=False, prepared=False):
     """
     Utility helper:
       fetch=True       → returns list of dicts
+      fetch='tuples'   → returns list of tuples (no per-row dict)
+      fetch='scalar'   → returns the first column of the first row, or None
       lastrowid=True   → returns last inserted id
-      else             → executes and commits
+      else             → executes (autocommit, or inside the unit of work)
+    prepared=True runs `sql` as a server-side prepared statement, cached on
+    the pooled connection – use it for hot statements with a fixed text.
     """
-    conn = get_db()
-    cur  = conn.cursor(dictionary=True)
-    cur.execute(sql, params or ())
-    if fetch:
-        result = cur.fetchall()
-        conn.close()
-        return result
-    if lastrowid:
-        conn.commit()
-        rid = cur.lastrowid
-        conn.close()
-        return rid
-    conn.commit()
-    conn.close()
+    run = _execute_prepared if prepared else _execute
+    conn = _bound_connection()
+    if conn is None:
+        with connection() as conn:
+            return run(conn, sql, params, fetch, lastrowid)
+    return run(conn, sql, params, fetch, lastrowid)
+
+
+def execute_now(sql, params=None, lastrowid=False):
+    """
+    Run one write that must not wait for (or be rolled back with) a unit of
+    work that has not started – e.g. a cache version bump from an
+    after-commit hook. Joins a transaction that is already open, otherwise
+    runs in autocommit, and never opens one itself.
+    """
+    if has_request_context() and g.get('db_scope'):
+        conn = g.get('db_conn')
+    else:
+        conn = getattr(_local, 'conn', None)
+    if conn is None:
+        with connection() as conn:
+            return _execute(conn, sql, params, False, lastrowid)
+    return _execute(conn, sql, params, False, lastrowid)
+
+
+def query_many(sql, seq_params, lastrowid=False):
+    """
+    Run one statement for every parameter tuple in `seq_params`.
+    INSERT ... VALUES statements are sent as a single multi-row INSERT.
+    Returns the affected row count, or with lastrowid=True the first
+    generated id.
+    """
+    seq_params = list(seq_params)
+    if not seq_params:
+        return 0
+    conn = _bound_connection()
+    if conn is None:
+        with connection() as conn:
+            return _execute_many(conn, sql, seq_params, lastrowid)
+    return _execute_many(conn, sql, seq_params, lastrowid)
+
+
+class StreamsBusy(Exception):
+    """Raised when DB_MAX_STREAMS streams stay open for longer than DB_POOL_TIMEOUT."""
+
+
+_stream_lock = threading.Lock()
+_stream_pid = None
+_stream_slots = None
+
+
+def _stream_slot():
+    """Take one of this process's DB_MAX_STREAMS stream slots; returns the semaphore to release."""
+    global _stream_pid, _stream_slots
+    with _stream_lock:
+        if _stream_pid != os.getpid():
+            _stream_pid, _stream_slots = os.getpid(), threading.BoundedSemaphore(DB_MAX_STREAMS)
+        slots = _stream_slots
+    if not slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise StreamsBusy(f"{DB_MAX_STREAMS} exports already running, please retry")
+    return slots
+
+
+def stream(sql, params=None, batch_size=1000):
+    """
+    Yield result rows as tuples without loading the whole result: an
+    unbuffered cursor read with fetchmany. The first item yielded is the
+    tuple of column names.
+    A stream lasts as long as the client takes to download it, so it runs
+    on its own connection outside the pool (closed at the end), and at most
+    DB_MAX_STREAMS run at once per process.
+    """
+    slots = _stream_slot()
+    try:
+        conn = get_db()
+        try:
+            _counted()
+            cur = conn.cursor(buffered=False)
+            cur.execute(sql, params or ())
+            yield tuple(cur.column_names)
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+            cur.close()
+        finally:
+            _close_quietly(conn)
+    finally:
+        slots.release()
+
+
+# ─────────────────────────────────────────────────────────────
+# QUERY COUNTING
+# ─────────────────────────────────────────────────────────────
+class QueryCounter:
+    """Number of statements sent while the counter was active."""
+
+    def __init__(self):
+        self.count = 0
+
+
+def _counted():
+    for counter in getattr(_local, 'counters', ()):
+        counter.count += 1
+    if has_request_context() and 'db_queries' in g:
+        g.db_queries += 1
+
+
+@contextmanager
+def count_queries():
+    """
+    Count the statements issued in the block (this thread only):
+        with count_queries() as n:
+            client.get('/api/trips')
+        assert n.count <= 2
+    """
+    counter = QueryCounter()
+    counters = _local.__dict__.setdefault('counters', [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def _execute_many(conn, sql, seq_params, lastrowid=False):
+    _counted()
+    cur = conn.cursor()
+    try:
+        cur.executemany(sql, seq_params)
+        return cur.lastrowid if lastrowid else cur.rowcount
+    finally:
+        cur.close()
+
+
+def _fetch(cur, fetch):
+    if fetch is True or fetch == 'tuples':
+        return cur.fetchall()
+    if fetch == 'scalar':
+        row = cur.fetchone()
+        cur.fetchall()    # drain, so the connection is free for the next statement
+        return row[0] if row else None
+    raise ValueError(f'Unknown fetch mode: {fetch!r}')
+
+
+def _prepared_cursor(conn, sql, dictionary):
+    """
+    Prepared cursor for `sql` from the connection's LRU statement cache.
+    Returns (cursor, sql): the connector only skips re-preparing when it is
+    given the very string object it prepared, so callers must execute the
+    cached string rather than their own copy. Evicted statements are closed
+    on the server; the rest go away with the connection.
+    """
+    statements = getattr(conn, '_mm_statements', None)
+    if statements is None:
+        statements = conn._mm_statements = OrderedDict()
+    key = (sql, dictionary)
+    entry = statements.get(key)
+    if entry is not None:
+        statements.move_to_end(key)
+        return entry
+    entry = statements[key] = (conn.cursor(prepared=True, dictionary=dictionary), sql)
+    while len(statements) > DB_STATEMENT_CACHE_SIZE:
+        _, (old, _) = statements.popitem(last=False)
+        old.close()
+    return entry
+
+
+def _execute_prepared(conn, sql, params, fetch, lastrowid):
+    _counted()
+    cur, sql = _prepared_cursor(conn, sql, fetch is True)
+    try:
+        cur.execute(sql, params or ())
+        if fetch:
+            return _fetch(cur, fetch)
+        if cur.with_rows:
+            cur.fetchall()
+        if lastrowid:
+            return cur.lastrowid
+    except Exception:
+        # A failed statement may have left the cursor unusable: prepare it afresh next time.
+        conn._mm_statements.pop((sql, fetch is True), None)
+        _close_quietly(cur)
+        raise
+
+
+def _execute(conn, sql, params, fetch, lastrowid):
+    _counted()
+    cur = conn.cursor(dictionary=fetch is True)
+    try:
+        cur.execute(sql, params or ())
+        if fetch:
+            return _fetch(cur, fetch)
+        if lastrowid:
+            return cur.lastrowid
+    finally:
+        cur.close()
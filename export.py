@@ -0,0 +1,100 @@
+import csv
+import io
+import json
+import zlib
+from database import stream
+from json_provider import json_default
+
+# Exportable history, oldest first. Every query is scoped to one user.
+EXPORT_TABLES = {
+    'transactions': """
+        SELECT t.id, t.date, t.type, t.amount, c.name AS category, t.note
+        FROM Transactions t
+        LEFT JOIN Categories c ON t.category_id=c.id
+        WHERE t.user_id=%s
+        ORDER BY t.date, t.id""",
+    'investments': """
+        SELECT id, invest_date, name, type, amount, current_val, note
+        FROM Investments
+        WHERE user_id=%s
+        ORDER BY invest_date, id""",
+    'emi_payments': """
+        SELECT p.id, p.paid_date, l.loan_name, p.amount, p.note
+        FROM EmiPayments p
+        JOIN Loans l ON l.id=p.loan_id
+        WHERE l.user_id=%s
+        ORDER BY p.paid_date, p.id""",
+    'trip_expenses': """
+        SELECT e.id, e.date, t.destination, e.amount, e.note
+        FROM TripExpenses e
+        JOIN Trips t ON t.id=e.trip_id
+        WHERE t.user_id=%s
+        ORDER BY e.date, e.id""",
+}
+
+FORMATS = ('csv', 'jsonl')
+
+# Rows are buffered into chunks of about this many characters before being
+# yielded, so the response is neither one huge string nor one write per row.
+CHUNK_CHARS = 64 * 1024
+
+
+def _csv_chunks(user_id, table):
+    rows = stream(EXPORT_TABLES[table], (user_id,))
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(next(rows))
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= CHUNK_CHARS:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def _jsonl_chunks(user_id, tables):
+    parts, size = [], 0
+    for table in tables:
+        rows = stream(EXPORT_TABLES[table], (user_id,))
+        columns = next(rows)
+        for row in rows:
+            record = dict(zip(columns, row))
+            record['table'] = table
+            line = json.dumps(record, default=json_default, ensure_ascii=False) + '\n'
+            parts.append(line)
+            size += len(line)
+            if size >= CHUNK_CHARS:
+                yield ''.join(parts)
+                parts, size = [], 0
+    yield ''.join(parts)
+
+
+def _gzipped(chunks):
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)    # wbits 31 → gzip container
+    for chunk in chunks:
+        data = gz.compress(chunk)
+        if data:
+            yield data
+    yield gz.flush()
+
+
+def export_chunks(user_id, fmt='jsonl', tables=None, compress=False):
+    """
+    Generate a user's history as text (or gzip bytes) chunks.
+    CSV holds one table (the first of `tables`); JSONL holds all of them,
+    each record tagged with its "table". Memory use does not depend on the
+    size of the history.
+    """
+    tables = list(tables or EXPORT_TABLES)
+    unknown = [t for t in tables if t not in EXPORT_TABLES]
+    if unknown or fmt not in FORMATS:
+        raise ValueError(f"Unknown table or format: {', '.join(unknown) or fmt}")
+    chunks = _csv_chunks(user_id, tables[0]) if fmt == 'csv' else _jsonl_chunks(user_id, tables)
+    chunks = (c.encode() for c in chunks if c)
+    return _gzipped(chunks) if compress else chunks
+
+
+def export_filename(fmt, tables, compress):
+    name = 'moneymap-' + ((tables or list(EXPORT_TABLES))[0] if fmt == 'csv' else 'history')
+    return f"{name}.{fmt}" + ('.gz' if compress else '')
@@ -0,0 +1,24 @@
+# Gunicorn settings, read by `gunicorn -c gunicorn.conf.py app:app`.
+#
+# Threaded workers: a login waits 100-300 ms on bcrypt (passwords.py) and an
+# export streams for as long as the download lasts. Under the default sync
+# worker either one blocks the whole process. A thread holds a pooled
+# database connection only while it queries, so `threads` may exceed
+# DB_POOL_SIZE; the rest wait up to DB_POOL_TIMEOUT for a free connection.
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+
+def on_starting(server):
+    """Refuse to start workers against a schema that `flask db migrate` has not brought up to date."""
+    import database
+    import models
+    pending = models.pending_migrations()
+    database.pool.close_idle()    # nothing opened here is handed to the workers
+    if pending:
+        raise SystemExit(f"Database schema is behind (migrations {pending} pending): "
+                         f"run `flask --app app db migrate` first")
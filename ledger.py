@@ -0,0 +1,200 @@
+import base64
+from database import query, query_many, transaction
+
+# TransactionRollup keeps SUM(amount)/COUNT(*) of Transactions per
+# (user, month, type, category); category_id 0 stands for "no category".
+# Every write to Transactions goes through this module so both stay in step.
+
+INSERT_TRANSACTION_SQL = (
+    "INSERT INTO Transactions (user_id,category_id,type,amount,note,date) VALUES (%s,%s,%s,%s,%s,%s)"
+)
+
+ROLLUP_ADD_SQL = """
+    INSERT INTO TransactionRollup (user_id, month, category_id, type, total, txn_count)
+    VALUES (%s, DATE_FORMAT(%s, '%Y-%m'), %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE total=total+VALUES(total), txn_count=txn_count+VALUES(txn_count)
+"""
+
+TOTALS_SQL = "SELECT type, SUM(total) FROM TransactionRollup WHERE user_id=%s GROUP BY type"
+
+LIST_SQL = """
+    SELECT t.id, t.date, t.type, t.amount, t.note, t.category_id, c.name as category
+    FROM Transactions t
+    LEFT JOIN Categories c ON t.category_id=c.id
+    WHERE {where}
+    ORDER BY t.date DESC, t.id DESC
+    LIMIT %s
+"""
+
+ROLLUP_SOURCE_SQL = """
+    SELECT user_id, DATE_FORMAT(date, '%Y-%m') AS month, IFNULL(category_id, 0) AS category_id,
+           type, SUM(amount) AS total, COUNT(*) AS txn_count
+    FROM Transactions {where}
+    GROUP BY user_id, DATE_FORMAT(date, '%Y-%m'), IFNULL(category_id, 0), type
+"""
+
+
+_id_step = None
+
+
+def id_step():
+    """
+    Gap between the AUTO_INCREMENT ids of one multi-row INSERT: the server's
+    auto_increment_increment (1 unless multi-primary replication raised it).
+    Read once per process.
+    """
+    global _id_step
+    if _id_step is None:
+        _id_step = int(query("SELECT @@SESSION.auto_increment_increment", fetch='scalar') or 1)
+    return _id_step
+
+
+# ─────────────────────────────────────────────────────────────
+# WRITES
+# ─────────────────────────────────────────────────────────────
+def add_transaction(user_id, category_id, type_, amount, note, date):
+    """Insert a transaction and fold it into the rollup. Returns the new id."""
+    with transaction():
+        tid = query(INSERT_TRANSACTION_SQL, (user_id, category_id, type_, amount, note, date),
+                    lastrowid=True, prepared=True)
+        query(ROLLUP_ADD_SQL, (user_id, date, category_id or 0, type_, amount, 1), prepared=True)
+    return tid
+
+
+def add_transactions(user_id, rows):
+    """
+    Insert many transactions with one multi-row INSERT and fold them into
+    the rollup with one multi-row upsert.
+    rows: [(category_id, type, amount, note, date)]. Returns the new ids
+    (one multi-row INSERT gets evenly spaced AUTO_INCREMENT values, see id_step()).
+    """
+    return add_many([(user_id,) + tuple(r) for r in rows])
+
+
+def add_many(rows):
+    """
+    add_transactions() for rows of any number of users:
+    [(user_id, category_id, type, amount, note, date)]. Returns the new ids.
+    """
+    if not rows:
+        return []
+    rollup = {}
+    for user_id, category_id, type_, amount, _, day in rows:
+        key = (user_id, str(day)[:7], category_id or 0, type_)
+        first_day, total, count = rollup.get(key, (day, 0, 0))
+        rollup[key] = (first_day, total + amount, count + 1)
+    with transaction():
+        first_id = query_many(INSERT_TRANSACTION_SQL, [tuple(r) for r in rows], lastrowid=True)
+        query_many(ROLLUP_ADD_SQL, [(user_id, day, cat, type_, total, count)
+                                    for (user_id, _, cat, type_), (day, total, count) in rollup.items()])
+    step = id_step()
+    return list(range(first_id, first_id + len(rows) * step, step))
+
+
+def delete_transaction(user_id, tid):
+    """Delete a user's transaction and take it back out of the rollup."""
+    with transaction():
+        row = query("SELECT category_id, type, amount, date FROM Transactions WHERE id=%s AND user_id=%s FOR UPDATE",
+                    (tid, user_id), fetch=True)
+        if not row:
+            return False
+        t = row[0]
+        query("DELETE FROM Transactions WHERE id=%s AND user_id=%s", (tid, user_id))
+        query(ROLLUP_ADD_SQL, (user_id, t['date'], t['category_id'] or 0, t['type'], -t['amount'], -1),
+              prepared=True)
+    return True
+
+
+def forget_category(user_id, category_id):
+    """
+    Move a category's rollup rows to "no category". Call before deleting
+    the category (its transactions fall back to category_id NULL).
+    """
+    with transaction():
+        query("""INSERT INTO TransactionRollup (user_id, month, category_id, type, total, txn_count)
+                 SELECT user_id, month, 0, type, total, txn_count FROM TransactionRollup
+                 WHERE user_id=%s AND category_id=%s
+                 ON DUPLICATE KEY UPDATE total=TransactionRollup.total+VALUES(total),
+                                         txn_count=TransactionRollup.txn_count+VALUES(txn_count)""",
+              (user_id, category_id))
+        query("DELETE FROM TransactionRollup WHERE user_id=%s AND category_id=%s", (user_id, category_id))
+
+
+# ─────────────────────────────────────────────────────────────
+# READS
+# ─────────────────────────────────────────────────────────────
+def totals(user_id):
+    """All-time income and expense totals as floats: {'income': .., 'expense': ..}."""
+    rows = query(TOTALS_SQL, (user_id,), fetch='tuples', prepared=True)
+    result = {'income': 0.0, 'expense': 0.0}
+    for type_, total in rows:
+        result[type_] = float(total or 0)
+    return result
+
+
+def encode_cursor(row):
+    """Opaque keyset cursor for the position just after `row`."""
+    return base64.urlsafe_b64encode(f"{row['date']}|{row['id']}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (date string, id) from encode_cursor(); raises ValueError if malformed."""
+    try:
+        day, tid = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return day, int(tid)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def list_transactions(user_id, cursor=None, limit=50, date_from=None, date_to=None,
+                      type_=None, category_id=None, min_amount=None, max_amount=None):
+    """
+    One page of a user's transactions, newest first, ordered by (date, id).
+    Keyset pagination: the cursor turns into a range condition on the
+    (user_id, date, id) index, so deep pages cost the same as the first.
+    Returns (rows, next_cursor or None).
+    """
+    where, params = ["t.user_id=%s"], [user_id]
+    if cursor:
+        day, tid = decode_cursor(cursor)
+        where.append("(t.date < %s OR (t.date = %s AND t.id < %s))")
+        params += [day, day, tid]
+    for cond, value in (("t.date >= %s", date_from), ("t.date <= %s", date_to),
+                        ("t.type = %s", type_), ("t.category_id = %s", category_id),
+                        ("t.amount >= %s", min_amount), ("t.amount <= %s", max_amount)):
+        if value is not None:
+            where.append(cond)
+            params.append(value)
+
+    rows = query(LIST_SQL.format(where=' AND '.join(where)), tuple(params) + (limit + 1,), fetch=True)
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+# ─────────────────────────────────────────────────────────────
+# MAINTENANCE
+# ─────────────────────────────────────────────────────────────
+def rebuild(user_id=None):
+    """Recompute the rollup from Transactions (all users, or one)."""
+    where, params = ("WHERE user_id=%s", (user_id,)) if user_id else ("", ())
+    with transaction():
+        query(f"DELETE FROM TransactionRollup {where}", params)
+        query("INSERT INTO TransactionRollup (user_id, month, category_id, type, total, txn_count) "
+              + ROLLUP_SOURCE_SQL.format(where=where), params)
+
+
+def verify(user_id=None):
+    """
+    Compare the rollup with Transactions. Returns a list of
+    (user_id, month, category_id, type, expected (total, count), actual (total, count)).
+    """
+    where, params = ("WHERE user_id=%s", (user_id,)) if user_id else ("", ())
+    key = lambda r: (r['user_id'], r['month'], r['category_id'], r['type'])
+    expected = {key(r): (r['total'], r['txn_count'])
+                for r in query(ROLLUP_SOURCE_SQL.format(where=where), params, fetch=True)}
+    actual = {key(r): (r['total'], r['txn_count'])
+              for r in query(f"SELECT * FROM TransactionRollup {where}", params, fetch=True)
+              if r['txn_count']}
+    return [k + (expected.get(k), actual.get(k))
+            for k in sorted(set(expected) | set(actual), key=str)
+            if expected.get(k) != actual.get(k)]
@@ -0,0 +1,136 @@
+from datetime import datetime
+
+from database import query, query_many, transaction
+import amortization
+import upcoming
+
+# LoanState keeps each loan's progress (paid to date, months paid, amount
+# left, next due date) next to the loan, so /api/loans reads it with one
+# indexed join instead of summing EmiPayments on every request. Every
+# payment goes through record_payment(), which writes the EmiPayments row,
+# the new state and the loan's UpcomingDues entry in the same transaction.
+
+STATE_UPSERT_SQL = """
+    INSERT INTO LoanState (loan_id, amount_paid, months_paid, amount_left, next_due)
+    VALUES (%s,%s,%s,%s,%s)
+    ON DUPLICATE KEY UPDATE amount_paid=VALUES(amount_paid), months_paid=VALUES(months_paid),
+                            amount_left=VALUES(amount_left), next_due=VALUES(next_due)
+"""
+
+LIST_SQL = """
+    SELECT l.*, COALESCE(s.amount_paid, 0) AS amount_paid, COALESCE(s.months_paid, 0) AS months_paid,
+           COALESCE(s.amount_left, l.principal + COALESCE(l.total_int, 0)) AS amount_left, s.next_due
+    FROM Loans l
+    LEFT JOIN LoanState s ON s.loan_id=l.id
+    WHERE l.user_id=%s
+"""
+
+PAYMENTS_SQL = """
+    SELECT p.* FROM EmiPayments p
+    JOIN Loans l ON l.id=p.loan_id
+    WHERE p.loan_id=%s AND l.user_id=%s
+    ORDER BY p.paid_date DESC
+"""
+
+
+def _state(loan, amount_paid):
+    """(loan_id, amount_paid, months_paid, amount_left, next_due) for a Loans row."""
+    emi = float(loan['emi'] or 0)
+    tenure = int(loan['tenure'])
+    months_paid = min(tenure, int(amount_paid // emi)) if emi > 0 else 0
+    amount_left = max(0.0, float(loan['principal']) + float(loan['total_int'] or 0) - amount_paid)
+    next_due = None
+    if months_paid < tenure:
+        next_due = amortization.due_dates(loan['created_at'].date(), months_paid + 1)[-1]
+    return loan['id'], round(amount_paid, 2), months_paid, round(amount_left, 2), next_due
+
+
+# ─────────────────────────────────────────────────────────────
+# WRITES
+# ─────────────────────────────────────────────────────────────
+def create_loan(user_id, loan_name, principal, annual_rate, tenure_months):
+    """Insert a loan (EMI from the annuity formula) with its initial state. Returns the id."""
+    emi = round(float(amortization.emi(principal, annual_rate, tenure_months)), 2)
+    total_int = round(emi * tenure_months - principal, 2)
+    loan = {'principal': principal, 'tenure': tenure_months, 'emi': emi, 'total_int': total_int,
+            'created_at': datetime.now().replace(microsecond=0)}
+    with transaction():
+        loan['id'] = query(
+            "INSERT INTO Loans (user_id,loan_name,principal,rate,tenure,emi,total_int,created_at) "
+            "VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
+            (user_id, loan_name, principal, annual_rate, tenure_months, emi, total_int,
+             loan['created_at']), lastrowid=True
+        )
+        state = _state(loan, 0.0)
+        query(STATE_UPSERT_SQL, state)
+        upcoming.set_due('loan', loan['id'], user_id, loan_name, emi, state[-1])
+    return loan['id']
+
+
+def record_payment(user_id, loan_id, amount, paid_date, note=''):
+    """
+    Record an EMI payment on one of the user's loans and move its state
+    forward, atomically. Returns the loan row, or None if the user does
+    not own the loan (nothing is written then).
+    """
+    with transaction():
+        rows = query(
+            """SELECT l.*, COALESCE(s.amount_paid, 0) AS paid_before
+               FROM Loans l LEFT JOIN LoanState s ON s.loan_id=l.id
+               WHERE l.id=%s AND l.user_id=%s
+               FOR UPDATE""",
+            (loan_id, user_id), fetch=True
+        )
+        if not rows:
+            return None
+        loan = rows[0]
+        query("INSERT INTO EmiPayments (loan_id, paid_date, amount, note) VALUES (%s, %s, %s, %s)",
+              (loan_id, paid_date, amount, note))
+        state = _state(loan, float(loan['paid_before']) + float(amount))
+        query(STATE_UPSERT_SQL, state)
+        upcoming.set_due('loan', loan_id, user_id, loan['loan_name'], loan['emi'], state[-1])
+    return loan
+
+
+# ─────────────────────────────────────────────────────────────
+# READS
+# ─────────────────────────────────────────────────────────────
+def list_loans(user_id, today=None):
+    """A user's loans with their stored state and the derived progress fields."""
+    rows = query(LIST_SQL, (user_id,), fetch=True)
+    today = today or datetime.now().date()
+    for r in rows:
+        tenure = int(r['tenure'])
+        r['months_left'] = max(0, tenure - r['months_paid'])
+        r['progress_pct'] = 0 if tenure == 0 else int(r['months_paid'] / tenure * 100)
+        r['days_to_due'] = (r['next_due'] - today).days if r['next_due'] else None
+    return rows
+
+
+def payments(user_id, loan_id):
+    """Payment history of one of the user's loans (empty if not theirs)."""
+    return query(PAYMENTS_SQL, (loan_id, user_id), fetch=True)
+
+
+# ─────────────────────────────────────────────────────────────
+# MAINTENANCE
+# ─────────────────────────────────────────────────────────────
+def rebuild_state(user_id=None):
+    """Recompute LoanState from EmiPayments (all loans, or one user's)."""
+    where, params = ("WHERE l.user_id=%s", (user_id,)) if user_id else ("", ())
+    loans = query(
+        f"""SELECT l.*, COALESCE(SUM(p.amount), 0) AS paid
+            FROM Loans l LEFT JOIN EmiPayments p ON p.loan_id=l.id
+            {where} GROUP BY l.id""",
+        params, fetch=True
+    )
+    states = [_state(l, float(l['paid'])) for l in loans]
+    with transaction():
+        query_many(STATE_UPSERT_SQL, states)
+        upcoming.set_many([('loan', l['id'], l['user_id'], l['loan_name'], l['emi'], s[-1])
+                           for l, s in zip(loans, states) if s[-1]])
+        paid_off = [l['id'] for l, s in zip(loans, states) if not s[-1]]
+        if paid_off:
+            query(f"DELETE FROM UpcomingDues WHERE kind='loan' AND item_id IN ({', '.join(['%s'] * len(paid_off))})",
+                  tuple(paid_off))
+    return len(loans)
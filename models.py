@@ -1,4 +1,8 @@
+from mysql.connector import Error as MySQLError, errorcode
 from database import query
+import ledger
+import loans
+import upcoming
 
 
 def create_tables():
@@ -12,7 +16,8 @@ def create_tables():
             password       VARCHAR(255) NOT NULL,
             created_at     DATETIME DEFAULT CURRENT_TIMESTAMP,
             last_login     DATETIME,
-            last_activity  DATETIME
+            last_activity  DATETIME,
+            login_count    INT NOT NULL DEFAULT 0
         )
     """)
 
@@ -32,6 +37,7 @@ def create_tables():
             user_id INT NOT NULL,
             name    VARCHAR(100) NOT NULL,
             type    ENUM('income','expense') NOT NULL,
+            UNIQUE KEY uq_category_user_type_name (user_id, type, name),
             FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
         )
     """)
@@ -51,6 +57,21 @@ def create_tables():
         )
     """)
 
+    # Per user/month/type/category totals of Transactions (category_id 0 = none),
+    # maintained by ledger.py on every write
+    query("""
+        CREATE TABLE IF NOT EXISTS TransactionRollup (
+            user_id     INT NOT NULL,
+            month       CHAR(7) NOT NULL,
+            category_id INT NOT NULL DEFAULT 0,
+            type        ENUM('income','expense') NOT NULL,
+            total       DECIMAL(14,2) NOT NULL DEFAULT 0,
+            txn_count   INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, month, type, category_id),
+            FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+        )
+    """)
+
     query("""
         CREATE TABLE IF NOT EXISTS Budgets (
             id          INT AUTO_INCREMENT PRIMARY KEY,
@@ -58,6 +79,7 @@ def create_tables():
             category_id INT,
             month       VARCHAR(7) NOT NULL,
             amount      DECIMAL(12,2) NOT NULL,
+            UNIQUE KEY uq_budget_user_category_month (user_id, category_id, month),
             FOREIGN KEY (user_id)     REFERENCES Users(id) ON DELETE CASCADE,
             FOREIGN KEY (category_id) REFERENCES Categories(id) ON DELETE CASCADE
         )
@@ -105,6 +127,7 @@ def create_tables():
             amount    DECIMAL(12,2) NOT NULL,
             due_day   INT NOT NULL,
             category  VARCHAR(100),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
         )
     """)
@@ -135,6 +158,19 @@ def create_tables():
         )
     """)
 
+    # Per-loan progress kept in step with EmiPayments (see loans.py)
+    query("""
+        CREATE TABLE IF NOT EXISTS LoanState (
+            loan_id      INT PRIMARY KEY,
+            amount_paid  DECIMAL(12,2) NOT NULL DEFAULT 0,
+            months_paid  INT NOT NULL DEFAULT 0,
+            amount_left  DECIMAL(12,2) NOT NULL DEFAULT 0,
+            next_due     DATE,
+            updated_at   DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            FOREIGN KEY (loan_id) REFERENCES Loans(id) ON DELETE CASCADE
+        )
+    """)
+
     query("""
         CREATE TABLE IF NOT EXISTS BankTransactions (
             id          INT AUTO_INCREMENT PRIMARY KEY,
@@ -143,6 +179,8 @@ def create_tables():
             amount      DECIMAL(12,2) NOT NULL,
             type        ENUM('credit','debit') NOT NULL,
             date        DATE NOT NULL,
+            row_hash    CHAR(64),
+            UNIQUE KEY uq_bank_user_hash (user_id, row_hash),
             FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
         )
     """)
@@ -154,6 +192,7 @@ def create_tables():
             name        VARCHAR(150) NOT NULL,
             amount      DECIMAL(12,2) NOT NULL,
             renewal_day INT NOT NULL,
+            created_at  DATETIME DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
         )
     """)
@@ -195,4 +234,249 @@ def create_tables():
         )
     """)
 
-    print("✅ All tables created successfully (including Investments).")
\ No newline at end of file
+    # One row per bill/subscription posted for a month (see recurring.py)
+    query("""
+        CREATE TABLE IF NOT EXISTS RecurringPostings (
+            kind            ENUM('bill','subscription') NOT NULL,
+            item_id         INT NOT NULL,
+            period          CHAR(7) NOT NULL,
+            user_id         INT NOT NULL,
+            transaction_id  INT,
+            posted_at       DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (kind, item_id, period),
+            FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+        )
+    """)
+
+    # Next due date of every bill, subscription and loan (see upcoming.py)
+    query("""
+        CREATE TABLE IF NOT EXISTS UpcomingDues (
+            kind        ENUM('bill','subscription','loan') NOT NULL,
+            item_id     INT NOT NULL,
+            user_id     INT NOT NULL,
+            name        VARCHAR(150),
+            amount      DECIMAL(12,2),
+            due_date    DATE NOT NULL,
+            PRIMARY KEY (kind, item_id),
+            KEY idx_upcoming_user_due (user_id, due_date),
+            FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+        )
+    """)
+
+    # Per-user data versions of the response cache, shared by all workers (see cache.py)
+    query("""
+        CREATE TABLE IF NOT EXISTS CacheVersions (
+            name        VARCHAR(100) PRIMARY KEY,
+            value       BIGINT NOT NULL DEFAULT 0,
+            updated_at  DOUBLE
+        )
+    """)
+
+    # Responses of idempotent batch requests, replayed when a client retries
+    query("""
+        CREATE TABLE IF NOT EXISTS IdempotencyKeys (
+            user_id     INT NOT NULL,
+            idem_key    VARCHAR(100) NOT NULL,
+            response    MEDIUMTEXT,
+            created_at  DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, idem_key),
+            KEY idx_idem_created (created_at),
+            FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+        )
+    """)
+
+    print("✅ All tables created successfully (including Investments).")
+    migrate()
+
+
+# ─────────────────────────────────────────────────────────────
+# SCHEMA MIGRATIONS
+# ─────────────────────────────────────────────────────────────
+def _dedupe_categories():
+    """Merge duplicate (user, type, name) categories into the oldest one."""
+    keep = """(SELECT user_id, type, name, MIN(id) AS keep_id FROM Categories
+               GROUP BY user_id, type, name HAVING COUNT(*) > 1)"""
+    for table in ('Transactions', 'Budgets'):
+        query(f"""UPDATE {table} x
+                  JOIN Categories c ON x.category_id=c.id
+                  JOIN {keep} k ON k.user_id=c.user_id AND k.type=c.type AND k.name=c.name
+                  SET x.category_id=k.keep_id
+                  WHERE c.id <> k.keep_id""")
+    query(f"""DELETE c FROM Categories c
+              JOIN {keep} k ON k.user_id=c.user_id AND k.type=c.type AND k.name=c.name
+              WHERE c.id <> k.keep_id""")
+
+
+def _dedupe_budgets():
+    """Keep only the newest budget per (user, category, month)."""
+    query("""DELETE b1 FROM Budgets b1
+             JOIN Budgets b2 ON b1.user_id=b2.user_id AND b1.category_id=b2.category_id
+                            AND b1.month=b2.month AND b1.id < b2.id""")
+
+
+def _backfill_login_counts():
+    """Set Users.login_count from LoginHistory."""
+    query("""UPDATE Users u
+             JOIN (SELECT user_id, COUNT(*) AS n FROM LoginHistory GROUP BY user_id) h ON h.user_id=u.id
+             SET u.login_count=h.n""")
+
+
+# (version, description, steps). Steps are SQL strings or callables.
+# Append new entries only – never edit one that has shipped.
+MIGRATIONS = [
+    (1, 'unique keys for default seeding', [
+        _dedupe_categories,
+        _dedupe_budgets,
+        "ALTER TABLE Categories ADD UNIQUE KEY uq_category_user_type_name (user_id, type, name)",
+        "ALTER TABLE Budgets ADD UNIQUE KEY uq_budget_user_category_month (user_id, category_id, month)",
+    ]),
+    (2, 'composite indexes for route queries', [
+        "CREATE INDEX idx_txn_user_date        ON Transactions (user_id, date, id)",
+        "CREATE INDEX idx_txn_user_type_amount ON Transactions (user_id, type, amount)",
+        "CREATE INDEX idx_emi_loan_date        ON EmiPayments (loan_id, paid_date, amount)",
+        "CREATE INDEX idx_trip_expenses_trip   ON TripExpenses (trip_id, amount)",
+        "CREATE INDEX idx_inv_user_date        ON Investments (user_id, invest_date)",
+        "CREATE INDEX idx_budgets_user_amount  ON Budgets (user_id, amount)",
+        "CREATE INDEX idx_loans_user_principal ON Loans (user_id, principal)",
+        "CREATE INDEX idx_subs_user_amount     ON Subscriptions (user_id, amount)",
+        "CREATE INDEX idx_login_user_time      ON LoginHistory (user_id, login_time)",
+    ]),
+    (3, 'backfill TransactionRollup', [
+        ledger.rebuild,
+    ]),
+    (4, 'natural-key hash for bank statement imports', [
+        "ALTER TABLE BankTransactions ADD COLUMN row_hash CHAR(64)",
+        "ALTER TABLE BankTransactions ADD UNIQUE KEY uq_bank_user_hash (user_id, row_hash)",
+    ]),
+    (5, 'login counter and sort indexes for admin stats', [
+        "ALTER TABLE Users ADD COLUMN login_count INT NOT NULL DEFAULT 0",
+        _backfill_login_counts,
+        "CREATE INDEX idx_users_last_login ON Users (last_login)",
+        "CREATE INDEX idx_users_created    ON Users (created_at)",
+        "CREATE INDEX idx_users_name       ON Users (name)",
+        "CREATE INDEX idx_users_logins     ON Users (login_count)",
+    ]),
+    (6, 'backfill LoanState', [
+        loans.rebuild_state,
+    ]),
+    (7, 'day-of-month indexes for recurring postings', [
+        "CREATE INDEX idx_bills_due_day     ON Bills (due_day, id)",
+        "CREATE INDEX idx_subs_renewal_day  ON Subscriptions (renewal_day, id)",
+    ]),
+    (8, 'backfill UpcomingDues', [
+        upcoming.rebuild,
+    ]),
+    (9, 'creation time of bills and subscriptions', [
+        # Existing rows get the time of the migration: nothing before it is back-charged
+        "ALTER TABLE Bills ADD COLUMN created_at DATETIME DEFAULT CURRENT_TIMESTAMP",
+        "ALTER TABLE Subscriptions ADD COLUMN created_at DATETIME DEFAULT CURRENT_TIMESTAMP",
+    ]),
+    (10, 'drop unused amount indexes', [
+        # No query filters or sorts on these; user_id lookups use the FK / unique key indexes
+        "DROP INDEX idx_budgets_user_amount  ON Budgets",
+        "DROP INDEX idx_loans_user_principal ON Loans",
+        "DROP INDEX idx_subs_user_amount     ON Subscriptions",
+    ]),
+    (11, 'expiry index for idempotency keys', [
+        "CREATE INDEX idx_idem_created ON IdempotencyKeys (created_at)",
+    ]),
+]
+
+# DDL that fails with these errors has already been applied by hand
+# (e.g. a database loaded from moneymap.sql), which is fine.
+_ALREADY_APPLIED = {errorcode.ER_DUP_KEYNAME, errorcode.ER_DUP_FIELDNAME, errorcode.ER_TABLE_EXISTS_ERROR,
+                    errorcode.ER_CANT_DROP_FIELD_OR_KEY}
+
+
+def applied_migrations():
+    """Return {version: applied_at} of migrations recorded in SchemaMigrations."""
+    query("""
+        CREATE TABLE IF NOT EXISTS SchemaMigrations (
+            version     INT PRIMARY KEY,
+            name        VARCHAR(200) NOT NULL,
+            applied_at  DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    rows = query("SELECT version, applied_at FROM SchemaMigrations", fetch=True)
+    return {r['version']: r['applied_at'] for r in rows}
+
+
+def pending_migrations():
+    """Versions in MIGRATIONS not applied to the database yet."""
+    done = applied_migrations()
+    return [version for version, _, _ in MIGRATIONS if version not in done]
+
+
+def migrate():
+    """Apply pending MIGRATIONS in order. Returns the versions applied."""
+    done = applied_migrations()
+    applied = []
+    for version, name, steps in MIGRATIONS:
+        if version in done:
+            continue
+        for step in steps:
+            if callable(step):
+                step()
+                continue
+            try:
+                query(step)
+            except MySQLError as e:
+                if e.errno not in _ALREADY_APPLIED:
+                    raise
+        query("INSERT INTO SchemaMigrations (version, name) VALUES (%s, %s)", (version, name))
+        print(f"✅ Migration {version} applied: {name}")
+        applied.append(version)
+    return applied
+
+# ─────────────────────────────────────────────────────────────
+# INDEX CHECK
+# ─────────────────────────────────────────────────────────────
+# The route queries themselves, with sample parameters; `flask db check-indexes`
+# EXPLAINs each one and fails if any table is read without an index.
+def indexed_queries():
+    """[(label, sql, params)] built from the SQL constants the code runs."""
+    import admin
+    import categories
+    import recurring
+    import routes
+    from analysis import ANALYSIS_SQL
+    return [
+        ('dashboard: recent transactions', routes.RECENT_TRANSACTIONS_SQL, (1,)),
+        ('dashboard/health: totals', ledger.TOTALS_SQL, (1,)),
+        ('transactions page', ledger.LIST_SQL.format(where='t.user_id=%s'), (1, 51)),
+        ('category map', categories.CATEGORY_MAP_SQL, (1,)),
+        ('categories list', routes.CATEGORIES_SQL, (1,)),
+        ('investments list', routes.INVESTMENTS_SQL, (1,)),
+        ('trips with spend', routes.TRIPS_SQL, (1,)),
+        ('budgets list', routes.BUDGETS_SQL, (1,)),
+        ('loans with state', loans.LIST_SQL, (1,)),
+        ('loan payments', loans.PAYMENTS_SQL, (1, 1)),
+        ('recurring: bills due on a day',
+         recurring.DUE_BATCH_SQL.format(table='Bills', column='due_day', where=''),
+         ('bill', '2030-01', 28, 31, '2030-02-01', 0, 1000)),
+        ('upcoming dues', upcoming.DUE_WITHIN_SQL, (1, '2030-01-31')),
+        ('admin: users page by last login',
+         admin.USERS_PAGE_SQL.format(where='WHERE ' + admin._after('last_login', True, '2030-01-01', 1)[0],
+                                     col='last_login', order='DESC'),
+         ('2030-01-01', '2030-01-01', 1, 51)),
+        ('admin: transaction counts for a page', admin.TXN_COUNTS_SQL.format(ids='%s, %s'), (1, 2)),
+        ('admin: login history', routes.LOGIN_HISTORY_SQL, (1,)),
+        ('analysis', ANALYSIS_SQL, (1, '2000-01') + (1,) * 7),
+        ('idempotency keys: purge', routes.PURGE_IDEMPOTENCY_KEYS_SQL, ('2030-01-01', 1000)),
+    ]
+
+
+def unindexed_queries():
+    """
+    EXPLAIN every indexed_queries() entry and return [(label, table,
+    access type)] for each table read without an index.
+    """
+    problems = []
+    for label, sql, params in indexed_queries():
+        for row in query("EXPLAIN " + sql, params, fetch=True):
+            table = row.get('table')
+            if not table or table.startswith('<'):
+                continue    # derived / union result rows
+            if row.get('type') == 'ALL' or not row.get('key'):
+                problems.append((label, table, row.get('type')))
+    return problems
@@ -27,7 +27,7 @@ USE moneymap;
 -- USERS TABLE
 -- ─────────────────────────────────────────────────────────────────
 -- Used by: Dashboard, Admin Stats, Settings
--- Tracks: User registration, last login, last activity
+-- Tracks: User registration, last login, last activity, login count
 CREATE TABLE IF NOT EXISTS Users (
     id             INT AUTO_INCREMENT PRIMARY KEY,
     name           VARCHAR(100) NOT NULL,
@@ -35,7 +35,8 @@ CREATE TABLE IF NOT EXISTS Users (
     password       VARCHAR(255) NOT NULL,
     created_at     DATETIME DEFAULT CURRENT_TIMESTAMP,
     last_login     DATETIME,
-    last_activity  DATETIME
+    last_activity  DATETIME,
+    login_count    INT NOT NULL DEFAULT 0
 );
 
 -- ─────────────────────────────────────────────────────────────────
@@ -61,6 +62,7 @@ CREATE TABLE IF NOT EXISTS Categories (
     user_id INT NOT NULL,
     name    VARCHAR(100) NOT NULL,
     type    ENUM('income','expense') NOT NULL,
+    UNIQUE KEY uq_category_user_type_name (user_id, type, name),
     FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
 );
 
@@ -82,6 +84,24 @@ CREATE TABLE IF NOT EXISTS Transactions (
     FOREIGN KEY (category_id) REFERENCES Categories(id) ON DELETE SET NULL
 );
 
+-- ─────────────────────────────────────────────────────────────────
+-- TRANSACTION ROLLUP TABLE
+-- ─────────────────────────────────────────────────────────────────
+-- Used by: Dashboard, Analysis, Health Score
+-- Tracks: Monthly totals of Transactions per type and category
+--         (category_id 0 = uncategorized), kept in step by ledger.py.
+--         Rebuild with: flask --app app rollup rebuild
+CREATE TABLE IF NOT EXISTS TransactionRollup (
+    user_id     INT NOT NULL,
+    month       CHAR(7) NOT NULL,
+    category_id INT NOT NULL DEFAULT 0,
+    type        ENUM('income','expense') NOT NULL,
+    total       DECIMAL(14,2) NOT NULL DEFAULT 0,
+    txn_count   INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month, type, category_id),
+    FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+);
+
 -- ─────────────────────────────────────────────────────────────────
 -- BUDGETS TABLE
 -- ─────────────────────────────────────────────────────────────────
@@ -93,6 +113,7 @@ CREATE TABLE IF NOT EXISTS Budgets (
     category_id INT,
     month       VARCHAR(7) NOT NULL,
     amount      DECIMAL(12,2) NOT NULL,
+    UNIQUE KEY uq_budget_user_category_month (user_id, category_id, month),
     FOREIGN KEY (user_id)     REFERENCES Users(id) ON DELETE CASCADE,
     FOREIGN KEY (category_id) REFERENCES Categories(id) ON DELETE CASCADE
 );
@@ -152,6 +173,7 @@ CREATE TABLE IF NOT EXISTS Bills (
     amount    DECIMAL(12,2) NOT NULL,
     due_day   INT NOT NULL,
     category  VARCHAR(100),
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
 );
 
@@ -187,6 +209,22 @@ CREATE TABLE IF NOT EXISTS EmiPayments (
     FOREIGN KEY (loan_id) REFERENCES Loans(id) ON DELETE CASCADE
 );
 
+-- ─────────────────────────────────────────────────────────────────
+-- LOAN STATE TABLE
+-- ─────────────────────────────────────────────────────────────────
+-- Used by: EMI Tracker Page (GET /api/loans)
+-- Tracks: Each loan's progress (paid to date, months paid, amount
+--         left, next due date), updated with every EMI payment
+CREATE TABLE IF NOT EXISTS LoanState (
+    loan_id      INT PRIMARY KEY,
+    amount_paid  DECIMAL(12,2) NOT NULL DEFAULT 0,
+    months_paid  INT NOT NULL DEFAULT 0,
+    amount_left  DECIMAL(12,2) NOT NULL DEFAULT 0,
+    next_due     DATE,
+    updated_at   DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (loan_id) REFERENCES Loans(id) ON DELETE CASCADE
+);
+
 -- ─────────────────────────────────────────────────────────────────
 -- BANK TRANSACTIONS TABLE
 -- ─────────────────────────────────────────────────────────────────
@@ -199,6 +237,8 @@ CREATE TABLE IF NOT EXISTS BankTransactions (
     amount      DECIMAL(12,2) NOT NULL,
     type        ENUM('credit','debit') NOT NULL,
     date        DATE NOT NULL,
+    row_hash    CHAR(64),
+    UNIQUE KEY uq_bank_user_hash (user_id, row_hash),
     FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
 );
 
@@ -213,6 +253,7 @@ CREATE TABLE IF NOT EXISTS Subscriptions (
     name        VARCHAR(150) NOT NULL,
     amount      DECIMAL(12,2) NOT NULL,
     renewal_day INT NOT NULL,
+    created_at  DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
 );
 
@@ -261,6 +302,69 @@ CREATE TABLE IF NOT EXISTS Investments (
     FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
 );
 
+-- ─────────────────────────────────────────────────────────────────
+-- IDEMPOTENCY KEYS TABLE
+-- ─────────────────────────────────────────────────────────────────
+-- Used by: POST /api/transactions/batch
+-- Tracks: Stored responses of batch requests so client retries
+--         (same Idempotency-Key) do not insert twice
+CREATE TABLE IF NOT EXISTS IdempotencyKeys (
+    user_id     INT NOT NULL,
+    idem_key    VARCHAR(100) NOT NULL,
+    response    MEDIUMTEXT,
+    created_at  DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idem_key),
+    KEY idx_idem_created (created_at),
+    FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+);
+
+-- ─────────────────────────────────────────────────────────────────
+-- CACHE VERSIONS TABLE
+-- ─────────────────────────────────────────────────────────────────
+-- Used by: Response cache / ETags (cache.py)
+-- Tracks: Per-user data versions, bumped after every write, so all
+--         gunicorn workers and CLI jobs agree on what is stale
+CREATE TABLE IF NOT EXISTS CacheVersions (
+    name        VARCHAR(100) PRIMARY KEY,
+    value       BIGINT NOT NULL DEFAULT 0,
+    updated_at  DOUBLE
+);
+
+-- ─────────────────────────────────────────────────────────────────
+-- RECURRING POSTINGS TABLE
+-- ─────────────────────────────────────────────────────────────────
+-- Used by: Bills, Subscriptions (recurring.py, `flask recurring post`)
+-- Tracks: Which bill/subscription has been posted as a transaction
+--         for which month, so each is posted at most once a month
+CREATE TABLE IF NOT EXISTS RecurringPostings (
+    kind            ENUM('bill','subscription') NOT NULL,
+    item_id         INT NOT NULL,
+    period          CHAR(7) NOT NULL,
+    user_id         INT NOT NULL,
+    transaction_id  INT,
+    posted_at       DATETIME DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (kind, item_id, period),
+    FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+);
+
+-- ─────────────────────────────────────────────────────────────────
+-- UPCOMING DUES TABLE
+-- ─────────────────────────────────────────────────────────────────
+-- Used by: GET /api/upcoming
+-- Tracks: Next due date of every bill, subscription and loan, kept
+--         current on add / pay / delete (upcoming.py)
+CREATE TABLE IF NOT EXISTS UpcomingDues (
+    kind        ENUM('bill','subscription','loan') NOT NULL,
+    item_id     INT NOT NULL,
+    user_id     INT NOT NULL,
+    name        VARCHAR(150),
+    amount      DECIMAL(12,2),
+    due_date    DATE NOT NULL,
+    PRIMARY KEY (kind, item_id),
+    KEY idx_upcoming_user_due (user_id, due_date),
+    FOREIGN KEY (user_id) REFERENCES Users(id) ON DELETE CASCADE
+);
+
 -- ═══════════════════════════════════════════════════════════════
 -- INDEXES FOR PERFORMANCE
 -- ═══════════════════════════════════════════════════════════════
@@ -273,6 +377,24 @@ CREATE INDEX idx_user_email ON Users(email);
 CREATE INDEX idx_login_user ON LoginHistory(user_id);
 CREATE INDEX idx_login_time ON LoginHistory(login_time);
 
+-- Composite indexes (schema migration 2 in models.py)
+CREATE INDEX idx_txn_user_date        ON Transactions (user_id, date, id);
+CREATE INDEX idx_txn_user_type_amount ON Transactions (user_id, type, amount);
+CREATE INDEX idx_emi_loan_date        ON EmiPayments (loan_id, paid_date, amount);
+CREATE INDEX idx_trip_expenses_trip   ON TripExpenses (trip_id, amount);
+CREATE INDEX idx_inv_user_date        ON Investments (user_id, invest_date);
+CREATE INDEX idx_login_user_time      ON LoginHistory (user_id, login_time);
+
+-- Admin stats sort keys (schema migration 5 in models.py)
+CREATE INDEX idx_users_last_login ON Users (last_login);
+CREATE INDEX idx_users_created    ON Users (created_at);
+CREATE INDEX idx_users_name       ON Users (name);
+CREATE INDEX idx_users_logins     ON Users (login_count);
+
+-- Recurring postings by day of month (schema migration 7 in models.py)
+CREATE INDEX idx_bills_due_day     ON Bills (due_day, id);
+CREATE INDEX idx_subs_renewal_day  ON Subscriptions (renewal_day, id);
+
 -- ═══════════════════════════════════════════════════════════════
 -- SAMPLE DATA (Optional - Uncomment to add test data)
 -- ═══════════════════════════════════════════════════════════════
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from config import BCRYPT_ROUNDS, BCRYPT_WORKERS, BCRYPT_MAX_QUEUE
+
+# bcrypt is deliberately slow (~100–300 ms of CPU at 12 rounds). It runs on a
+# small bounded thread pool – bcrypt releases the GIL while hashing – so at
+# most BCRYPT_WORKERS hashes burn CPU at once and the rest of the worker
+# (other threads, the pool's DB connections) keeps moving. When more than
+# BCRYPT_MAX_QUEUE hashes are waiting, new ones are refused with PoolBusy
+# instead of piling up behind a login storm.
+
+
+class PoolBusy(Exception):
+    """Raised when too many password hashes are already queued."""
+
+
+class _Metrics:
+    def __init__(self):
+        self.lock      = threading.Lock()
+        self.queued    = 0      # submitted, not started
+        self.running   = 0
+        self.completed = 0
+        self.rejected  = 0
+        self.wait_ms   = 0.0    # total time spent queued
+        self.run_ms    = 0.0    # total time spent hashing
+
+
+def _init_worker():
+    # Threads do not survive a fork: every worker process gets its own pool.
+    global _metrics, _executor
+    _metrics = _Metrics()
+    _executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix='bcrypt')
+
+
+_init_worker()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_init_worker)
+
+
+def _run(fn):
+    """Run fn() on the hashing pool and wait for the result."""
+    with _metrics.lock:
+        if _metrics.queued >= BCRYPT_MAX_QUEUE:
+            _metrics.rejected += 1
+            raise PoolBusy('Too many logins in progress, please retry')
+        _metrics.queued += 1
+    submitted = time.perf_counter()
+
+    def task():
+        started = time.perf_counter()
+        with _metrics.lock:
+            _metrics.queued  -= 1
+            _metrics.running += 1
+            _metrics.wait_ms += (started - submitted) * 1000
+        try:
+            return fn()
+        finally:
+            with _metrics.lock:
+                _metrics.running   -= 1
+                _metrics.completed += 1
+                _metrics.run_ms    += (time.perf_counter() - started) * 1000
+
+    return _executor.submit(task).result()
+
+
+def hash_password(password, rounds=BCRYPT_ROUNDS):
+    """bcrypt hash (str) of `password` at the configured work factor."""
+    return _run(lambda: bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode())
+
+
+def check_password(password, hashed):
+    """True if `password` matches the stored bcrypt hash."""
+    return _run(lambda: bcrypt.checkpw(password.encode(), hashed.encode()))
+
+
+def needs_rehash(hashed, rounds=BCRYPT_ROUNDS):
+    """True if a stored hash ($2b$<cost>$...) was made with another work factor."""
+    try:
+        return int(hashed.split('$')[2]) != rounds
+    except (IndexError, ValueError):
+        return True
+
+
+def stats():
+    """Pool metrics for sizing BCRYPT_WORKERS / BCRYPT_MAX_QUEUE."""
+    m = _metrics
+    with m.lock:
+        done = m.completed or 1
+        return {
+            'workers': BCRYPT_WORKERS, 'rounds': BCRYPT_ROUNDS, 'max_queue': BCRYPT_MAX_QUEUE,
+            'queued': m.queued, 'running': m.running, 'completed': m.completed,
+            'rejected': m.rejected,
+            'avg_wait_ms': round(m.wait_ms / done, 2), 'avg_hash_ms': round(m.run_ms / done, 2),
+        }
@@ -0,0 +1,197 @@
+import calendar
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+from mysql.connector import IntegrityError
+
+from database import query, query_many, transaction
+from cache import invalidate
+from config import RECURRING_INTERVAL, RECURRING_LOOKBACK_DAYS, RECURRING_BATCH_SIZE
+import ledger
+import upcoming
+
+# Bills (due_day) and Subscriptions (renewal_day) are posted as expense
+# Transactions on their day of the month. A day past the end of a short month
+# falls on its last day (31 → Feb 28/29). Each posting leaves a
+# RecurringPostings row keyed by (kind, item, month). That makes posting
+# idempotent: a re-run, a catch-up over missed days, a second worker, or a
+# manual "pay" all post an item at most once per month. An item is never
+# posted for a day before it was created.
+#
+# run() posts the due items for the last RECURRING_LOOKBACK_DAYS days, so a
+# few days of downtime are caught up. For each day, one query on
+# (due_day, id) finds the unposted items of every user, read in keyset
+# batches of RECURRING_BATCH_SIZE. Each batch is one multi-row Transactions
+# insert plus one marker insert, and moves the items on in UpcomingDues.
+
+KINDS = {
+    # kind: (table, day column, expense category, transaction note prefix)
+    'bill':         ('Bills',         'due_day',     'Utilities',        'Bill Paid: '),
+    'subscription': ('Subscriptions', 'renewal_day', 'Phone & Internet', 'Subscription: '),
+}
+
+MARKER_SQL = ("INSERT INTO RecurringPostings (kind, item_id, period, user_id, transaction_id) "
+              "VALUES (%s,%s,%s,%s,%s)")
+
+
+DUE_BATCH_SQL = """
+    SELECT x.id, x.user_id, x.name, x.amount, x.{column}
+    FROM {table} x
+    LEFT JOIN RecurringPostings p ON p.kind=%s AND p.item_id=x.id AND p.period=%s
+    WHERE x.{column} BETWEEN %s AND %s AND x.created_at < %s AND x.id > %s AND p.item_id IS NULL{where}
+    ORDER BY x.id
+    LIMIT %s
+"""
+
+
+class AlreadyPosted(Exception):
+    """The item has already been posted for that month."""
+
+
+# ─────────────────────────────────────────────────────────────
+# CALENDAR
+# ─────────────────────────────────────────────────────────────
+def occurrence(day_of_month, year, month):
+    """The date a monthly item falls on in (year, month), clamped to the month's end."""
+    return date(year, month, min(max(int(day_of_month), 1), calendar.monthrange(year, month)[1]))
+
+
+def next_occurrence(day_of_month, today):
+    """The first date strictly after `today` that the item falls on."""
+    this_month = occurrence(day_of_month, today.year, today.month)
+    if this_month > today:
+        return this_month
+    year, month = (today.year + 1, 1) if today.month == 12 else (today.year, today.month + 1)
+    return occurrence(day_of_month, year, month)
+
+
+def day_bucket(day):
+    """(lo, hi) range of day-of-month values due on `day`: the month's last day also takes every later one."""
+    if day.day == calendar.monthrange(day.year, day.month)[1]:
+        return day.day, 31
+    return day.day, day.day
+
+
+def period(day):
+    return f'{day.year:04d}-{day.month:02d}'
+
+
+# ─────────────────────────────────────────────────────────────
+# POSTING
+# ─────────────────────────────────────────────────────────────
+def _due_batch(kind, day, after_id, limit, user_id=None):
+    table, column, _, _ = KINDS[kind]
+    lo, hi = day_bucket(day)
+    where, params = (" AND x.user_id=%s", (user_id,)) if user_id else ("", ())
+    return query(
+        DUE_BATCH_SQL.format(table=table, column=column, where=where),
+        (kind, period(day), lo, hi, day + timedelta(days=1), after_id) + params + (limit,), fetch='tuples'
+    )
+
+
+def _category_ids(name, user_ids):
+    """{user_id: id of the user's expense category `name`} in one query."""
+    ids = sorted(set(user_ids))
+    return dict(query(
+        f"""SELECT user_id, id FROM Categories
+            WHERE type='expense' AND name=%s AND user_id IN ({', '.join(['%s'] * len(ids))})""",
+        (name,) + tuple(ids), fetch='tuples'
+    ))
+
+
+def post_day(day, batch_size=RECURRING_BATCH_SIZE, user_id=None):
+    """Post every bill and subscription due on `day` (all users, or one) not posted yet. Returns the count."""
+    posted = 0
+    for kind, (_, _, category, note) in KINDS.items():
+        after_id = 0
+        while True:
+            items = _due_batch(kind, day, after_id, batch_size, user_id)
+            if not items:
+                break
+            after_id = items[-1][0]
+            cats = _category_ids(category, [user_id for _, user_id, _, _, _ in items])
+            try:
+                with transaction():
+                    ids = ledger.add_many([(user_id, cats.get(user_id), 'expense', amount, note + name, day)
+                                           for _, user_id, name, amount, _ in items])
+                    query_many(MARKER_SQL, [(kind, item_id, period(day), user_id, tid)
+                                            for (item_id, user_id, _, _, _), tid in zip(items, ids)])
+                    upcoming.advance([(kind, item_id, user_id, name, amount, upcoming.after_period(dom, period(day)))
+                                      for item_id, user_id, name, amount, dom in items])
+            except IntegrityError as e:
+                # Another runner posted some of these first (or an item was deleted meanwhile);
+                # the batch was rolled back and the next run picks up whatever is still due.
+                print(f"Recurring {kind} batch for {day} skipped: {e}", flush=True)
+                break
+            for owner in {item[1] for item in items}:
+                invalidate(owner)
+            posted += len(items)
+            if len(items) < batch_size:
+                break
+    return posted
+
+
+def run(today=None, days=RECURRING_LOOKBACK_DAYS, user_id=None):
+    """Post everything due in the `days` days up to and including `today` (all users, or one). Returns the count."""
+    today = today or date.today()
+    return sum(post_day(today - timedelta(days=n), user_id=user_id) for n in range(days - 1, -1, -1))
+
+
+def nearest_occurrence(day_of_month, day):
+    """The date the item falls on in the month before, of, or after `day`, whichever is closest."""
+    months = [(day.year - (day.month == 1), (day.month - 2) % 12 + 1), (day.year, day.month),
+              (day.year + (day.month == 12), day.month % 12 + 1)]
+    return min((occurrence(day_of_month, y, m) for y, m in months), key=lambda d: abs((d - day).days))
+
+
+def pay_now(kind, item, user_id, paid_date, category_id):
+    """
+    Post one item by hand (the pay buttons). The month paid is the item's
+    next due date in UpcomingDues – paying September late in October, or
+    October early in September, settles that month – falling back to the
+    occurrence closest to `paid_date`. The transaction is dated `paid_date`.
+    Raises AlreadyPosted if that month was posted already.
+    Returns the transaction id.
+    """
+    _, column, _, note = KINDS[kind]
+    day = paid_date if isinstance(paid_date, date) else date.fromisoformat(str(paid_date))
+    with transaction():
+        due = query("SELECT due_date FROM UpcomingDues WHERE kind=%s AND item_id=%s FOR UPDATE",
+                    (kind, item['id']), fetch='scalar')
+        month = period(due or nearest_occurrence(item[column], day))
+        tid = ledger.add_transaction(user_id, category_id, 'expense', item['amount'], note + item['name'], day)
+        try:
+            query(MARKER_SQL, (kind, item['id'], month, user_id, tid))
+        except IntegrityError:
+            raise AlreadyPosted(f"Already posted for {month}")
+        upcoming.advance([(kind, item['id'], user_id, item['name'], item['amount'],
+                           upcoming.after_period(item[column], month))])
+    return tid
+
+
+# ─────────────────────────────────────────────────────────────
+# BACKGROUND SCHEDULER
+# ─────────────────────────────────────────────────────────────
+_pid = None
+_lock = threading.Lock()
+
+
+def start_scheduler():
+    """Run run() every RECURRING_INTERVAL seconds on a daemon thread of this process."""
+    global _pid
+    with _lock:
+        if _pid == os.getpid():
+            return
+        _pid = os.getpid()
+        threading.Thread(target=_loop, name='recurring', daemon=True).start()
+
+
+def _loop():
+    while True:
+        try:
+            run()
+        except Exception as e:
+            print(f"Recurring posting error: {e}", flush=True)
+        time.sleep(RECURRING_INTERVAL)
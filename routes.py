@@ -1,12 +1,32 @@
+import io
+import itertools
+import json
 import math
 import random
-from datetime import date, timedelta, datetime
+from datetime import date, datetime, timedelta
 from functools import wraps
 
-from flask import Blueprint, request, session, redirect, url_for, render_template, jsonify
-from database import query
+from flask import (Blueprint, Response, request, session, redirect, url_for, render_template, jsonify,
+                   stream_with_context)
+from mysql.connector import IntegrityError, errorcode
+from database import StreamsBusy, query, query_many, bind_request_scope, own_transactions, release_connection
+from cache import bind_invalidation, cached, conditional
+from categories import seed_defaults, category_types, resolve as resolve_category, invalidate as invalidate_categories
+from analysis import build_analysis
+import admin
+import amortization
+import ledger
+import loans
+import recurring
+import upcoming
+from export import export_chunks, export_filename
+from passwords import PoolBusy, check_password, hash_password, stats as password_pool_stats
+from bank_import import StatementError, detect_format, import_statement
+from config import IDEMPOTENCY_KEY_DAYS
 
 routes_bp = Blueprint('routes', __name__)
+bind_invalidation(routes_bp)    # registered first so it runs after the commit
+bind_request_scope(routes_bp)
 
 # ─────────────────────────────────────────────────────────────
 # AUTH GUARD
@@ -23,68 +43,19 @@ def uid():
     return session['user_id']
 
 def _get_expense_cat(user_id, name):
-    """Find expense category id by name for the user, or None."""
-    row = query("SELECT id FROM Categories WHERE user_id=%s AND name=%s AND type='expense'",
-                (user_id, name), fetch=True)
-    return row[0]['id'] if row else None
+    """Find expense category id by name for the user, or None (from the cached category map)."""
+    return resolve_category(user_id, name, 'expense')
 
+def _arg_date(value):
+    """Parse an optional YYYY-MM-DD query argument; ValueError if malformed."""
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'Invalid date: {value}')
 
 
-# ─────────────────────────────────────────────────────────────
-# DEFAULT CATEGORIES + BUDGETS HELPER
-# ─────────────────────────────────────────────────────────────
-def _create_default_categories_and_budgets(user_id):
-    """Create default categories and budgets for a user. Safe to call anytime."""
-    income_cats = ['Salary', 'Freelance', 'Bonus', 'Investment Returns', 'Gifts', 'Other Income']
-    expense_cats = [
-        'Food & Dining', 'Transportation', 'Shopping', 'Utilities', 'Healthcare',
-        'Entertainment', 'Education', 'Insurance', 'Home & Rent', 'Personal Care',
-        'Phone & Internet', 'Gifts & Donations', 'Other Expense'
-    ]
-
-    for cat in income_cats:
-        try:
-            query("INSERT INTO Categories (user_id, name, type) VALUES (%s, %s, %s)",
-                  (user_id, cat, 'income'))
-        except Exception:
-            pass
-
-    cat_ids = {}
-    for cat in expense_cats:
-        try:
-            cid = query("INSERT INTO Categories (user_id, name, type) VALUES (%s, %s, %s)",
-                        (user_id, cat, 'expense'), lastrowid=True)
-            cat_ids[cat] = cid
-        except Exception:
-            row = query("SELECT id FROM Categories WHERE user_id=%s AND name=%s AND type='expense'",
-                        (user_id, cat), fetch=True)
-            if row:
-                cat_ids[cat] = row[0]['id']
-
-    current_month = datetime.now().strftime('%Y-%m')
-    default_budgets = {
-        'Food & Dining':     5000,
-        'Transportation':    3000,
-        'Shopping':          4000,
-        'Utilities':         2000,
-        'Healthcare':        2000,
-        'Entertainment':     2000,
-        'Education':         3000,
-        'Insurance':         1500,
-        'Home & Rent':      10000,
-        'Personal Care':     1000,
-        'Phone & Internet':  1000,
-        'Gifts & Donations': 1000,
-        'Other Expense':     2000,
-    }
-    for cat_name, amount in default_budgets.items():
-        cid = cat_ids.get(cat_name)
-        if cid:
-            try:
-                query("INSERT INTO Budgets (user_id, category_id, month, amount) VALUES (%s,%s,%s,%s)",
-                      (user_id, cid, current_month, amount))
-            except Exception:
-                pass
 
 # ─────────────────────────────────────────────────────────────
 # DASHBOARD
@@ -94,44 +65,46 @@ def _create_default_categories_and_budgets(user_id):
 def dashboard():
     return render_template('dashboard.html')
 
-@routes_bp.route('/api/dashboard')
-@login_required
-def api_dashboard():
-    transactions = query(
-        """SELECT t.*, c.name as category
-           FROM Transactions t
-           LEFT JOIN Categories c ON t.category_id=c.id
-           WHERE t.user_id=%s
-           ORDER BY t.date DESC LIMIT 20""",
-        (uid(),), fetch=True
-    )
-
-    income = query(
-        "SELECT IFNULL(SUM(amount),0) s FROM Transactions WHERE user_id=%s AND type='income'",
-        (uid(),), fetch=True
-    )[0]['s']
+RECENT_TRANSACTIONS_SQL = """
+    SELECT t.*, c.name as category
+    FROM Transactions t
+    LEFT JOIN Categories c ON t.category_id=c.id
+    WHERE t.user_id=%s
+    ORDER BY t.date DESC LIMIT 20
+"""
 
-    expense = query(
-        "SELECT IFNULL(SUM(amount),0) s FROM Transactions WHERE user_id=%s AND type='expense'",
-        (uid(),), fetch=True
-    )[0]['s']
-
-    for t in transactions:
-        t['date'] = str(t['date'])
-        t['amount'] = float(t['amount'])
+def _dashboard_data(user_id, totals):
+    transactions = query(RECENT_TRANSACTIONS_SQL, (user_id,), fetch=True)
+    income, expense = totals['income'], totals['expense']
 
     # Savings goals
-    goals = query("SELECT * FROM SavingsGoals WHERE user_id=%s", (uid(),), fetch=True) or []
-    for g in goals:
-        g['target'] = float(g['target'])
-        g['saved']  = float(g['saved'])
+    goals = query("SELECT * FROM SavingsGoals WHERE user_id=%s", (user_id,), fetch=True) or []
 
-    return jsonify({
+    return {
         'transactions': transactions,
-        'income': float(income),
-        'expense': float(expense),
-        'balance': float(income) - float(expense),
+        'income': income,
+        'expense': expense,
+        'balance': income - expense,
         'goals': goals
+    }
+
+@routes_bp.route('/api/dashboard')
+@login_required
+@cached
+def api_dashboard():
+    return jsonify(_dashboard_data(uid(), ledger.totals(uid())))
+
+@routes_bp.route('/api/bootstrap')
+@login_required
+@cached
+def api_bootstrap():
+    """Everything the dashboard shows on first paint, from one set of totals."""
+    user_id = uid()
+    totals = ledger.totals(user_id)
+    return jsonify({
+        'dashboard': _dashboard_data(user_id, totals),
+        'health': _health_score_data(user_id, totals),
+        'categories': _categories_data(user_id),
     })
 
 # ─────────────────────────────────────────────────────────────
@@ -171,18 +144,8 @@ def add_to_savings_goal(gid):
 # ─────────────────────────────────────────────────────────────
 # HEALTH SCORE
 # ─────────────────────────────────────────────────────────────
-@routes_bp.route('/api/health-score')
-@login_required
-def health_score():
-    user_id = uid()
-    income = float(query(
-        "SELECT IFNULL(SUM(amount),0) s FROM Transactions WHERE user_id=%s AND type='income'",
-        (user_id,), fetch=True
-    )[0]['s'] or 0)
-    expense = float(query(
-        "SELECT IFNULL(SUM(amount),0) s FROM Transactions WHERE user_id=%s AND type='expense'",
-        (user_id,), fetch=True
-    )[0]['s'] or 0)
+def _health_score_data(user_id, totals):
+    income, expense = totals['income'], totals['expense']
 
     score = 50
     suggestions = []
@@ -205,8 +168,7 @@ def health_score():
     else:
         suggestions.append('💡 Add income transactions to get a score.')
 
-    budgets = query("SELECT COUNT(*) as cnt FROM Budgets WHERE user_id=%s", (user_id,), fetch=True)
-    if budgets and budgets[0]['cnt'] > 0:
+    if query("SELECT COUNT(*) FROM Budgets WHERE user_id=%s", (user_id,), fetch='scalar'):
         score += 10
     else:
         suggestions.append('💡 Set budgets to better track spending.')
@@ -225,25 +187,156 @@ def health_score():
     if not suggestions:
         suggestions.append('✅ Keep up the great financial habits!')
 
-    return jsonify({'score': score, 'grade': grade, 'message': message, 'suggestions': suggestions})
+    return {'score': score, 'grade': grade, 'message': message, 'suggestions': suggestions}
+
+@routes_bp.route('/api/health-score')
+@login_required
+@cached
+def health_score():
+    return jsonify(_health_score_data(uid(), ledger.totals(uid())))
 
 # ─────────────────────────────────────────────────────────────
 # TRANSACTIONS
 # ─────────────────────────────────────────────────────────────
+@routes_bp.route('/api/transactions', methods=['GET'])
+@login_required
+@conditional
+def list_transactions():
+    """
+    Browse the full history, newest first.
+    Query args: cursor, limit (≤500), from, to, type, category_id, min_amount, max_amount.
+    """
+    a = request.args
+    try:
+        limit = min(max(int(a.get('limit', 50)), 1), 500)
+        type_ = a.get('type')
+        if type_ not in (None, 'income', 'expense'):
+            raise ValueError('type must be income or expense')
+        rows, next_cursor = ledger.list_transactions(
+            uid(), cursor=a.get('cursor'), limit=limit,
+            date_from=_arg_date(a.get('from')), date_to=_arg_date(a.get('to')), type_=type_,
+            category_id=a.get('category_id', type=int),
+            min_amount=a.get('min_amount', type=float), max_amount=a.get('max_amount', type=float),
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'transactions': rows, 'next_cursor': next_cursor})
+
 @routes_bp.route('/api/transactions', methods=['POST'])
 @login_required
 def add_transaction():
     d = request.json
-    query(
-        "INSERT INTO Transactions (user_id,category_id,type,amount,note,date) VALUES (%s,%s,%s,%s,%s,%s)",
-        (uid(), d.get('category_id') or None, d['type'], d['amount'], d.get('note',''), d['date'])
-    )
+    ledger.add_transaction(uid(), d.get('category_id') or None, d['type'], d['amount'],
+                           d.get('note',''), d['date'])
     return jsonify({'status': 'ok'})
 
+BATCH_MAX_ITEMS = 1000
+
+PURGE_IDEMPOTENCY_KEYS_SQL = "DELETE FROM IdempotencyKeys WHERE created_at < %s LIMIT %s"
+
+def purge_idempotency_keys(days=IDEMPOTENCY_KEY_DAYS, batch_size=1000):
+    """
+    Delete Idempotency-Key responses older than `days`, `batch_size` rows per
+    statement so no delete holds its locks for long. Returns the number deleted.
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+    deleted = 0
+    while True:
+        n = query_many(PURGE_IDEMPOTENCY_KEYS_SQL, [(cutoff, batch_size)])
+        deleted += n
+        if n < batch_size:
+            return deleted
+
+def _validate_transaction(item, categories):
+    """Return (category_id, type, amount, note, date) for a batch item, or raise ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError('Item must be an object')
+    type_ = item.get('type')
+    if type_ not in ('income', 'expense'):
+        raise ValueError('type must be income or expense')
+    try:
+        amount = round(float(item.get('amount')), 2)
+    except (TypeError, ValueError):
+        raise ValueError('amount must be a number')
+    if not 0 < amount < 1e10:
+        raise ValueError('amount must be positive')
+    day = _arg_date(str(item.get('date')))
+    category_id = item.get('category_id') or None
+    if category_id is not None:
+        try:
+            category_id = int(category_id)
+        except (TypeError, ValueError):
+            raise ValueError('category_id must be an integer')
+    if category_id is not None and categories.get(category_id) != type_:
+        raise ValueError(f'Unknown {type_} category {category_id}')
+    note = str(item.get('note') or '')[:255]
+    return category_id, type_, amount, note, day
+
+def _validate_batch(items, categories):
+    """Return (results, valid): an error entry or None per item, and [(index, row)] of the valid ones."""
+    results, valid = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, _validate_transaction(item, categories)))
+            results.append(None)
+        except ValueError as e:
+            results.append({'index': index, 'status': 'error', 'error': str(e)})
+    return results, valid
+
+@routes_bp.route('/api/transactions/batch', methods=['POST'])
+@login_required
+def add_transactions_batch():
+    """
+    Insert up to BATCH_MAX_ITEMS transactions in one transaction.
+    Body: {"transactions": [...]} (or a bare list). Invalid items are reported
+    per index and skipped. Send an Idempotency-Key header to make retries safe:
+    a repeated key replays the first response instead of inserting again, for
+    IDEMPOTENCY_KEY_DAYS (see purge_idempotency_keys).
+    """
+    user_id = uid()
+    d = request.json
+    items = d.get('transactions') if isinstance(d, dict) else d
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'Expected a non-empty list of transactions'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f'At most {BATCH_MAX_ITEMS} transactions per batch'}), 400
+
+    idem_key = request.headers.get('Idempotency-Key', '').strip()[:100]
+    if idem_key:
+        # The key row is written in this request's transaction: a concurrent retry
+        # waits on it, and a failed request leaves no key behind.
+        if not query_many("INSERT IGNORE INTO IdempotencyKeys (user_id, idem_key) VALUES (%s,%s)",
+                          [(user_id, idem_key)]):
+            stored = query("SELECT response FROM IdempotencyKeys WHERE user_id=%s AND idem_key=%s",
+                           (user_id, idem_key), fetch=True)
+            return jsonify(json.loads(stored[0]['response']))
+
+    # The cached category map can trail another worker's add or delete by a moment:
+    # an unknown id, or an id whose category is gone (FK error), is checked again
+    # against the table before the item is rejected.
+    results, valid = _validate_batch(items, category_types(user_id))
+    if len(valid) < len(items):
+        results, valid = _validate_batch(items, category_types(user_id, fresh=True))
+    try:
+        ids = ledger.add_transactions(user_id, [row for _, row in valid])
+    except IntegrityError as e:
+        if e.errno != errorcode.ER_NO_REFERENCED_ROW_2:
+            raise
+        results, valid = _validate_batch(items, category_types(user_id, fresh=True))
+        ids = ledger.add_transactions(user_id, [row for _, row in valid])
+    for (index, _), tid in zip(valid, ids):
+        results[index] = {'index': index, 'status': 'created', 'id': tid}
+
+    body = {'status': 'ok', 'created': len(ids), 'failed': len(items) - len(ids), 'results': results}
+    if idem_key:
+        query("UPDATE IdempotencyKeys SET response=%s WHERE user_id=%s AND idem_key=%s",
+              (json.dumps(body), user_id, idem_key))
+    return jsonify(body)
+
 @routes_bp.route('/api/transactions/<int:tid>', methods=['DELETE'])
 @login_required
 def delete_transaction(tid):
-    query("DELETE FROM Transactions WHERE id=%s AND user_id=%s", (tid, uid()))
+    ledger.delete_transaction(uid(), tid)
     return jsonify({'status': 'ok'})
 
 # ─────────────────────────────────────────────────────────────
@@ -254,17 +347,13 @@ def delete_transaction(tid):
 def investments():
     return render_template('investment.html')
 
+INVESTMENTS_SQL = "SELECT * FROM Investments WHERE user_id=%s ORDER BY invest_date DESC"
+
 @routes_bp.route('/api/investments', methods=['GET'])
 @login_required
+@conditional
 def get_investments():
-    rows = query(
-        "SELECT * FROM Investments WHERE user_id=%s ORDER BY invest_date DESC",
-        (uid(),), fetch=True
-    )
-    for r in rows:
-        r['amount'] = float(r['amount'])
-        r['current_val'] = float(r['current_val'])
-        r['invest_date'] = str(r['invest_date'])
+    rows = query(INVESTMENTS_SQL, (uid(),), fetch=True)
     return jsonify(rows)
 
 @routes_bp.route('/api/investments', methods=['POST'])
@@ -277,10 +366,7 @@ def add_investment():
     """, (uid(), d['name'], d['type'], d['amount'],
           d.get('current_val', d['amount']), d['invest_date'], d.get('note','')))
     cat_id = _get_expense_cat(uid(), 'Other Expense')
-    query(
-        "INSERT INTO Transactions (user_id,category_id,type,amount,note,date) VALUES (%s,%s,%s,%s,%s,%s)",
-        (uid(), cat_id, 'expense', d['amount'], f"Investment: {d['name']}", d['invest_date'])
-    )
+    ledger.add_transaction(uid(), cat_id, 'expense', d['amount'], f"Investment: {d['name']}", d['invest_date'])
     return jsonify({'status': 'ok'})
 
 @routes_bp.route('/api/investments/<int:iid>', methods=['DELETE'])
@@ -299,10 +385,9 @@ def accounts():
 
 @routes_bp.route('/api/accounts', methods=['GET'])
 @login_required
+@conditional
 def get_accounts():
     rows = query("SELECT * FROM Accounts WHERE user_id=%s", (uid(),), fetch=True)
-    for r in rows:
-        r['balance'] = float(r['balance'])
     return jsonify(rows)
 
 @routes_bp.route('/api/accounts', methods=['POST'])
@@ -331,20 +416,20 @@ def bills():
 
 @routes_bp.route('/api/bills', methods=['GET'])
 @login_required
+@conditional
 def get_bills():
     rows = query("SELECT * FROM Bills WHERE user_id=%s", (uid(),), fetch=True)
-    for r in rows:
-        r['amount'] = float(r['amount'])
     return jsonify(rows)
 
 @routes_bp.route('/api/bills', methods=['POST'])
 @login_required
 def add_bill():
     d = request.json
-    query(
+    bid = query(
         "INSERT INTO Bills (user_id,name,amount,due_day,category) VALUES (%s,%s,%s,%s,%s)",
-        (uid(), d['name'], d['amount'], d['due_day'], d.get('category','Other'))
+        (uid(), d['name'], d['amount'], d['due_day'], d.get('category','Other')), lastrowid=True
     )
+    upcoming.set_due('bill', bid, uid(), d['name'], d['amount'], upcoming.first_due(d['due_day']))
     return jsonify({'status': 'ok'})
 
 @routes_bp.route('/api/bills/<int:bid>/pay', methods=['POST'])
@@ -357,19 +442,18 @@ def pay_bill(bid):
     b = bill[0]
     d = request.json
     paid_date = d.get('date', datetime.now().strftime('%Y-%m-%d'))
-    # Find matching category
-    cat_id = _get_expense_cat(uid(), 'Utilities')
-    # Add expense transaction
-    query(
-        "INSERT INTO Transactions (user_id,category_id,type,amount,note,date) VALUES (%s,%s,%s,%s,%s,%s)",
-        (uid(), cat_id, 'expense', float(b['amount']), f"Bill Paid: {b['name']}", paid_date)
-    )
+    # Add expense transaction, unless this month's bill is already posted
+    try:
+        recurring.pay_now('bill', b, uid(), paid_date, _get_expense_cat(uid(), 'Utilities'))
+    except recurring.AlreadyPosted as e:
+        return jsonify({'error': str(e)}), 409
     return jsonify({'status': 'ok', 'amount': float(b['amount'])})
 
 @routes_bp.route('/api/bills/<int:bid>', methods=['DELETE'])
 @login_required
 def delete_bill(bid):
     query("DELETE FROM Bills WHERE id=%s AND user_id=%s", (bid, uid()))
+    upcoming.remove('bill', bid, uid())
     return jsonify({'status': 'ok'})
 
 # ─────────────────────────────────────────────────────────────
@@ -382,12 +466,12 @@ def settings():
 
 @routes_bp.route('/api/profile', methods=['GET'])
 @login_required
+@conditional
 def get_profile():
     user = query(
         "SELECT id,name,email,created_at FROM Users WHERE id=%s",
         (uid(),), fetch=True
     )[0]
-    user['created_at'] = str(user['created_at'])
     prefs = query(
         "SELECT currency, theme FROM UserPreferences WHERE user_id=%s",
         (uid(),), fetch=True
@@ -412,12 +496,15 @@ def update_profile():
 @routes_bp.route('/api/change-password', methods=['POST'])
 @login_required
 def change_password():
-    import bcrypt
     d = request.json
     user = query("SELECT password FROM Users WHERE id=%s", (uid(),), fetch=True)[0]
-    if not bcrypt.checkpw(d['old_password'].encode(), user['password'].encode()):
-        return jsonify({'message': 'Current password is incorrect.'}), 400
-    hashed = bcrypt.hashpw(d['new_password'].encode(), bcrypt.gensalt()).decode()
+    release_connection()    # not held while bcrypt runs
+    try:
+        if not check_password(d['old_password'], user['password']):
+            return jsonify({'message': 'Current password is incorrect.'}), 400
+        hashed = hash_password(d['new_password'])
+    except PoolBusy as e:
+        return jsonify({'error': str(e)}), 503
     query("UPDATE Users SET password=%s WHERE id=%s", (hashed, uid()))
     return jsonify({'status': 'ok'})
 
@@ -431,146 +518,11 @@ def analysis():
 
 @routes_bp.route('/api/analysis')
 @login_required
+@cached
 def api_analysis():
     """Return comprehensive analysis data from all pages"""
     try:
-        uid_val = uid()
-        months_data = {}
-        today = datetime.now()
-
-        for i in range(11, -1, -1):
-            month_date = today - timedelta(days=30*i)
-            month_key = month_date.strftime('%Y-%m')
-            month_label = month_date.strftime('%b %Y')
-            months_data[month_key] = {'label': month_label, 'income': 0, 'expense': 0}
-
-        start_date = (today - timedelta(days=365)).strftime('%Y-%m-01')
-
-        transactions = query(
-            """SELECT DATE_FORMAT(date, '%Y-%m') as month, type, SUM(amount) as total
-               FROM Transactions
-               WHERE user_id=%s AND date >= %s
-               GROUP BY DATE_FORMAT(date, '%Y-%m'), type""",
-            (uid_val, start_date), fetch=True
-        )
-
-        if transactions:
-            for t in transactions:
-                month_key = t['month']
-                if month_key in months_data:
-                    if t['type'] == 'income':
-                        months_data[month_key]['income'] = float(t['total'])
-                    else:
-                        months_data[month_key]['expense'] = float(t['total'])
-
-        months, income, expense, savings = [], [], [], []
-        for month_key in sorted(months_data.keys()):
-            data = months_data[month_key]
-            months.append(data['label'])
-            inc = data['income']
-            exp = data['expense']
-            income.append(inc)
-            expense.append(exp)
-            savings.append(inc - exp)
-
-        income_by_cat = query(
-            """SELECT c.name as category, SUM(t.amount) as total
-               FROM Transactions t
-               LEFT JOIN Categories c ON t.category_id=c.id
-               WHERE t.user_id=%s AND t.type='income' AND date >= %s
-               GROUP BY c.id, c.name ORDER BY total DESC""",
-            (uid_val, start_date), fetch=True
-        ) or []
-        income_cats = [r['category'] or 'Uncategorized' for r in income_by_cat]
-        income_vals = [float(r['total']) if r['total'] else 0 for r in income_by_cat]
-
-        expense_by_cat = query(
-            """SELECT c.name as category, SUM(t.amount) as total
-               FROM Transactions t
-               LEFT JOIN Categories c ON t.category_id=c.id
-               WHERE t.user_id=%s AND t.type='expense' AND date >= %s
-               GROUP BY c.id, c.name ORDER BY total DESC""",
-            (uid_val, start_date), fetch=True
-        ) or []
-        expense_cats = [r['category'] or 'Uncategorized' for r in expense_by_cat]
-        expense_vals = [float(r['total']) if r['total'] else 0 for r in expense_by_cat]
-
-        accounts = query(
-            "SELECT type, SUM(balance) as total FROM Accounts WHERE user_id=%s GROUP BY type",
-            (uid_val,), fetch=True
-        ) or []
-        account_types  = [a['type'].upper() if a['type'] else 'Unknown' for a in accounts]
-        account_values = [float(a['total']) if a['total'] else 0 for a in accounts]
-
-        investments = query(
-            "SELECT type, COUNT(*) as count, SUM(current_val) as total FROM Investments WHERE user_id=%s GROUP BY type ORDER BY total DESC",
-            (uid_val,), fetch=True
-        ) or []
-        inv_types  = [inv['type'] or 'Other' for inv in investments]
-        inv_counts = [int(inv['count']) for inv in investments]
-        inv_values = [float(inv['total']) if inv['total'] else 0 for inv in investments]
-
-        bills = query(
-            "SELECT category, COUNT(*) as count, SUM(amount) as total FROM Bills WHERE user_id=%s GROUP BY category ORDER BY total DESC LIMIT 10",
-            (uid_val,), fetch=True
-        ) or []
-        bill_cats   = [b['category'] or 'Other' for b in bills]
-        bill_counts = [int(b['count']) for b in bills]
-        bill_vals   = [float(b['total']) if b['total'] else 0 for b in bills]
-
-        subscriptions = query(
-            "SELECT name, amount FROM Subscriptions WHERE user_id=%s ORDER BY amount DESC LIMIT 10",
-            (uid_val,), fetch=True
-        ) or []
-        sub_names  = [s['name'][:15] for s in subscriptions]
-        sub_values = [float(s['amount']) for s in subscriptions]
-
-        # ─── TRIPS (fixed: uses TripExpenses JOIN) ───────────────
-        trips = query(
-            """SELECT t.destination, COALESCE(SUM(te.amount), 0) as spent
-               FROM Trips t
-               LEFT JOIN TripExpenses te ON te.trip_id = t.id
-               WHERE t.user_id=%s
-               GROUP BY t.id, t.destination
-               ORDER BY spent DESC LIMIT 10""",
-            (uid_val,), fetch=True
-        ) or []
-        trip_names  = [t['destination'][:15] for t in trips]
-        trip_values = [float(t['spent']) if t['spent'] else 0 for t in trips]
-
-        loans = query(
-            "SELECT loan_name, principal, emi, total_int FROM Loans WHERE user_id=%s ORDER BY principal DESC LIMIT 10",
-            (uid_val,), fetch=True
-        ) or []
-        loan_names      = [l['loan_name'][:15] for l in loans]
-        loan_principals = [float(l['principal']) for l in loans]
-        loan_emis       = [float(l['emi']) if l['emi'] else 0 for l in loans]
-        loan_interests  = [float(l['total_int']) if l['total_int'] else 0 for l in loans]
-
-        budgets = query(
-            """SELECT b.amount, c.name
-               FROM Budgets b
-               LEFT JOIN Categories c ON b.category_id=c.id
-               WHERE b.user_id=%s
-               ORDER BY b.amount DESC LIMIT 10""",
-            (uid_val,), fetch=True
-        ) or []
-        budget_cats = [bg['name'][:15] for bg in budgets if bg['name']]
-        budget_vals = [float(bg['amount']) if bg['amount'] else 0 for bg in budgets if bg['name']]
-
-        return jsonify({
-            'months': months, 'income': income, 'expense': expense, 'savings': savings,
-            'income_categories': income_cats, 'income_values': income_vals,
-            'expense_categories': expense_cats, 'expense_values': expense_vals,
-            'account_types': account_types, 'account_values': account_values,
-            'inv_types': inv_types, 'inv_counts': inv_counts, 'inv_values': inv_values,
-            'bill_categories': bill_cats, 'bill_counts': bill_counts, 'bill_values': bill_vals,
-            'subscription_names': sub_names, 'subscription_values': sub_values,
-            'trip_names': trip_names, 'trip_values': trip_values,
-            'loan_names': loan_names, 'loan_principals': loan_principals,
-            'loan_emis': loan_emis, 'loan_interests': loan_interests,
-            'budget_categories': budget_cats, 'budget_values': budget_vals
-        })
+        return jsonify(build_analysis(uid()))
     except Exception as e:
         print(f"Analysis API error: {str(e)}", flush=True)
         return jsonify({'error': str(e)}), 500
@@ -583,37 +535,47 @@ def api_analysis():
 def categories():
     return render_template('categories.html')
 
+CATEGORIES_SQL = "SELECT * FROM Categories WHERE user_id=%s ORDER BY type, name"
+
+def _categories_data(user_id):
+    rows = query(CATEGORIES_SQL, (user_id,), fetch=True)
+    if not rows:
+        seed_defaults(user_id)
+        rows = query(CATEGORIES_SQL, (user_id,), fetch=True)
+    return rows
+
 @routes_bp.route('/api/categories')
 @login_required
+@cached
 def get_categories():
-    user_id = uid()
-    existing = query("SELECT COUNT(*) as cnt FROM Categories WHERE user_id=%s", (user_id,), fetch=True)
-    if existing and existing[0]['cnt'] == 0:
-        _create_default_categories_and_budgets(user_id)
-    rows = query("SELECT * FROM Categories WHERE user_id=%s ORDER BY type, name", (user_id,), fetch=True)
-    return jsonify(rows)
+    return jsonify(_categories_data(uid()))
 
 @routes_bp.route('/api/setup-defaults', methods=['POST'])
 @login_required
 def setup_defaults():
     """Repair endpoint: re-create missing categories/budgets for existing users."""
-    _create_default_categories_and_budgets(uid())
+    seed_defaults(uid())
     return jsonify({'status': 'ok', 'message': 'Defaults created'})
 
 @routes_bp.route('/api/categories', methods=['POST'])
 @login_required
 def add_category():
     d = request.json
-    query(
-        "INSERT INTO Categories (user_id,name,type) VALUES (%s,%s,%s)",
-        (uid(), d['name'], d['type'])
+    cid = query(
+        "INSERT IGNORE INTO Categories (user_id,name,type) VALUES (%s,%s,%s)",
+        (uid(), d['name'], d['type']), lastrowid=True
     )
+    if not cid:
+        return jsonify({'error': 'Category already exists'}), 409
+    invalidate_categories(uid())
     return jsonify({'status': 'ok'})
 
 @routes_bp.route('/api/categories/<int:cid>', methods=['DELETE'])
 @login_required
 def delete_category(cid):
+    ledger.forget_category(uid(), cid)
     query("DELETE FROM Categories WHERE id=%s AND user_id=%s", (cid, uid()))
+    invalidate_categories(uid())
     return jsonify({'status': 'ok'})
 
 # ─────────────────────────────────────────────────────────────
@@ -624,15 +586,18 @@ def delete_category(cid):
 def budgets():
     return render_template('budgets.html')
 
+BUDGETS_SQL = """
+    SELECT b.id, b.amount, b.month, b.category_id, c.name as category_name
+    FROM Budgets b
+    LEFT JOIN Categories c ON b.category_id=c.id
+    WHERE b.user_id=%s
+"""
+
 @routes_bp.route('/api/budgets')
 @login_required
+@conditional
 def get_budgets():
-    rows = query("""SELECT b.id, b.amount, b.month, b.category_id, c.name as category_name
-                    FROM Budgets b
-                    LEFT JOIN Categories c ON b.category_id=c.id
-                    WHERE b.user_id=%s""", (uid(),), fetch=True)
-    for r in rows:
-        r['amount'] = float(r['amount'])
+    rows = query(BUDGETS_SQL, (uid(),), fetch=True)
     return jsonify(rows)
 
 @routes_bp.route('/api/budgets', methods=['POST'])
@@ -640,7 +605,8 @@ def get_budgets():
 def add_budget():
     d = request.json
     query(
-        "INSERT INTO Budgets (user_id,category_id,month,amount) VALUES (%s,%s,%s,%s)",
+        """INSERT INTO Budgets (user_id,category_id,month,amount) VALUES (%s,%s,%s,%s)
+           ON DUPLICATE KEY UPDATE amount=VALUES(amount)""",
         (uid(), d.get('category_id'), d['month'], d['amount'])
     )
     return jsonify({'status': 'ok'})
@@ -659,19 +625,19 @@ def delete_budget(bid):
 def trips():
     return render_template('trips.html')
 
+TRIPS_SQL = """
+    SELECT t.*, COALESCE(SUM(te.amount), 0) as spent
+    FROM Trips t
+    LEFT JOIN TripExpenses te ON te.trip_id = t.id
+    WHERE t.user_id=%s
+    GROUP BY t.id
+"""
+
 @routes_bp.route('/api/trips')
 @login_required
+@conditional
 def get_trips():
-    rows = query("SELECT * FROM Trips WHERE user_id=%s", (uid(),), fetch=True)
-    for r in rows:
-        r['budget'] = float(r['budget'])
-        r['start_date'] = str(r['start_date'])
-        r['end_date'] = str(r['end_date'])
-        spent_row = query(
-            "SELECT COALESCE(SUM(amount), 0) as total FROM TripExpenses WHERE trip_id=%s",
-            (r['id'],), fetch=True
-        )
-        r['spent'] = float(spent_row[0]['total']) if spent_row else 0.0
+    rows = query(TRIPS_SQL, (uid(),), fetch=True)
     return jsonify(rows)
 
 @routes_bp.route('/api/trips', methods=['POST'])
@@ -713,21 +679,14 @@ def subscriptions():
 
 @routes_bp.route('/api/subscriptions')
 @login_required
+@conditional
 def get_subscriptions():
     rows = query("SELECT * FROM Subscriptions WHERE user_id=%s", (uid(),), fetch=True)
     today = datetime.now().date()
     for r in rows:
-        r['amount'] = float(r['amount'])
-        # Calculate next renewal date
-        renewal_day = int(r['renewal_day'])
-        next_renewal = today.replace(day=renewal_day)
-        if next_renewal <= today:
-            # Move to next month
-            if today.month == 12:
-                next_renewal = next_renewal.replace(year=today.year+1, month=1)
-            else:
-                next_renewal = next_renewal.replace(month=today.month+1)
-        r['next_renewal'] = str(next_renewal)
+        # Next renewal date (day 29–31 falls on the last day of shorter months)
+        next_renewal = recurring.next_occurrence(r['renewal_day'], today)
+        r['next_renewal'] = next_renewal
         r['days_left'] = (next_renewal - today).days
     return jsonify(rows)
 
@@ -735,16 +694,18 @@ def get_subscriptions():
 @login_required
 def add_subscription():
     d = request.json
-    query(
+    sid = query(
         "INSERT INTO Subscriptions (user_id,name,amount,renewal_day) VALUES (%s,%s,%s,%s)",
-        (uid(), d['name'], d['amount'], d['renewal_day'])
+        (uid(), d['name'], d['amount'], d['renewal_day']), lastrowid=True
     )
+    upcoming.set_due('subscription', sid, uid(), d['name'], d['amount'], upcoming.first_due(d['renewal_day']))
     return jsonify({'status': 'ok'})
 
 @routes_bp.route('/api/subscriptions/<int:sid>', methods=['DELETE'])
 @login_required
 def delete_subscription(sid):
     query("DELETE FROM Subscriptions WHERE id=%s AND user_id=%s", (sid, uid()))
+    upcoming.remove('subscription', sid, uid())
     return jsonify({'status': 'ok'})
 
 @routes_bp.route('/api/subscriptions/<int:sid>/pay', methods=['POST'])
@@ -757,11 +718,10 @@ def pay_subscription(sid):
     s = sub[0]
     d = request.json
     paid_date = d.get('date', datetime.now().strftime('%Y-%m-%d'))
-    cat_id = _get_expense_cat(uid(), 'Phone & Internet')
-    query(
-        "INSERT INTO Transactions (user_id,category_id,type,amount,note,date) VALUES (%s,%s,%s,%s,%s,%s)",
-        (uid(), cat_id, 'expense', float(s['amount']), f"Subscription: {s['name']}", paid_date)
-    )
+    try:
+        recurring.pay_now('subscription', s, uid(), paid_date, _get_expense_cat(uid(), 'Phone & Internet'))
+    except recurring.AlreadyPosted as e:
+        return jsonify({'error': str(e)}), 409
     return jsonify({'status': 'ok', 'amount': float(s['amount'])})
 
 # ─────────────────────────────────────────────────────────────
@@ -774,53 +734,16 @@ def emi_tracker():
 
 @routes_bp.route('/api/loans')
 @login_required
+@conditional
 def get_loans():
-    rows = query("SELECT * FROM Loans WHERE user_id=%s", (uid(),), fetch=True)
-
-    for r in rows:
-        r['principal'] = float(r['principal'])
-        r['rate'] = float(r['rate'])
-        r['emi'] = float(r['emi']) if r['emi'] else 0
-        r['total_int'] = float(r['total_int']) if r['total_int'] else 0
-        r['tenure'] = int(r['tenure'])
-
-        payments = query(
-            "SELECT SUM(amount) as total FROM EmiPayments WHERE loan_id=%s",
-            (r['id'],), fetch=True
-        )
-        amount_paid = float(payments[0]['total']) if payments[0]['total'] else 0
-        r['amount_paid'] = amount_paid
-        r['amount_left'] = (r['principal'] + r['total_int']) - amount_paid
-
-        months_paid = int(amount_paid / r['emi']) if r['emi'] > 0 else 0
-        r['months_paid'] = months_paid
-        r['months_left'] = max(0, r['tenure'] - months_paid)
-        r['progress_pct'] = 0 if r['tenure'] == 0 else int((months_paid / r['tenure']) * 100)
-
-        created = r['created_at']
-        next_due_date = created + timedelta(days=30 * (months_paid + 1))
-        r['next_due'] = next_due_date.strftime('%Y-%m-%d')
-
-        today = datetime.now()
-        r['days_to_due'] = (next_due_date.date() - today.date()).days
-
-    return jsonify(rows)
+    return jsonify(loans.list_loans(uid()))
 
 @routes_bp.route('/api/loans', methods=['POST'])
 @login_required
 def add_loan():
     d = request.json
-    principal = float(d['principal'])
-    rate = float(d['rate']) / 12 / 100
     tenure = int(d['tenure']) * 12
-
-    emi = principal * rate * ((1 + rate) ** tenure) / (((1 + rate) ** tenure) - 1)
-    total_int = (emi * tenure) - principal
-
-    query(
-        "INSERT INTO Loans (user_id,loan_name,principal,rate,tenure,emi,total_int) VALUES (%s,%s,%s,%s,%s,%s,%s)",
-        (uid(), d.get('loan_name', 'My Loan'), principal, d['rate'], tenure, emi, total_int)
-    )
+    loans.create_loan(uid(), d.get('loan_name', 'My Loan'), float(d['principal']), float(d['rate']), tenure)
     return jsonify({'status': 'ok'})
 
 @routes_bp.route('/api/emi-calc', methods=['POST'])
@@ -832,6 +755,7 @@ def emi_calc():
 @login_required
 def delete_loan(lid):
     query("DELETE FROM Loans WHERE id=%s AND user_id=%s", (lid, uid()))
+    upcoming.remove('loan', lid, uid())
     return jsonify({'status': 'ok'})
 
 @routes_bp.route('/api/loans/<int:lid>/pay', methods=['POST'])
@@ -840,33 +764,177 @@ def pay_emi(lid):
     d = request.json
     amt  = float(d['amount'])
     date = d['date']
-    note = d.get('note', '')
-    # Save to EMI payment history
-    query(
-        "INSERT INTO EmiPayments (loan_id, paid_date, amount, note) VALUES (%s, %s, %s, %s)",
-        (lid, date, amt, note)
-    )
-    # Get loan name for transaction note
-    loan = query("SELECT loan_name FROM Loans WHERE id=%s AND user_id=%s", (lid, uid()), fetch=True)
-    loan_name = loan[0]['loan_name'] if loan else 'EMI'
+    # Payment history and loan state move together; nothing is written for someone else's loan
+    loan = loans.record_payment(uid(), lid, amt, date, d.get('note', ''))
+    if not loan:
+        return jsonify({'error': 'Loan not found'}), 404
     # Auto-add as expense transaction
     cat_id = _get_expense_cat(uid(), 'Insurance')
-    query(
-        "INSERT INTO Transactions (user_id,category_id,type,amount,note,date) VALUES (%s,%s,%s,%s,%s,%s)",
-        (uid(), cat_id, 'expense', amt, f"EMI Paid: {loan_name}", date)
-    )
+    ledger.add_transaction(uid(), cat_id, 'expense', amt, f"EMI Paid: {loan['loan_name']}", date)
     return jsonify({'status': 'ok'})
 
 @routes_bp.route('/api/loans/<int:lid>/payments')
 @login_required
 def get_loan_payments(lid):
-    rows = query(
-        "SELECT * FROM EmiPayments WHERE loan_id=%s ORDER BY paid_date DESC",
-        (lid,), fetch=True
-    )
-    for r in rows:
-        r['amount'] = float(r['amount'])
-    return jsonify(rows)
+    if not _owned_loan(lid):
+        return jsonify({'error': 'Loan not found'}), 404
+    return jsonify(loans.payments(uid(), lid))
+
+WHAT_IF_MAX_SCENARIOS = 50
+
+def _owned_loan(lid):
+    rows = query("SELECT * FROM Loans WHERE id=%s AND user_id=%s", (lid, uid()), fetch=True)
+    return rows[0] if rows else None
+
+def _round(values):
+    return [round(float(v), 2) for v in values]
+
+@routes_bp.route('/api/loans/<int:lid>/schedule')
+@login_required
+def get_loan_schedule(lid):
+    """Month-by-month EMI split (interest / principal / balance) with real due dates."""
+    loan = _owned_loan(lid)
+    if not loan:
+        return jsonify({'error': 'Loan not found'}), 404
+    months = int(loan['tenure'])
+    result = amortization.schedules(loan['principal'], loan['rate'], months)
+    return jsonify({
+        'loan_id': lid,
+        'emi': round(float(result['emi'][0]), 2),
+        'total_interest': round(float(result['interest'][0].sum()), 2),
+        'due_dates': amortization.due_dates(loan['created_at'].date(), months),
+        'payment': _round(result['payment'][0]),
+        'interest': _round(result['interest'][0]),
+        'principal': _round(result['principal'][0]),
+        'balance': _round(result['balance'][0]),
+    })
+
+@routes_bp.route('/api/loans/what-if', methods=['POST'])
+@login_required
+def loan_what_if():
+    """
+    Compare scenarios against one loan in a single vectorized run.
+    Body: {"loan_id": 3} or {"principal", "rate", "tenure_months"}, plus
+    "scenarios": [{"name", "principal"?, "rate"?, "tenure_months"?,
+                   "prepayments": [{"month", "amount"}], "rate_changes": [{"month", "rate"}]}]
+    """
+    d = request.json or {}
+    try:
+        if d.get('loan_id'):
+            loan = _owned_loan(int(d['loan_id']))
+            if not loan:
+                return jsonify({'error': 'Loan not found'}), 404
+            base = {'principal': float(loan['principal']), 'rate': float(loan['rate']),
+                    'tenure_months': int(loan['tenure'])}
+        else:
+            base = {'principal': float(d['principal']), 'rate': float(d['rate']),
+                    'tenure_months': int(d['tenure_months'])}
+        scenarios = d.get('scenarios') or []
+        if len(scenarios) > WHAT_IF_MAX_SCENARIOS:
+            return jsonify({'error': f'At most {WHAT_IF_MAX_SCENARIOS} scenarios'}), 400
+
+        runs = [dict(base, name='Current plan')]
+        prepayments, rate_changes = {}, {}
+        for i, sc in enumerate(scenarios, start=1):
+            run = {'name': sc.get('name') or f'Scenario {i}',
+                   'principal': float(sc.get('principal', base['principal'])),
+                   'rate': float(sc.get('rate', base['rate'])),
+                   'tenure_months': int(sc.get('tenure_months', base['tenure_months']))}
+            prepayments[i] = {int(p['month']): float(p['amount']) for p in sc.get('prepayments', [])}
+            rate_changes[i] = {int(c['month']): float(c['rate']) for c in sc.get('rate_changes', [])}
+            runs.append(run)
+        for run in runs:
+            if run['principal'] <= 0 or not 0 < run['tenure_months'] <= 600 or run['rate'] < 0:
+                raise ValueError(f"{run['name']}: principal, rate or tenure out of range")
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid what-if request: {e}'}), 400
+
+    result = amortization.schedules([r['principal'] for r in runs], [r['rate'] for r in runs],
+                                    [r['tenure_months'] for r in runs],
+                                    prepayments=prepayments, rate_changes=rate_changes)
+    totals = amortization.summarize(result)
+    base_interest, base_months = totals['total_interest'][0], totals['months'][0]
+    return jsonify({'scenarios': [{
+        'name': run['name'],
+        'emi': round(float(result['emi'][i]), 2),
+        'total_interest': round(float(totals['total_interest'][i]), 2),
+        'total_paid': round(float(totals['total_paid'][i]), 2),
+        'months': int(totals['months'][i]),
+        'interest_saved': round(float(base_interest - totals['total_interest'][i]), 2),
+        'months_saved': int(base_months - totals['months'][i]),
+    } for i, run in enumerate(runs)]})
+
+# ─────────────────────────────────────────────────────────────
+# UPCOMING DUES
+# ─────────────────────────────────────────────────────────────
+@routes_bp.route('/api/upcoming')
+@login_required
+@conditional
+def get_upcoming():
+    """
+    Bills, subscriptions and loan EMIs due in the next `days` days (default
+    30, max 366), soonest first; overdue ones come first with days_left < 0.
+    """
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        return jsonify({'error': 'days must be a number'}), 400
+    days = min(max(days, 0), 366)
+    rows = upcoming.due_within(uid(), days)
+    return jsonify({'days': days, 'items': rows,
+                    'total': round(sum(float(r['amount'] or 0) for r in rows), 2)})
+
+# ─────────────────────────────────────────────────────────────
+# BANK STATEMENT IMPORT
+# ─────────────────────────────────────────────────────────────
+@routes_bp.route('/api/bank-import', methods=['POST'])
+@login_required
+def bank_import():
+    """
+    Import an uploaded CSV/OFX statement (form field `file`) into BankTransactions.
+    Every batch commits as it goes: after a bad line the batches before it stay
+    imported, and uploading the corrected file skips them.
+    """
+    upload = request.files.get('file')
+    if not upload:
+        return jsonify({'error': 'No statement file uploaded'}), 400
+    lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', errors='replace', newline='')
+    first = next(lines, '')
+    fmt = request.form.get('format') or detect_format(first, upload.filename or '')
+    try:
+        with own_transactions():
+            result = import_statement(uid(), itertools.chain([first], lines), fmt)
+    except StatementError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'status': 'ok', **result})
+
+# ─────────────────────────────────────────────────────────────
+# EXPORT
+# ─────────────────────────────────────────────────────────────
+@routes_bp.route('/api/export')
+@login_required
+def export_history():
+    """
+    Stream the user's full history as a download.
+    Query args: format=jsonl|csv, table=<name> (repeatable; CSV takes one), gzip=1.
+    """
+    fmt      = request.args.get('format', 'jsonl')
+    tables   = request.args.getlist('table') or None
+    compress = request.args.get('gzip') == '1'
+    try:
+        chunks = export_chunks(uid(), fmt, tables, compress)
+        first = next(chunks, b'')    # opens the stream now, so a busy server can still answer 503
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except StreamsBusy as e:
+        return jsonify({'error': str(e)}), 503
+    if compress:
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = export_filename(fmt, tables, compress)
+    return Response(stream_with_context(itertools.chain([first], chunks)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 # ─────────────────────────────────────────────────────────────
 # ADMIN ANALYTICS
@@ -877,30 +945,36 @@ def admin_stats_page():
 
 @routes_bp.route('/api/admin/stats')
 def api_admin_stats():
-    total_users = query("SELECT COUNT(*) as count FROM Users", fetch=True)[0]['count']
-    users_by_date = query(
-        "SELECT DATE(created_at) as date, COUNT(*) as count FROM Users GROUP BY DATE(created_at) ORDER BY date DESC LIMIT 30",
-        fetch=True
-    )
-    all_users = query(
-        """SELECT u.id, u.name, u.email, u.created_at, u.last_login,
-            (SELECT COUNT(*) FROM Transactions WHERE user_id=u.id) as transaction_count,
-            (SELECT COUNT(*) FROM LoginHistory WHERE user_id=u.id) as login_count
-           FROM Users u ORDER BY u.last_login DESC""",
-        fetch=True
-    )
-    for user in all_users:
-        user['created_at'] = str(user['created_at']) if user['created_at'] else 'N/A'
-        user['last_login'] = str(user['last_login']) if user['last_login'] else 'Never'
-    return jsonify({'total_users': total_users, 'users_by_date': users_by_date, 'all_users': all_users})
+    """
+    One keyset page of users. Query args: sort (last_login, created_at, name,
+    logins), order (asc/desc), q (email or name prefix), limit (max 200), cursor.
+    The first page (no cursor) also carries the headline numbers.
+    """
+    a = request.args
+    try:
+        limit = min(max(int(a.get('limit', 50)), 1), 200)
+        users, next_cursor = admin.list_users(
+            cursor=a.get('cursor'), limit=limit, sort=a.get('sort', 'last_login'),
+            desc=a.get('order', 'desc') != 'asc', search=a.get('q', '').strip() or None,
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    body = {'users': users, 'next_cursor': next_cursor}
+    if not a.get('cursor'):
+        body.update(admin.summary())
+    return jsonify(body)
+
+LOGIN_HISTORY_SQL = """
+    SELECT id, login_time, ip_address FROM LoginHistory
+    WHERE user_id=%s ORDER BY login_time DESC LIMIT 50
+"""
 
 @routes_bp.route('/api/admin/login-history/<int:user_id>')
 def api_admin_login_history(user_id):
-    logins = query(
-        """SELECT id, login_time, ip_address FROM LoginHistory
-           WHERE user_id=%s ORDER BY login_time DESC LIMIT 50""",
-        (user_id,), fetch=True
-    )
-    for login in logins:
-        login['login_time'] = str(login['login_time'])
-    return jsonify(logins)
\ No newline at end of file
+    logins = query(LOGIN_HISTORY_SQL, (user_id,), fetch=True)
+    return jsonify(logins)
+
+@routes_bp.route('/api/admin/password-pool')
+def api_admin_password_pool():
+    """Queue depth and timings of this worker's bcrypt pool."""
+    return jsonify(password_pool_stats())
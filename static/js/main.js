@@ -5,8 +5,11 @@
 const MM = {
   fmt: (n) => '₹' + Number(n).toLocaleString('en-IN', { minimumFractionDigits: 2 }),
 
+  // Cached API views carry an ETag and "Cache-Control: private, no-cache":
+  // the browser's HTTP cache keeps the body across page loads and revalidates
+  // it with If-None-Match, so an unchanged view costs a 304, not a download.
   async get(url) {
-    const r = await fetch(url);
+    const r = await fetch(url, { cache: 'no-cache' });
     if (!r.ok) {
       const err = await r.json().catch(() => ({ error: r.statusText }));
       throw new Error(err.error || `HTTP ${r.status}`);
@@ -0,0 +1,28 @@
+"""OFX parsing in bank_import: account-qualified FITIDs and cut-short files."""
+import pytest
+
+from bank_import import StatementError, parse_ofx
+
+STATEMENT = """OFXHEADER:100
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS>
+<BANKACCTFROM><BANKID>123<ACCTID>9</BANKACCTFROM>
+<BANKTRANLIST>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20240105<TRNAMT>-10.00<FITID>A1<NAME>Shop</STMTTRN>
+</BANKTRANLIST></STMTRS>
+<STMTRS><CCACCTFROM><ACCTID>CC1</CCACCTFROM>
+<BANKTRANLIST><STMTTRN><DTPOSTED>20240107<TRNAMT>3<FITID>A1<NAME>Refund</STMTTRN></BANKTRANLIST>
+</STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+def test_the_same_fitid_in_two_accounts_gives_two_keys():
+    rows = list(parse_ofx(STATEMENT.splitlines(True)))
+    assert [(r[2], r[4], r[5]) for r in rows] == [('Shop', 'debit', '123|9|A1'), ('Refund', 'credit', '|CC1|A1')]
+
+
+def test_a_transaction_left_open_at_the_end_is_reported():
+    cut = STATEMENT.split('<STMTTRN><DTPOSTED>20240107')[0] + '<STMTTRN><DTPOSTED>20240107<TRNAMT>3\n'
+    rows = parse_ofx(cut.splitlines(True))
+    assert next(rows)[5] == '123|9|A1'
+    with pytest.raises(StatementError, match='line 8'):
+        next(rows)
@@ -0,0 +1,21 @@
+"""
+The route queries and their indexes (models.indexed_queries). EXPLAIN needs
+a MySQL server holding the schema: set DB_HOST and DB_NAME to a scratch
+database that `flask db migrate` has been run against, otherwise that test
+is skipped.
+"""
+import pytest
+
+import config
+import models
+
+
+def test_sample_parameters_fit_each_query():
+    for label, sql, params in models.indexed_queries():
+        assert sql.count('%s') == len(params), label
+
+
+@pytest.mark.skipif(not config.DB_FROM_ENV, reason='DB_HOST/DB_NAME not set to a test database')
+def test_route_queries_use_indexes():
+    assert models.pending_migrations() == [], 'run `flask --app app db migrate` on the test database'
+    assert models.unindexed_queries() == []
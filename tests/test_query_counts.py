@@ -0,0 +1,116 @@
+"""
+Statements each hot route sends (commands.QUERY_BUDGETS), counted with
+database.count_queries against a fake connection, so an N+1 regression
+fails here rather than in production. The fake answers every SELECT with
+no rows except the user's categories, which keeps the lazy seeding of
+defaults out of the counts.
+"""
+import pytest
+
+import cache
+import commands
+import database
+from app import app
+from database import count_queries
+
+CATEGORY = {'id': 1, 'user_id': 1, 'name': 'Salary', 'type': 'income'}
+
+
+class FakeCursor:
+    categories = [CATEGORY]
+
+    def __init__(self, dictionary=False, **kwargs):
+        self.dictionary = dictionary
+        self.rows = []
+        self.lastrowid = 1
+        self.rowcount = 0
+        self.with_rows = False
+
+    def execute(self, sql, params=()):
+        self.rows = []
+        if sql.lstrip().startswith('SELECT * FROM Categories'):
+            self.rows = [c if self.dictionary else tuple(c.values()) for c in self.categories]
+        self.with_rows = sql.lstrip().startswith(('SELECT', '('))
+
+    def executemany(self, sql, rows):
+        pass
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    in_transaction = False
+
+    def cursor(self, **kwargs):
+        return FakeCursor(**kwargs)
+
+    def ping(self, **kwargs):
+        pass
+
+    def start_transaction(self):
+        self.in_transaction = True
+
+    def commit(self):
+        self.in_transaction = False
+
+    def rollback(self):
+        self.in_transaction = False
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(database, 'get_db', FakeConnection)
+    monkeypatch.setattr(database, 'pool', database.ConnectionPool())
+    cache.backend.clear()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    return client
+
+
+@pytest.mark.parametrize('path, budget', commands.QUERY_BUDGETS)
+def test_uncached_get_sends_its_budget(client, path, budget):
+    with app.app_context():
+        cache.invalidate(1)
+    with count_queries() as n:
+        assert client.get(path).status_code == 200
+    assert n.count <= budget, f'{path} sent {n.count} statements, budget {budget}'
+
+
+def test_cached_get_only_reads_versions(client):
+    client.get('/api/dashboard')
+    with count_queries() as n:
+        assert client.get('/api/dashboard').status_code == 200
+    assert n.count <= 2
+
+
+def test_unchanged_data_gets_a_304_for_one_version_read(client):
+    tag = client.get('/api/bills').headers['ETag']
+    with count_queries() as n:
+        assert client.get('/api/bills', headers={'If-None-Match': tag}).status_code == 304
+    assert n.count == 1
+
+
+def test_seeding_defaults_on_a_first_visit_bumps_the_data_version(client, monkeypatch):
+    monkeypatch.setattr(FakeCursor, 'categories', [])
+    bumped = []
+    monkeypatch.setattr(cache, 'invalidate', bumped.append)
+    assert client.get('/api/categories').status_code == 200
+    assert bumped == [1]
+
+
+def test_check_queries_command(client):
+    result = app.test_cli_runner().invoke(args=['db', 'check-queries', '1'])
+    assert result.exit_code == 0, result.output
+
@@ -0,0 +1,227 @@
+"""
+recurring.py on a simulated clock. The database side of posting is an
+in-memory fake (items, transactions, RecurringPostings with its unique
+key, UpcomingDues), so years of days run in well under a second and no
+MySQL server is touched.
+"""
+import random
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import pytest
+from mysql.connector import IntegrityError
+
+import recurring
+
+
+class FakeDB:
+    def __init__(self):
+        self.items = {kind: {} for kind in recurring.KINDS}    # kind → {id: item}
+        self.transactions = {}                                 # id → (user_id, cat, type, amount, note, date)
+        self.markers = {}                                      # (kind, item_id, period) → transaction id
+        self.dues = {}                                         # (kind, item_id) → due date
+        self.invalidated = []
+
+    def add_item(self, kind, user_id, day_of_month, created_at, name=None, amount=10):
+        items = self.items[kind]
+        item_id = len(items) + 1
+        items[item_id] = {'id': item_id, 'user_id': user_id, 'name': name or f'{kind} {item_id}',
+                          'amount': amount, recurring.KINDS[kind][1]: day_of_month, 'created_at': created_at}
+        return items[item_id]
+
+    # What the SQL does, row by row
+    def due_batch(self, kind, day, after_id, limit, user_id=None):
+        column = recurring.KINDS[kind][1]
+        lo, hi = recurring.day_bucket(day)
+        end_of_day = datetime.combine(day + timedelta(days=1), datetime.min.time())
+        rows = [(i['id'], i['user_id'], i['name'], i['amount'], i[column])
+                for i in sorted(self.items[kind].values(), key=lambda i: i['id'])
+                if lo <= i[column] <= hi and i['created_at'] < end_of_day and i['id'] > after_id
+                and (kind, i['id'], recurring.period(day)) not in self.markers
+                and (user_id is None or i['user_id'] == user_id)]
+        return rows[:limit]
+
+    def add_many(self, rows):
+        ids = []
+        for row in rows:
+            ids.append(len(self.transactions) + 1)
+            self.transactions[ids[-1]] = tuple(row)
+        return ids
+
+    def add_transaction(self, user_id, category_id, type_, amount, note, day):
+        return self.add_many([(user_id, category_id, type_, amount, note, day)])[0]
+
+    def insert_markers(self, sql, rows):
+        assert sql == recurring.MARKER_SQL
+        for kind, item_id, period, _, tid in rows:
+            if (kind, item_id, period) in self.markers:
+                raise IntegrityError(msg=f"Duplicate entry '{kind}-{item_id}-{period}'")
+            self.markers[(kind, item_id, period)] = tid
+
+    def query(self, sql, params=None, **kwargs):
+        if sql.startswith("SELECT due_date FROM UpcomingDues"):
+            return self.dues.get(params)
+        self.insert_markers(sql, [params])
+
+    def advance(self, rows):
+        for kind, item_id, _, _, _, due_date in rows:
+            self.dues[(kind, item_id)] = max(due_date, self.dues.get((kind, item_id), due_date))
+
+    @contextmanager
+    def transaction(self):
+        saved = dict(self.transactions), dict(self.markers), dict(self.dues)
+        try:
+            yield
+        except Exception:
+            self.transactions, self.markers, self.dues = saved
+            raise
+
+    def postings(self, kind, item_id):
+        """{period: transaction date} of one item."""
+        return {p: self.transactions[tid][5] for (k, i, p), tid in self.markers.items() if (k, i) == (kind, item_id)}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(recurring, '_due_batch', fake.due_batch)
+    monkeypatch.setattr(recurring, '_category_ids', lambda name, user_ids: {u: 100 + u for u in user_ids})
+    monkeypatch.setattr(recurring, 'transaction', fake.transaction)
+    monkeypatch.setattr(recurring, 'query', fake.query)
+    monkeypatch.setattr(recurring, 'query_many', fake.insert_markers)
+    monkeypatch.setattr(recurring, 'invalidate', fake.invalidated.append)
+    monkeypatch.setattr(recurring.ledger, 'add_many', fake.add_many)
+    monkeypatch.setattr(recurring.ledger, 'add_transaction', fake.add_transaction)
+    monkeypatch.setattr(recurring.upcoming, 'advance', fake.advance)
+    return fake
+
+
+def months_between(start, end):
+    return (end.year - start.year) * 12 + end.month - start.month
+
+
+# ─────────────────────────────────────────────────────────────
+# CALENDAR
+# ─────────────────────────────────────────────────────────────
+def test_every_day_of_the_month_comes_due_once_a_month():
+    seen = {}
+    day = date(2020, 1, 1)
+    while day < date(2028, 1, 1):
+        lo, hi = recurring.day_bucket(day)
+        for dom in range(lo, hi + 1):
+            key = (dom, recurring.period(day))
+            assert key not in seen, f'day {dom} due twice in {key[1]}'
+            seen[key] = day
+            assert day == recurring.occurrence(dom, day.year, day.month)
+        day += timedelta(days=1)
+    assert len(seen) == 31 * 12 * 8
+
+
+def test_nearest_occurrence():
+    assert recurring.nearest_occurrence(5, date(2025, 10, 2)) == date(2025, 10, 5)
+    assert recurring.nearest_occurrence(28, date(2025, 10, 2)) == date(2025, 9, 28)
+    assert recurring.nearest_occurrence(1, date(2025, 12, 30)) == date(2026, 1, 1)
+    assert recurring.nearest_occurrence(31, date(2024, 3, 2)) == date(2024, 2, 29)
+
+
+# ─────────────────────────────────────────────────────────────
+# POSTING
+# ─────────────────────────────────────────────────────────────
+def test_years_of_runs_post_each_item_once_a_month_on_its_day(db):
+    start, end = date(2020, 1, 1), date(2025, 1, 1)
+    for dom in range(1, 32):
+        db.add_item('bill', 1, dom, datetime(2020, 1, 1))
+        db.add_item('subscription', 2, dom, datetime(2020, 1, 1))
+
+    # Random double runs, and random outages of fewer days than the lookback
+    rnd, day, outage = random.Random(5), start, 0
+    while day < end:
+        if outage:
+            outage -= 1
+        else:
+            for _ in range(2 if rnd.random() < 0.1 else 1):
+                recurring.run(day)
+            if rnd.random() < 0.03:
+                outage = rnd.randrange(1, recurring.RECURRING_LOOKBACK_DAYS)
+        day += timedelta(days=1)
+    recurring.run(end - timedelta(days=1))
+
+    months = months_between(start, end)
+    assert len(db.transactions) == len(db.markers) == 2 * 31 * months
+    for kind, items in db.items.items():
+        column = recurring.KINDS[kind][1]
+        for item in items.values():
+            posted = db.postings(kind, item['id'])
+            assert len(posted) == months
+            for p, day in posted.items():
+                assert day == recurring.occurrence(item[column], *map(int, p.split('-')))
+            assert db.dues[(kind, item['id'])] == recurring.occurrence(item[column], end.year, 1)
+    assert set(db.invalidated) == {1, 2}
+
+
+def test_batches_smaller_than_the_due_items(db):
+    for n in range(25):
+        db.add_item('bill', n % 3 + 1, 10, datetime(2024, 1, 1))
+    assert recurring.post_day(date(2024, 2, 10), batch_size=7) == 25
+    assert recurring.post_day(date(2024, 2, 10), batch_size=7) == 0
+
+
+def test_items_are_not_posted_for_days_before_they_were_added(db):
+    bill = db.add_item('bill', 1, 5, datetime(2024, 3, 6, 9, 30))
+    same_day = db.add_item('subscription', 1, 6, datetime(2024, 3, 6, 9, 30))
+    # The catch-up on March 7 covers the 5th and the 6th
+    recurring.run(date(2024, 3, 7), days=3)
+    assert db.postings('bill', bill['id']) == {}
+    assert db.postings('subscription', same_day['id']) == {'2024-03': date(2024, 3, 6)}
+    recurring.run(date(2024, 4, 5))
+    assert db.postings('bill', bill['id']) == {'2024-04': date(2024, 4, 5)}
+
+
+def test_run_for_one_user(db):
+    mine = db.add_item('bill', 1, 3, datetime(2024, 1, 1))
+    theirs = db.add_item('bill', 2, 3, datetime(2024, 1, 1))
+    assert recurring.run(date(2024, 2, 3), user_id=1) == 1
+    assert db.postings('bill', mine['id']) and not db.postings('bill', theirs['id'])
+    assert db.invalidated == [1]
+
+
+def test_a_batch_another_runner_got_to_first_is_rolled_back(db, monkeypatch):
+    bill = db.add_item('bill', 1, 3, datetime(2024, 1, 1))
+    db.add_item('bill', 1, 3, datetime(2024, 1, 1))
+    batches = [db.due_batch('bill', date(2024, 2, 3), 0, 10)]
+    db.markers[('bill', bill['id'], '2024-02')] = 0     # posted between our read and our insert
+    monkeypatch.setattr(recurring, '_due_batch', lambda *args: batches.pop() if batches else [])
+    assert recurring.post_day(date(2024, 2, 3)) == 0
+    assert db.transactions == {} and len(db.markers) == 1
+
+
+# ─────────────────────────────────────────────────────────────
+# PAY BUTTONS
+# ─────────────────────────────────────────────────────────────
+def test_paying_late_settles_the_month_that_was_due(db):
+    bill = db.add_item('bill', 1, 5, datetime(2024, 8, 1))
+    db.dues[('bill', bill['id'])] = date(2024, 9, 5)     # September not posted: the poster was down
+    recurring.pay_now('bill', bill, 1, date(2024, 10, 2), 101)
+    assert db.postings('bill', bill['id']) == {'2024-09': date(2024, 10, 2)}
+    assert db.dues[('bill', bill['id'])] == date(2024, 10, 5)
+    recurring.run(date(2024, 10, 5))
+    assert db.postings('bill', bill['id']) == {'2024-09': date(2024, 10, 2), '2024-10': date(2024, 10, 5)}
+
+
+def test_paying_early_is_not_charged_again(db):
+    sub = db.add_item('subscription', 1, 1, datetime(2024, 8, 1))
+    db.dues[('subscription', sub['id'])] = date(2024, 10, 1)
+    recurring.pay_now('subscription', sub, 1, date(2024, 9, 30), 101)
+    recurring.run(date(2024, 10, 1))
+    assert db.postings('subscription', sub['id']) == {'2024-10': date(2024, 9, 30)}
+    assert len(db.transactions) == 1
+    db.dues[('subscription', sub['id'])] = date(2024, 10, 1)     # a stale entry still on October
+    with pytest.raises(recurring.AlreadyPosted):
+        recurring.pay_now('subscription', sub, 1, date(2024, 10, 1), 101)
+    assert len(db.transactions) == 1
+
+
+def test_paying_without_an_upcoming_entry_takes_the_nearest_month(db):
+    bill = db.add_item('bill', 1, 28, datetime(2024, 8, 1))
+    recurring.pay_now('bill', bill, 1, date(2024, 10, 2), 101)
+    assert db.postings('bill', bill['id']) == {'2024-09': date(2024, 10, 2)}
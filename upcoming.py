@@ -0,0 +1,139 @@
+from datetime import date, timedelta
+
+from database import query, query_many, transaction
+import recurring
+
+# UpcomingDues holds the next due date of every bill, subscription and loan,
+# indexed by (user_id, due_date). "What is due in the next N days" is then
+# one range read on that index rather than three table scans with dates
+# recomputed per row. The writers keep it current:
+#   - bills/subscriptions: set on add, moved to the next month when a month
+#     is posted (pay button or recurring.post_day), removed on delete
+#   - loans: follows LoanState.next_due (loans.py), removed once paid off
+# rebuild() recomputes it from the source tables.
+#
+# A subscription renews by itself, so one whose day has passed before the
+# poster ran (`flask recurring post` from cron, or RECURRING_SCHEDULER) is
+# shown at its next renewal rather than as overdue.
+
+UPSERT_SQL = """
+    INSERT INTO UpcomingDues (kind, item_id, user_id, name, amount, due_date)
+    VALUES (%s,%s,%s,%s,%s,%s)
+    ON DUPLICATE KEY UPDATE user_id=VALUES(user_id), name=VALUES(name),
+                            amount=VALUES(amount), due_date=VALUES(due_date)
+"""
+
+DUE_WITHIN_SQL = """
+    SELECT u.kind, u.item_id, u.name, u.amount, u.due_date, s.renewal_day
+    FROM UpcomingDues u
+    LEFT JOIN Subscriptions s ON u.kind='subscription' AND s.id=u.item_id
+    WHERE u.user_id=%s AND u.due_date <= %s
+    ORDER BY u.due_date, u.kind, u.item_id
+"""
+
+ADVANCE_SQL = """
+    INSERT INTO UpcomingDues (kind, item_id, user_id, name, amount, due_date)
+    VALUES (%s,%s,%s,%s,%s,%s)
+    ON DUPLICATE KEY UPDATE due_date=GREATEST(due_date, VALUES(due_date))
+"""
+
+
+def first_due(day_of_month, today=None):
+    """A new monthly item's first due date: this month's day if not past yet, else next month's."""
+    today = today or date.today()
+    this_month = recurring.occurrence(day_of_month, today.year, today.month)
+    return this_month if this_month >= today else recurring.next_occurrence(day_of_month, today)
+
+
+def after_period(day_of_month, period):
+    """Due date in the month after `period` ('YYYY-MM'), once that month has been posted."""
+    year, month = map(int, period.split('-'))
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return recurring.occurrence(day_of_month, year, month)
+
+
+# ─────────────────────────────────────────────────────────────
+# WRITES
+# ─────────────────────────────────────────────────────────────
+def set_due(kind, item_id, user_id, name, amount, due_date):
+    """Insert or move one item's entry; a due_date of None removes it."""
+    if due_date is None:
+        return remove(kind, item_id, user_id)
+    query(UPSERT_SQL, (kind, item_id, user_id, name, amount, due_date))
+
+
+def set_many(rows):
+    """set_due() for many items: [(kind, item_id, user_id, name, amount, due_date)]."""
+    query_many(UPSERT_SQL, rows)
+
+
+def advance(rows):
+    """
+    Move items whose month has just been posted to their next due date:
+    [(kind, item_id, user_id, name, amount, due_date)]. Never moves one
+    back (paying an old month late leaves a later due date alone).
+    """
+    query_many(ADVANCE_SQL, rows)
+
+
+def remove(kind, item_id, user_id):
+    query("DELETE FROM UpcomingDues WHERE kind=%s AND item_id=%s AND user_id=%s", (kind, item_id, user_id))
+
+
+# ─────────────────────────────────────────────────────────────
+# READS
+# ─────────────────────────────────────────────────────────────
+def due_within(user_id, days=30, today=None):
+    """
+    Everything of the user's due up to `days` days from today, soonest
+    first – overdue items included (negative days_left).
+    """
+    today = today or date.today()
+    horizon = today + timedelta(days=days)
+    rows = query(DUE_WITHIN_SQL, (user_id, horizon), fetch=True, prepared=True)
+    rolled = False
+    for r in rows:
+        renewal_day = r.pop('renewal_day')
+        if renewal_day is not None and r['due_date'] < today:
+            r['due_date'], rolled = first_due(renewal_day, today), True
+    if rolled:
+        rows = sorted((r for r in rows if r['due_date'] <= horizon),
+                      key=lambda r: (r['due_date'], r['kind'], r['item_id']))
+    for r in rows:
+        r['days_left'] = (r['due_date'] - today).days
+    return rows
+
+
+# ─────────────────────────────────────────────────────────────
+# MAINTENANCE
+# ─────────────────────────────────────────────────────────────
+def rebuild(user_id=None, today=None):
+    """Recompute UpcomingDues from Bills, Subscriptions and LoanState (all users, or one)."""
+    today = today or date.today()
+    current = recurring.period(today)
+    where, params = ("WHERE x.user_id=%s", (user_id,)) if user_id else ("", ())
+    rows = []
+    for kind, (table, column, _, _) in recurring.KINDS.items():
+        items = query(
+            f"""SELECT x.id, x.user_id, x.name, x.amount, x.{column}, p.item_id IS NOT NULL
+                FROM {table} x
+                LEFT JOIN RecurringPostings p ON p.kind=%s AND p.item_id=x.id AND p.period=%s
+                {where}""",
+            (kind, current) + params, fetch='tuples'
+        )
+        rows += [(kind, item_id, uid_, name, amount,
+                  after_period(dom, current) if posted else first_due(dom, today))
+                 for item_id, uid_, name, amount, dom, posted in items]
+    rows += query(
+        f"""SELECT 'loan', x.id, x.user_id, x.loan_name, x.emi, s.next_due
+            FROM Loans x JOIN LoanState s ON s.loan_id=x.id
+            {where + (' AND' if where else 'WHERE')} s.next_due IS NOT NULL""",
+        params, fetch='tuples'
+    )
+    with transaction():
+        if user_id:
+            query("DELETE FROM UpcomingDues WHERE user_id=%s", (user_id,))
+        else:
+            query("DELETE FROM UpcomingDues")
+        set_many(rows)
+    return len(rows)